@@ -1,8 +1,8 @@
 import datetime
 
-from collections import defaultdict
-from django.core.cache import cache
-from finance.accounts.models import Account, AccountType
+from django.db.models import Sum
+from finance.accounts.models import AccountType, MonthlyBalance
+from finance.core.cache import get_or_set
 
 
 def get_months(year):
@@ -20,60 +20,76 @@ def get_monthly_totals(profile, debits=True):
     """Totals for the accounts broken into the months
     of the selected year
     """
-    cache_key = "{p.pk}-{p.year}-monthly-totals-{t}".format(
-        p=profile,
-        t="debits" if debits else "credits"
+    year = int(profile.year)
+    months = get_months(year)
+    return get_or_set(
+        profile.pk,
+        "monthly-totals-{0}-{1}".format("debits" if debits else "credits",
+                                        len(months)),
+        lambda: calculate_monthly_totals(profile, months, debits),
+        year
     )
-    if debits:
-        accounts = Account.objects.filter(profile=profile).debits()
-    else:
-        accounts = Account.objects.filter(profile=profile).credits()
-    monthly_accounts = cache.get(cache_key)
-    if monthly_accounts is None:
-        monthly_accounts = defaultdict(dict)
-        month_account_covered = []
-        months = get_months(profile.year)
-        for month in months:
-            for acct in accounts:
-                for trx in acct.transactions(month=month):
-                    if trx.date.month not in monthly_accounts:
-                        monthly_accounts[trx.date.month] = []
-                    if (month, acct.name) not in month_account_covered:
-                        month_account_covered.append((month, acct.name))
-                        monthly_accounts[trx.date.month].append(
-                            {"label": acct.name, "balance": trx.balance}
-                        )
-            if month in monthly_accounts.keys():
-                monthly_accounts[month].sort(key=lambda d: d["balance"])
-        cache.add(cache_key, monthly_accounts)
+
+
+def calculate_monthly_totals(profile, months, debits=True):
+    """Monthly totals of the yearly accounts, read from the monthly rollup"""
+    monthly_accounts = {}
+    if not months:
+        return monthly_accounts
+    rows = MonthlyBalance.objects.filter(
+        profile_id=profile.pk,
+        year=profile.year,
+        month__in=months,
+        transactions__gt=0,
+        account__account_type__yearly=True,
+        account__account_type__default_type="DEBIT" if debits else "CREDIT"
+    ).values_list("month", "account__name", "amount")
+    for month, name, balance in rows:
+        monthly_accounts.setdefault(month, []).append(
+            {"label": name, "balance": balance}
+        )
+    for accounts in monthly_accounts.values():
+        accounts.sort(key=lambda d: (d["balance"], d["label"]))
     return monthly_accounts
 
 
 def get_debits_title(profile):
-    return "/".join([x.name for x in AccountType.objects.filter(
-        profile=profile
-    ).debits()])
+    return get_or_set(profile.pk, "debits-title", lambda: "/".join(
+        [x.name for x in AccountType.objects.filter(
+            profile_id=profile.pk
+        ).debits()]
+    ))
 
 
 def get_credits_title(profile):
-    return "/".join([x.name for x in AccountType.objects.filter(
-        profile=profile
-    ).credits()])
+    return get_or_set(profile.pk, "credits-title", lambda: "/".join(
+        [x.name for x in AccountType.objects.filter(
+            profile_id=profile.pk
+        ).credits()]
+    ))
 
 
 def get_monthly_debits_vs_credits(profile):
-    cache_key = "{p.pk}-{p.year}-debits-vs-credits".format(p=profile)
-    monthly_debits = get_monthly_totals(profile)
-    monthly_credits = get_monthly_totals(profile, False)
-    months = get_months(profile.year)
-    monthly_totals = cache.get(cache_key)
-    if monthly_totals is None:
-        monthly_totals = []
-        for month in months:
-            debits = monthly_debits.get(month, [])
-            debit_total = sum([x.get("balance", 0) for x in debits])
-            credits = monthly_credits.get(month, [])
-            credit_total = sum([x.get("balance", 0) for x in credits])
-            monthly_totals.append((month, debit_total + credit_total))
-        cache.add(cache_key, monthly_totals)
-    return monthly_totals
+    year = int(profile.year)
+    months = get_months(year)
+    return get_or_set(
+        profile.pk,
+        "debits-vs-credits-{0}".format(len(months)),
+        lambda: calculate_debits_vs_credits(profile, months),
+        year
+    )
+
+
+def calculate_debits_vs_credits(profile, months):
+    if not months:
+        return []
+    totals = dict(MonthlyBalance.objects.filter(
+        profile_id=profile.pk,
+        year=profile.year,
+        month__in=months,
+        account__account_type__yearly=True,
+        account__account_type__default_type__in=["DEBIT", "CREDIT"]
+    ).order_by().values("month").annotate(
+        total=Sum("amount")
+    ).values_list("month", "total"))
+    return [(month, totals.get(month, 0)) for month in months]
@@ -1,12 +1,18 @@
 import os
-import uuid
+import tempfile
 
 from django import forms
 from django.conf import settings
+from django.core.urlresolvers import reverse
 from django.forms.formsets import formset_factory, BaseFormSet
+from django.forms.models import modelformset_factory, BaseModelFormSet
+from django.forms.utils import flatatt
+from django.utils.encoding import force_text
+from django.utils.html import format_html
 from finance.accounts.models import (AccountType, Transaction,
-                                     Account)
-from finance.accounts.trx_import import TransactionsImport
+                                     Account, ImportJob, ImportRow)
+from finance.accounts.search import get_account_index
+from finance.accounts.trx_import import get_file_type, run_import_job
 from finance.accounts.utils import (get_account_choices,
                                     get_account_type_choices)
 from finance.core.utils import get_year_choices
@@ -36,10 +42,12 @@ class AccountForm(forms.ModelForm):
         fields = ["name", "description", "account_type", "parent",
                   "is_category"]
 
-    def __init__(self, user, *args, **kwargs):
+    def __init__(self, profile, *args, **kwargs):
         super(AccountForm, self).__init__(*args, **kwargs)
-        self.fields["account_type"].choices = get_account_type_choices(user)
-        self.fields["parent"].choices = get_account_choices(user, True)
+        self.fields["account_type"].choices = get_account_type_choices(
+            profile
+        )
+        self.fields["parent"].choices = get_account_choices(profile, True)
 
 
 class TransactionImportForm(forms.Form):
@@ -48,23 +56,50 @@ class TransactionImportForm(forms.Form):
     year = forms.ChoiceField(required=False)
 
     def __init__(self, *args, **kwargs):
-        self.user = kwargs.pop("user")
+        self.profile = kwargs.pop("profile")
         super(TransactionImportForm, self).__init__(*args, **kwargs)
-        self.fields["account_main"].choices = get_account_choices(self.user)
+        self.fields["account_main"].choices = get_account_choices(
+            self.profile
+        )
         self.fields["year"].choices = get_year_choices(True)
 
-    def process_file(self):
+    def save_file(self):
+        """Copy the upload to a temporary file in the imports directory
+        and return its name
+        """
         _, file_ext = os.path.splitext(self.files["filename"].name)
-        filename = "{0}/imports/{1}{2}".format(settings.MEDIA_ROOT,
-                                               uuid.uuid4(), file_ext)
-        with open(filename, "wb+") as destination:
+        directory = os.path.join(settings.MEDIA_ROOT, "imports")
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        fd, filename = tempfile.mkstemp(suffix=file_ext, dir=directory)
+        with os.fdopen(fd, "wb") as destination:
             for chunk in self.files["filename"].chunks():
                 destination.write(chunk)
-        parser = TransactionsImport(self.cleaned_data["account_main"],
-                                    filename,
-                                    year=self.cleaned_data.get("year"))
-        parser.parse_file()
-        return parser.transactions
+        return filename
+
+    def create_job(self):
+        """Import job for the upload
+
+        PDFs, which pdftotext needs as a file, and uploads larger than
+        ``settings.IMPORT_INLINE_MAX_SIZE`` are written to disk and left
+        for the import worker, so the request does not wait on them. Small
+        files of the other formats are parsed straight from the upload.
+        """
+        upload = self.files["filename"]
+        job = ImportJob(profile_id=self.profile.pk,
+                        account_id=self.cleaned_data["account_main"],
+                        year=self.cleaned_data.get("year") or None)
+        if (get_file_type(upload.name) == "PDF" or
+                upload.size > settings.IMPORT_INLINE_MAX_SIZE):
+            job.filename = self.save_file()
+            job.is_temporary = True
+            job.save()
+        else:
+            job.filename = upload.name
+            job.status = ImportJob.RUNNING
+            job.save()
+            run_import_job(job, upload)
+        return job
 
 
 class TransactionForm(forms.ModelForm):
@@ -73,24 +108,78 @@ class TransactionForm(forms.ModelForm):
         exclude = ["description"]
 
 
-class TransactionBaseFormSet(BaseFormSet):
+class AccountAutocompleteInput(forms.Widget):
+    """Account picker completed from the autocomplete endpoint
+
+    Only the pk of the selected account is part of the form, shown by its
+    label from ``labels``, so no list of accounts is sent with the page.
+    """
+    def __init__(self, attrs=None, labels=None):
+        super(AccountAutocompleteInput, self).__init__(attrs)
+        self.labels = {} if labels is None else labels
+
+    def render(self, name, value, attrs=None):
+        final_attrs = self.build_attrs(attrs, type="text", autocomplete="off")
+        final_attrs["class"] = " ".join(
+            [final_attrs.get("class", ""), "account-autocomplete"]
+        ).strip()
+        final_attrs["data-url"] = reverse("accounts.account.autocomplete")
+        try:
+            label = self.labels.get(int(value), "")
+        except (TypeError, ValueError):
+            label = ""
+        return format_html(
+            '<input type="hidden" name="{0}" value="{1}" />'
+            '<input{2} value="{3}" />',
+            name, "" if value is None else force_text(value),
+            flatatt(final_attrs), label
+        )
+
+
+class AccountWidgetsMixin(object):
+    """Formset whose forms pick the debit and credit accounts of the
+    profile with the autocomplete widget
+    """
     def __init__(self, *args, **kwargs):
-        self.user = kwargs.pop("user")
-        super(TransactionBaseFormSet, self).__init__(*args, **kwargs)
+        self.profile = kwargs.pop("profile")
+        super(AccountWidgetsMixin, self).__init__(*args, **kwargs)
+        # shared by all the forms, labelled from a single index lookup
+        self.account_widget = AccountAutocompleteInput(
+            labels=get_account_index(self.profile).labels
+        )
+        self.accounts = Account.objects.filter(profile_id=self.profile.pk)
 
     def _construct_form(self, i, **kwargs):
-        form = super(TransactionBaseFormSet, self)._construct_form(i, **kwargs)
-        account_choices = get_account_choices(self.user)
-        form.fields["account_debit"].choices = account_choices
-        form.fields["account_credit"].choices = account_choices
-        if "DELETE" in form.fields:
-            form.fields["DELETE"].label = "Duplicate"
+        form = super(AccountWidgetsMixin, self)._construct_form(i, **kwargs)
+        for name in ("account_debit", "account_credit"):
+            form.fields[name].widget = self.account_widget
+            form.fields[name].queryset = self.accounts
         return form
 
 
-TransactionImportFormSet = formset_factory(TransactionForm,
-                                           can_delete=True, extra=0,
-                                           formset=TransactionBaseFormSet)
+class TransactionBaseFormSet(AccountWidgetsMixin, BaseFormSet):
+    def save(self):
+        """Add the transactions of the filled in forms all at once"""
+        return Transaction.objects.add_all(
+            form.instance for form in self.forms if form.cleaned_data
+        )
+
 
 TransactionFormSet = formset_factory(TransactionForm, extra=5,
                                      formset=TransactionBaseFormSet)
+
+
+class ImportRowForm(forms.ModelForm):
+    class Meta:
+        model = ImportRow
+        fields = ["account_debit", "account_credit", "amount", "summary",
+                  "date", "is_duplicate"]
+
+
+class ImportRowBaseFormSet(AccountWidgetsMixin, BaseModelFormSet):
+    pass
+
+
+ImportRowFormSet = modelformset_factory(ImportRow, form=ImportRowForm,
+                                        formset=ImportRowBaseFormSet,
+                                        extra=0)
@@ -0,0 +1,49 @@
+import time
+
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+from finance.accounts.models import ImportJob
+from finance.accounts.trx_import import run_import_job
+
+# seconds between two purges of the old jobs
+PURGE_EVERY = 60 * 60
+
+
+class Command(BaseCommand):
+    help = "Run the pending transaction import jobs"
+
+    option_list = BaseCommand.option_list + (
+        make_option("--once", action="store_true", dest="once",
+                    default=False,
+                    help="Exit once there are no pending jobs"),
+        make_option("--interval", dest="interval", type="float", default=2,
+                    help="Seconds to wait between polls for new jobs"),
+        make_option("--timeout", dest="timeout", type="int", default=600,
+                    help="Seconds without progress after which a running "
+                         "job is taken to be abandoned by its worker"),
+        make_option("--max-age", dest="max_age", type="int", default=7,
+                    help="Days after which finished jobs, and the rows "
+                         "of those never confirmed, are deleted"),
+    )
+
+    def handle(self, *args, **options):
+        last_purge = None
+        while True:
+            if last_purge is None or time.time() - last_purge > PURGE_EVERY:
+                count = ImportJob.objects.purge(
+                    options["max_age"] * 24 * 60 * 60
+                )
+                if count:
+                    self.stdout.write("Purged {0} old import job(s)".format(
+                        count
+                    ))
+                last_purge = time.time()
+            job = ImportJob.objects.claim(options["timeout"])
+            if job is None:
+                if options["once"]:
+                    break
+                time.sleep(options["interval"])
+                continue
+            run_import_job(job)
+            self.stdout.write("Processed import job {0}".format(job.pk))
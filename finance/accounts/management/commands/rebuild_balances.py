@@ -0,0 +1,24 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+from finance.accounts.models import Account, AccountBalance, MonthlyBalance
+
+
+class Command(BaseCommand):
+    help = ("Recalculate the stored account balances and monthly totals "
+            "from the transactions")
+
+    option_list = BaseCommand.option_list + (
+        make_option("--profile", dest="profile", type="int",
+                    help="Only rebuild the balances of this profile"),
+    )
+
+    def handle(self, *args, **options):
+        accounts = Account.objects.all()
+        if options.get("profile") is not None:
+            accounts = accounts.filter(profile=options["profile"])
+        AccountBalance.objects.rebuild(accounts)
+        MonthlyBalance.objects.rebuild(accounts)
+        self.stdout.write("Rebuilt balances for {0} account(s)".format(
+            accounts.count()
+        ))
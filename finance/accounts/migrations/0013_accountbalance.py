@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from collections import defaultdict
+from decimal import Decimal
+from django.db import models, migrations
+
+
+def populate_balances(apps, schema_editor):
+    Account = apps.get_model("accounts", "Account")
+    AccountBalance = apps.get_model("accounts", "AccountBalance")
+    Transaction = apps.get_model("accounts", "Transaction")
+    parents = dict(Account.objects.values_list("pk", "parent"))
+    totals = defaultdict(Decimal)
+    for trx in Transaction.objects.values("account_debit", "account_credit",
+                                          "amount", "date"):
+        for account_id, amount in ((trx["account_debit"], trx["amount"]),
+                                   (trx["account_credit"], -trx["amount"])):
+            while account_id is not None:
+                totals[(account_id, trx["date"].year)] += amount
+                account_id = parents.get(account_id)
+    AccountBalance.objects.bulk_create([
+        AccountBalance(account_id=account_id, year=year, balance=balance)
+        for (account_id, year), balance in totals.items()
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0012_accounttype_yearly'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AccountBalance',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False,
+                                        auto_created=True, primary_key=True)),
+                ('year', models.IntegerField()),
+                ('balance', models.DecimalField(default=0, max_digits=12,
+                                                decimal_places=2)),
+                ('account', models.ForeignKey(related_name='balances',
+                                              to='accounts.Account')),
+            ],
+            options={
+            },
+            bases=(models.Model,),
+        ),
+        migrations.AlterUniqueTogether(
+            name='accountbalance',
+            unique_together=set([('account', 'year')]),
+        ),
+        migrations.RunPython(populate_balances),
+    ]
@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+def populate_paths(apps, schema_editor):
+    Account = apps.get_model("accounts", "Account")
+    parents = dict(Account.objects.values_list("pk", "parent"))
+    for pk in parents:
+        chain = [pk]
+        while parents.get(chain[-1]) is not None and \
+                parents[chain[-1]] not in chain:
+            chain.append(parents[chain[-1]])
+        Account.objects.filter(pk=pk).update(
+            path="".join("{0}/".format(x) for x in reversed(chain)),
+            depth=len(chain) - 1
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0013_accountbalance'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='account',
+            name='path',
+            field=models.CharField(db_index=True, max_length=255,
+                                   editable=False, blank=True),
+            preserve_default=True,
+        ),
+        migrations.AddField(
+            model_name='account',
+            name='depth',
+            field=models.PositiveSmallIntegerField(default=0,
+                                                   editable=False),
+            preserve_default=True,
+        ),
+        migrations.RunPython(populate_paths),
+    ]
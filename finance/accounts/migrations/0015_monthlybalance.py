@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from collections import defaultdict
+from decimal import Decimal
+from django.db import models, migrations
+
+
+def populate_monthly_balances(apps, schema_editor):
+    Account = apps.get_model("accounts", "Account")
+    MonthlyBalance = apps.get_model("accounts", "MonthlyBalance")
+    Transaction = apps.get_model("accounts", "Transaction")
+    profiles = dict(Account.objects.values_list("pk", "profile"))
+    totals = defaultdict(lambda: [Decimal(0), 0])
+    for trx in Transaction.objects.values("account_debit", "account_credit",
+                                          "amount", "date"):
+        for account_id, amount in ((trx["account_debit"], trx["amount"]),
+                                   (trx["account_credit"], -trx["amount"])):
+            total = totals[(account_id, trx["date"].year, trx["date"].month)]
+            total[0] += amount
+            total[1] += 1
+    rows = []
+    balances = defaultdict(Decimal)
+    for (account_id, year, month), (amount, count) in sorted(totals.items()):
+        balances[(account_id, year)] += amount
+        rows.append(MonthlyBalance(
+            profile_id=profiles[account_id], account_id=account_id,
+            year=year, month=month, amount=amount, transactions=count,
+            balance=balances[(account_id, year)]
+        ))
+    MonthlyBalance.objects.bulk_create(rows)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0003_profile_current_year'),
+        ('accounts', '0014_account_path'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MonthlyBalance',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False,
+                                        auto_created=True, primary_key=True)),
+                ('year', models.IntegerField()),
+                ('month', models.PositiveSmallIntegerField()),
+                ('amount', models.DecimalField(default=0, max_digits=12,
+                                               decimal_places=2)),
+                ('balance', models.DecimalField(default=0, max_digits=12,
+                                                decimal_places=2)),
+                ('transactions', models.IntegerField(default=0)),
+                ('account', models.ForeignKey(related_name='monthly_balances',
+                                              to='accounts.Account')),
+                ('profile', models.ForeignKey(to='core.Profile')),
+            ],
+            options={
+            },
+            bases=(models.Model,),
+        ),
+        migrations.AlterUniqueTogether(
+            name='monthlybalance',
+            unique_together=set([('account', 'year', 'month')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='monthlybalance',
+            index_together=set([('profile', 'year')]),
+        ),
+        migrations.RunPython(populate_monthly_balances),
+    ]
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import hashlib
+
+from decimal import Decimal
+from django.db import models, migrations
+
+
+def transaction_fingerprint(profile_pk, date, amount, summary):
+    # frozen copy of finance.accounts.models.transaction_fingerprint as it
+    # was when this migration was written
+    amount = Decimal(str(amount)).quantize(Decimal("0.01"))
+    summary = " ".join(summary.lower().split())
+    return hashlib.sha1("{0}|{1}|{2}|{3}".format(
+        profile_pk, date.isoformat(), amount, summary
+    ).encode("utf-8")).hexdigest()
+
+
+def populate_fingerprints(apps, schema_editor):
+    Transaction = apps.get_model("accounts", "Transaction")
+    for pk, profile_pk, date, amount, summary in \
+            Transaction.objects.values_list("pk", "account_debit__profile",
+                                            "date", "amount", "summary"):
+        Transaction.objects.filter(pk=pk).update(
+            fingerprint=transaction_fingerprint(profile_pk, date, amount,
+                                                summary)
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0015_monthlybalance'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='transaction',
+            name='fingerprint',
+            field=models.CharField(db_index=True, max_length=40,
+                                   editable=False, blank=True),
+            preserve_default=True,
+        ),
+        migrations.RunPython(populate_fingerprints),
+    ]
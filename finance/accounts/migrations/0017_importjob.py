@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_cacheversion'),
+        ('accounts', '0016_transaction_fingerprint'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportJob',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False,
+                                        auto_created=True, primary_key=True)),
+                ('filename', models.CharField(max_length=255)),
+                ('year', models.IntegerField(null=True, blank=True)),
+                ('status', models.CharField(default='PENDING', max_length=20,
+                                            db_index=True,
+                                            choices=[('PENDING', 'Pending'),
+                                                     ('RUNNING', 'Running'),
+                                                     ('DONE', 'Done'),
+                                                     ('FAILED', 'Failed')])),
+                ('processed', models.IntegerField(default=0)),
+                ('result', models.TextField(blank=True)),
+                ('error', models.TextField(blank=True)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('updated', models.DateTimeField(auto_now=True)),
+                ('account', models.ForeignKey(to='accounts.Account')),
+                ('profile', models.ForeignKey(to='core.Profile')),
+            ],
+            options={
+            },
+            bases=(models.Model,),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0018_importjob_rejected'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='transaction',
+            name='external_id',
+            field=models.CharField(db_index=True, max_length=255,
+                                   editable=False, blank=True),
+            preserve_default=True,
+        ),
+    ]
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0019_transaction_external_id'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='importjob',
+            name='is_temporary',
+            field=models.BooleanField(default=False),
+            preserve_default=True,
+        ),
+    ]
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0020_importjob_is_temporary'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportRow',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False,
+                                        auto_created=True, primary_key=True)),
+                ('position', models.IntegerField()),
+                ('amount', models.DecimalField(max_digits=8,
+                                               decimal_places=2)),
+                ('summary', models.CharField(max_length=100)),
+                ('date', models.DateField()),
+                ('fingerprint', models.CharField(max_length=40, editable=False,
+                                                 blank=True)),
+                ('external_id', models.CharField(max_length=255,
+                                                 editable=False, blank=True)),
+                ('is_duplicate', models.BooleanField(
+                    default=False, verbose_name='duplicate')),
+                ('account_credit', models.ForeignKey(
+                    related_name='+', verbose_name='credit', blank=True,
+                    to='accounts.Account', null=True)),
+                ('account_debit', models.ForeignKey(
+                    related_name='+', verbose_name='debit', blank=True,
+                    to='accounts.Account', null=True)),
+                ('job', models.ForeignKey(related_name='rows',
+                                          to='accounts.ImportJob')),
+            ],
+            options={
+                'ordering': ['position'],
+            },
+            bases=(models.Model,),
+        ),
+        migrations.AlterUniqueTogether(
+            name='importrow',
+            unique_together=set([('job', 'position')]),
+        ),
+        migrations.RemoveField(
+            model_name='importjob',
+            name='result',
+        ),
+        migrations.AlterField(
+            model_name='importjob',
+            name='status',
+            field=models.CharField(default='PENDING', max_length=20,
+                                   db_index=True,
+                                   choices=[('PENDING', 'Pending'),
+                                            ('RUNNING', 'Running'),
+                                            ('DONE', 'Done'),
+                                            ('FAILED', 'Failed'),
+                                            ('IMPORTED', 'Imported')]),
+            preserve_default=True,
+        ),
+    ]
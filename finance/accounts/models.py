@@ -1,12 +1,52 @@
 import datetime
+import hashlib
+import os
 
-from django.core.cache import cache
-from django.db import models
-from django.db.models import Q
+from collections import defaultdict, namedtuple, OrderedDict
+from decimal import Decimal
+from django.core.exceptions import ValidationError
+from django.db import connection, models, transaction, IntegrityError
+from django.db.models import Count, F, Q, Sum
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+from finance.core.cache import bump_version
+from finance.core.identity import (IdentityMapQuerySetMixin,
+                                   get_identity_map)
 from finance.core.models import Profile
+from finance.core.utils import date_to_str
 
 
-class AccountTypeQuerySet(models.QuerySet):
+def get_year(date):
+    """Year of a date that may not have been converted from a string yet"""
+    if isinstance(date, datetime.date):
+        return date.year
+    return int(date[:4])
+
+
+def get_month(date):
+    if isinstance(date, datetime.date):
+        return date.month
+    return int(date[5:7])
+
+
+def transaction_fingerprint(profile_pk, date, amount, summary):
+    """Hash identifying the transactions that look like the same one"""
+    if isinstance(date, datetime.date):
+        date = date_to_str(date)
+    amount = Decimal(str(amount)).quantize(Decimal("0.01"))
+    summary = u" ".join(summary.lower().split())
+    return hashlib.sha1(u"{0}|{1}|{2}|{3}".format(
+        profile_pk, date[:10], amount, summary
+    ).encode("utf-8")).hexdigest()
+
+
+# change one side of a transaction makes to the stored balances, ``count``
+# is the number of transactions added (1) or removed (-1)
+BalanceDelta = namedtuple("BalanceDelta", "account_id year month amount count")
+
+
+class AccountTypeQuerySet(IdentityMapQuerySetMixin, models.QuerySet):
     def yearly(self):
         return self.filter(yearly=True)
 
@@ -38,13 +78,52 @@ class AccountType(models.Model):
         return self.name
 
 
-class AccountQuerySet(models.QuerySet):
+PARENT_CYCLE_ERROR = "An account can not be a subaccount of itself"
+
+
+class AccountQuerySet(IdentityMapQuerySetMixin, models.QuerySet):
     def yearly(self):
         return self.filter(account_type__yearly=True)
 
-    def clear_cache(self):
-        for acct in self.yearly():
-            acct.clear_cache()
+    def ancestor_map(self, account_ids):
+        """Map each account pk to the pks of its parent categories,
+        nearest first
+        """
+        ancestors = dict((pk, []) for pk in account_ids)
+        for pk, path in self.filter(pk__in=account_ids).values_list("pk",
+                                                                    "path"):
+            ancestors[pk] = Account.path_ids(path)[-2::-1]
+        return ancestors
+
+    def tree(self, year=None):
+        """Accounts in display order, categories followed by their
+        subaccounts, with their ``level`` below the top of the tree
+
+        The accounts are fetched in one query. When a year is given the
+        balance of every account is set as ``year_balance`` as well.
+        """
+        accounts = list(self.select_related("account_type"))
+        pks = set(account.pk for account in accounts)
+        children = defaultdict(list)
+        for account in accounts:
+            children[account.parent_id if account.parent_id in pks
+                     else None].append(account)
+        if year is not None:
+            balances = dict(AccountBalance.objects.filter(
+                account__in=pks, year=year
+            ).values_list("account", "balance"))
+        ordered = []
+        pending = [(account, 0) for account in reversed(children[None])]
+        while pending:
+            account, level = pending.pop()
+            account.level = level
+            if year is not None:
+                account.year_balance = balances.get(account.pk, 0)
+            ordered.append(account)
+            if account.is_category:
+                pending.extend((child, level + 1)
+                               for child in reversed(children[account.pk]))
+        return ordered
 
     def debits(self):
         """Yearly accounts that are type DEBIT"""
@@ -63,6 +142,10 @@ class Account(models.Model):
     parent = models.ForeignKey('Account', null=True, blank=True,
                                limit_choices_to={"is_category": True})
     is_category = models.BooleanField(default=False)
+    # pks of the parent categories and the account itself, "1/5/12/"
+    path = models.CharField(max_length=255, blank=True, db_index=True,
+                            editable=False)
+    depth = models.PositiveSmallIntegerField(default=0, editable=False)
 
     objects = AccountQuerySet.as_manager()
 
@@ -72,54 +155,372 @@ class Account(models.Model):
     def __unicode__(self):
         return self.name
 
+    @staticmethod
+    def path_ids(path):
+        return [int(pk) for pk in path.split("/") if pk]
+
+    def get_parent_path(self):
+        if self.parent_id is None:
+            return ""
+        return Account.objects.filter(pk=self.parent_id).values_list(
+            "path", flat=True
+        ).first() or ""
+
+    def clean(self):
+        if self.pk in self.path_ids(self.get_parent_path()):
+            raise ValidationError({"parent": [PARENT_CYCLE_ERROR]})
+
+    def save(self, **kwargs):
+        with transaction.atomic():
+            previous_parent, previous_path = None, ""
+            if self.pk is not None:
+                previous_parent, previous_path = Account.objects.filter(
+                    pk=self.pk
+                ).values_list("parent", "path").first() or (None, "")
+            parent_path = self.get_parent_path()
+            if self.pk in self.path_ids(parent_path):
+                raise ValidationError(PARENT_CYCLE_ERROR)
+            created = self.pk is None
+            if not created:
+                self.set_path(parent_path)
+            super(Account, self).save(**kwargs)
+            if created:
+                self.set_path(parent_path)
+                Account.objects.filter(pk=self.pk).update(path=self.path,
+                                                          depth=self.depth)
+            elif previous_path and previous_path != self.path:
+                self.move_descendants(previous_path)
+            if previous_parent != self.parent_id:
+                AccountBalance.objects.move(self, previous_parent)
+
+    def set_path(self, parent_path):
+        self.path = "{0}{1}/".format(parent_path, self.pk)
+        self.depth = len(self.path_ids(self.path)) - 1
+
+    def move_descendants(self, previous_path):
+        """Rewrite the paths below this account after it was moved"""
+        depth_change = self.depth - (len(self.path_ids(previous_path)) - 1)
+        table = connection.ops.quote_name(Account._meta.db_table)
+        cursor = connection.cursor()
+        cursor.execute(
+            "UPDATE {0} SET path = %s || SUBSTR(path, %s), "
+            "depth = depth + %s WHERE path LIKE %s".format(table),
+            [self.path, len(previous_path) + 1, depth_change,
+             previous_path + "%"]
+        )
+
     @property
-    def cache_key(self):
-        return "account-{0}".format(self.pk)
+    def ancestor_ids(self):
+        """pks of the parent categories, top of the tree first"""
+        return self.path_ids(self.path)[:-1]
+
+    def ancestors(self):
+        return Account.objects.filter(pk__in=self.ancestor_ids)
 
-    def clear_cache(self):
-        cache.delete(self.cache_key)
+    def descendants(self):
+        """All accounts below this one, however deep"""
+        return Account.objects.filter(path__startswith=self.path).exclude(
+            pk=self.pk
+        )
 
     def balance(self):
-        """Current balance of account"""
-        balance = cache.get(self.cache_key)
-        if balance is not None:
-            return balance
-        balance = 0
-        if self.is_category:
-            for acct in self.subaccounts():
-                balance += acct.balance()
-        else:
-            trxs = self.transactions()
-            if trxs:
-                balance = trxs[0].balance
-        cache.set(self.cache_key, balance)
-        return balance
+        """Current balance of account
+
+        Category balances include all their subaccounts
+        """
+        return AccountBalance.objects.balance(self, self.profile.year)
 
     def subaccounts(self):
         return Account.objects.filter(parent=self)
 
-    def transactions(self, month=None):
-        """Get all transactions associated with this account
+    def ledger(self, month=None, year=None, running_balance=True):
+        """Lazy queryset of the transactions of this account, newest first
 
-        We want to clearly indicate the opposite account
-        And maintain a running balance for each transaction
+        The database adds the ``signed_amount`` of each transaction, which is
+        negative when this account is credited, and keeps the running
+        ``balance`` with a cumulative window sum, so only the rows that are
+        used get loaded.
         """
-        year = self.profile.year
+        if year is None:
+            year = self.profile.year
         trxs = Transaction.objects.filter(
             Q(account_debit=self) | Q(account_credit=self)
         ).filter(date__year=year)
         if month is not None:
             trxs = trxs.filter(date__month=month)
-        trxs = trxs.order_by("date")
-        trx_list = []
-        balance = 0
-        for trx in trxs:
-            if self == trx.account_credit:
-                trx.amount = trx.amount * -1
-            balance += trx.amount
-            trx.balance = balance
-            trx_list.append(trx)
-        return trx_list[::-1]
+        signed_amount = Transaction.signed_amount_sql()
+        select = OrderedDict([("signed_amount", signed_amount)])
+        if running_balance:
+            select["balance"] = "SUM({0}) OVER (ORDER BY {1}, {2})".format(
+                signed_amount,
+                Transaction.column_sql("date"),
+                Transaction.column_sql("id")
+            )
+        return trxs.extra(
+            select=select, select_params=(self.pk, ) * len(select)
+        ).order_by("-date", "-id")
+
+    def ledger_sum(self, trxs):
+        """Sum of the signed amounts of the given ledger transactions"""
+        total = trxs.order_by().extra(
+            select={"total": "COALESCE(SUM({0}), 0)".format(
+                Transaction.signed_amount_sql()
+            )},
+            select_params=(self.pk, )
+        ).values_list("total", flat=True)
+        return total[0]
+
+    def transactions(self, month=None):
+        """Get all transactions associated with this account
+
+        We want to clearly indicate the opposite account
+        And maintain a running balance for each transaction
+        """
+        trx_list = get_identity_map().attach(
+            self.ledger(month), "account_debit", "account_credit"
+        )
+        for trx in trx_list:
+            trx.amount = trx.signed_amount
+        return trx_list
+
+
+class AccountBalanceQuerySet(models.QuerySet):
+    def balance(self, account, year):
+        balance = self.filter(account=account, year=year).values_list(
+            "balance", flat=True
+        ).first()
+        return balance if balance is not None else 0
+
+    def apply(self, deltas, create=True):
+        """Add ``BalanceDelta`` changes to the stored balances
+
+        Each amount is also added to the parent categories of the account.
+        Rows are changed with a single ``UPDATE ... SET balance = balance +
+        amount`` so concurrent writers can not lose each others changes, and
+        they are visited in order so that two writers can not deadlock.
+        """
+        ancestors = Account.objects.ancestor_map(
+            set(delta.account_id for delta in deltas)
+        )
+        totals = defaultdict(Decimal)
+        for delta in deltas:
+            for pk in [delta.account_id] + ancestors[delta.account_id]:
+                totals[(pk, delta.year)] += delta.amount
+        for (account_id, year), amount in sorted(totals.items()):
+            if not amount:
+                continue
+            rows = self.filter(account_id=account_id, year=year)
+            if rows.update(balance=F("balance") + amount) or not create:
+                continue
+            try:
+                with transaction.atomic():
+                    self.create(account_id=account_id, year=year,
+                                balance=amount)
+            except IntegrityError:
+                # another writer created the row first
+                rows.update(balance=F("balance") + amount)
+
+    def move(self, account, previous_parent):
+        """Shift the balances of an account between parent categories"""
+        deltas = []
+        for year, balance in self.filter(account=account).values_list(
+                "year", "balance"):
+            if previous_parent is not None:
+                deltas.append(
+                    BalanceDelta(previous_parent, year, None, -balance, 0)
+                )
+            if account.parent_id is not None:
+                deltas.append(
+                    BalanceDelta(account.parent_id, year, None, balance, 0)
+                )
+        self.apply(deltas)
+
+    def rebuild(self, accounts=None):
+        """Recalculate the stored balances from the transactions
+
+        Used to recover the balances after changes that bypass
+        ``Transaction.save``, such as ``QuerySet.update``.
+        """
+        if accounts is None:
+            accounts = Account.objects.all()
+        account_ids = list(accounts.values_list("pk", flat=True))
+        ancestors = Account.objects.ancestor_map(account_ids)
+        year_sql = connection.ops.date_extract_sql(
+            "year", Transaction.column_sql("date")
+        )
+        trxs = Transaction.objects.extra(select={"year": year_sql})
+        totals = defaultdict(Decimal)
+        for field, sign in (("account_debit", 1), ("account_credit", -1)):
+            sums = trxs.filter(**{"{0}__in".format(field): account_ids})
+            sums = sums.values(field, "year").annotate(total=Sum("amount"))
+            for row in sums:
+                account_id = row[field]
+                for pk in [account_id] + ancestors[account_id]:
+                    totals[(pk, int(row["year"]))] += sign * row["total"]
+        with transaction.atomic():
+            self.filter(account__in=account_ids).delete()
+            self.bulk_create([
+                AccountBalance(account_id=pk, year=year, balance=balance)
+                for (pk, year), balance in totals.items()
+            ])
+
+
+class AccountBalance(models.Model):
+    """Balance of an account for a year, maintained by every
+    transaction save and delete
+    """
+    account = models.ForeignKey(Account, related_name="balances")
+    year = models.IntegerField()
+    balance = models.DecimalField(decimal_places=2, max_digits=12,
+                                  default=0)
+
+    objects = AccountBalanceQuerySet.as_manager()
+
+    class Meta:
+        unique_together = (("account", "year"), )
+
+    def __unicode__(self):
+        return u"{0} {1}: {2}".format(self.account_id, self.year,
+                                      self.balance)
+
+
+class MonthlyBalanceQuerySet(models.QuerySet):
+    def apply(self, deltas, create=True):
+        """Add ``BalanceDelta`` changes to the monthly rollup
+
+        Only the accounts named in the deltas are changed, categories are
+        not rolled up. The accounts are locked first, in order, so that
+        concurrent writers can not interleave the opening balance of a new
+        month with the shift of the closing balances of the later ones.
+        """
+        totals = defaultdict(lambda: [Decimal(0), 0])
+        for delta in deltas:
+            total = totals[(delta.account_id, delta.year, delta.month)]
+            total[0] += delta.amount
+            total[1] += delta.count
+        profiles = dict(Account.objects.select_for_update().filter(
+            pk__in=set(account_id for account_id, _, _ in totals)
+        ).order_by("pk").values_list("pk", "profile"))
+        for (account_id, year, month), (amount, count) in sorted(
+                totals.items()):
+            if account_id not in profiles or not (amount or count):
+                continue
+            rows = self.filter(account_id=account_id, year=year)
+            if not rows.filter(month=month).update(
+                    amount=F("amount") + amount,
+                    transactions=F("transactions") + count):
+                if not create:
+                    continue
+                opening = rows.filter(month__lt=month).order_by(
+                    "-month"
+                ).values_list("balance", flat=True).first()
+                self.create(profile_id=profiles[account_id],
+                            account_id=account_id, year=year, month=month,
+                            amount=amount, transactions=count,
+                            balance=opening or 0)
+            if amount:
+                rows.filter(month__gte=month).update(
+                    balance=F("balance") + amount
+                )
+        return profiles
+
+    def rebuild(self, accounts=None):
+        """Recalculate the monthly rollup from the transactions"""
+        if accounts is None:
+            accounts = Account.objects.all()
+        profiles = dict(accounts.values_list("pk", "profile"))
+        trxs = Transaction.objects.extra(select=dict(
+            (name, connection.ops.date_extract_sql(
+                name, Transaction.column_sql("date")
+            )) for name in ("year", "month")
+        ))
+        totals = defaultdict(lambda: [Decimal(0), 0])
+        for field, sign in (("account_debit", 1), ("account_credit", -1)):
+            sums = trxs.filter(**{"{0}__in".format(field): list(profiles)})
+            sums = sums.values(field, "year", "month").annotate(
+                total=Sum("amount"), count=Count("pk")
+            )
+            for row in sums:
+                total = totals[(row[field], int(row["year"]),
+                                int(row["month"]))]
+                total[0] += sign * row["total"]
+                total[1] += row["count"]
+        rows = []
+        balances = defaultdict(Decimal)
+        for (account_id, year, month), (amount, count) in sorted(
+                totals.items()):
+            balances[(account_id, year)] += amount
+            rows.append(MonthlyBalance(
+                profile_id=profiles[account_id], account_id=account_id,
+                year=year, month=month, amount=amount, transactions=count,
+                balance=balances[(account_id, year)]
+            ))
+        with transaction.atomic():
+            self.filter(account__in=list(profiles)).delete()
+            self.bulk_create(rows)
+            for profile_id in sorted(set(profiles.values())):
+                bump_version(profile_id)
+
+
+class MonthlyBalance(models.Model):
+    """Net amount and closing balance of an account for a month,
+    maintained alongside ``AccountBalance``
+
+    The closing balance runs from the start of the year, like the
+    yearly balances.
+    """
+    profile = models.ForeignKey(Profile)
+    account = models.ForeignKey(Account, related_name="monthly_balances")
+    year = models.IntegerField()
+    month = models.PositiveSmallIntegerField()
+    amount = models.DecimalField(decimal_places=2, max_digits=12,
+                                 default=0)
+    balance = models.DecimalField(decimal_places=2, max_digits=12,
+                                  default=0)
+    transactions = models.IntegerField(default=0)
+
+    objects = MonthlyBalanceQuerySet.as_manager()
+
+    class Meta:
+        unique_together = (("account", "year", "month"), )
+        index_together = (("profile", "year"), )
+
+    def __unicode__(self):
+        return u"{0} {1}-{2:02d}: {3}".format(self.account_id, self.year,
+                                              self.month, self.amount)
+
+
+def apply_balance_deltas(deltas, create=True):
+    """Apply the deltas to the monthly rollup and the yearly balances,
+    and invalidate the cached values of the years they change
+
+    The monthly rollup goes first as it locks the accounts.
+    """
+    profiles = MonthlyBalance.objects.apply(deltas, create)
+    AccountBalance.objects.apply(deltas, create)
+    for profile_id, year in sorted(set(
+            (profiles[delta.account_id], delta.year) for delta in deltas
+            if delta.account_id in profiles)):
+        bump_version(profile_id, year)
+
+
+class TransactionQuerySet(models.QuerySet):
+    def add_all(self, trxs):
+        """Insert new transactions with a single ``bulk_create``
+
+        Their balance deltas are applied together, so each account and
+        profile year is changed and invalidated once however many
+        transactions there are.
+        """
+        trxs = list(trxs)
+        with transaction.atomic():
+            for trx in trxs:
+                trx.set_fingerprint()
+            self.bulk_create(trxs)
+            apply_balance_deltas(
+                [delta for trx in trxs for delta in trx.balance_deltas()]
+            )
+        return trxs
 
 
 class Transaction(models.Model):
@@ -131,6 +532,13 @@ class Transaction(models.Model):
     summary = models.CharField(max_length=100)
     description = models.CharField(max_length=250, blank=True)
     date = models.DateField()
+    fingerprint = models.CharField(max_length=40, blank=True, db_index=True,
+                                   editable=False)
+    # id given to the transaction by the bank, e.g. the OFX FITID
+    external_id = models.CharField(max_length=255, blank=True, db_index=True,
+                                   editable=False)
+
+    objects = TransactionQuerySet.as_manager()
 
     class Meta:
         ordering = ["-date", ]
@@ -141,22 +549,289 @@ class Transaction(models.Model):
             amount=self.amount
         )
 
+    @classmethod
+    def column_sql(cls, name):
+        return "{0}.{1}".format(connection.ops.quote_name(cls._meta.db_table),
+                                connection.ops.quote_name(name))
+
+    @classmethod
+    def signed_amount_sql(cls):
+        """SQL for the amount, negated when the account given as the
+        parameter is credited
+        """
+        return "CASE WHEN {0} = %s THEN -{1} ELSE {1} END".format(
+            cls.column_sql("account_credit_id"), cls.column_sql("amount")
+        )
+
+    def balance_deltas(self, sign=1):
+        """Changes this transaction makes to the account balances"""
+        year = get_year(self.date)
+        month = get_month(self.date)
+        amount = sign * Decimal(str(self.amount))
+        return [
+            BalanceDelta(self.account_debit_id, year, month, amount, sign),
+            BalanceDelta(self.account_credit_id, year, month, -amount, sign),
+        ]
+
+    def set_fingerprint(self):
+        self.fingerprint = transaction_fingerprint(
+            self.account_debit.profile_id, self.date, self.amount,
+            self.summary
+        )
+
+    def save(self, **kwargs):
+        self.set_fingerprint()
+        with transaction.atomic():
+            deltas = self.balance_deltas()
+            if self.pk is not None:
+                previous = Transaction.objects.select_for_update().filter(
+                    pk=self.pk
+                ).first()
+                if previous is not None:
+                    deltas += previous.balance_deltas(-1)
+            super(Transaction, self).save(**kwargs)
+            apply_balance_deltas(deltas)
+
+
+class ImportJobQuerySet(models.QuerySet):
+    def claim(self, timeout=None):
+        """Lock the oldest pending job and mark it as running
+
+        Workers that race for the same job wait on the row lock and
+        then find it running, so a job is only ever run once. Running jobs
+        that have made no progress for ``timeout`` seconds were left by a
+        worker that died and are given back first.
+        """
+        if timeout is not None:
+            self.requeue_stale(timeout)
+        with transaction.atomic():
+            job = self.select_for_update().filter(
+                status=ImportJob.PENDING
+            ).order_by("created", "pk").first()
+            if job is not None:
+                job.status = ImportJob.RUNNING
+                job.started = timezone.now()
+                job.attempts += 1
+                job.save(update_fields=["status", "started", "attempts",
+                                        "updated"])
+        return job
+
+    def requeue_stale(self, timeout):
+        """Put the stale running jobs back in the queue, or fail those
+        that have already been tried ``ImportJob.MAX_ATTEMPTS`` times
+        """
+        cutoff = timezone.now() - datetime.timedelta(seconds=timeout)
+        with transaction.atomic():
+            stale = list(self.select_for_update().filter(
+                status=ImportJob.RUNNING, started__lt=cutoff,
+                updated__lt=cutoff
+            ))
+            for job in stale:
+                ImportRow.objects.filter(job=job).delete()
+                job.processed = 0
+                if job.attempts >= ImportJob.MAX_ATTEMPTS:
+                    job.status = ImportJob.FAILED
+                    job.error = u"The import stopped before it finished"
+                else:
+                    job.status = ImportJob.PENDING
+                job.save(update_fields=["status", "processed", "error",
+                                        "updated"])
+        # the worker that died never removed the upload of the job
+        for job in stale:
+            if job.status == ImportJob.FAILED:
+                job.delete_file()
+        return len(stale)
+
+    def purge(self, max_age):
+        """Delete the finished jobs, with the rows they staged and the
+        copies of their uploads, that have not been touched for ``max_age``
+        seconds, e.g. imports that were never confirmed
+        """
+        cutoff = timezone.now() - datetime.timedelta(seconds=max_age)
+        jobs = self.filter(
+            status__in=[ImportJob.DONE, ImportJob.FAILED, ImportJob.IMPORTED],
+            updated__lt=cutoff
+        )
+        for job in jobs.filter(is_temporary=True):
+            job.delete_file()
+        ImportRow.objects.filter(job__in=jobs).delete()
+        count = jobs.count()
+        jobs.delete()
+        return count
+
+
+class ImportJob(models.Model):
+    """Statement file waiting to be parsed by the import worker"""
+    PENDING = "PENDING"
+    RUNNING = "RUNNING"
+    DONE = "DONE"
+    FAILED = "FAILED"
+    IMPORTED = "IMPORTED"
+    STATUS_CHOICES = (
+        (PENDING, "Pending"),
+        (RUNNING, "Running"),
+        (DONE, "Done"),
+        (FAILED, "Failed"),
+        (IMPORTED, "Imported"),
+    )
+    # runs a job may take before it is failed instead of given back
+    MAX_ATTEMPTS = 3
+    profile = models.ForeignKey(Profile)
+    account = models.ForeignKey(Account)
+    filename = models.CharField(max_length=255)
+    # the file is a copy of the upload, removed once it has been read
+    is_temporary = models.BooleanField(default=False)
+    year = models.IntegerField(null=True, blank=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES,
+                              default=PENDING, db_index=True)
+    processed = models.IntegerField(default=0)
+    rejected = models.IntegerField(default=0)
+    error = models.TextField(blank=True)
+    started = models.DateTimeField(null=True, blank=True)
+    attempts = models.IntegerField(default=0)
+    created = models.DateTimeField(auto_now_add=True)
+    updated = models.DateTimeField(auto_now=True)
+
+    objects = ImportJobQuerySet.as_manager()
+
+    def __unicode__(self):
+        return u"{0} {1}".format(self.filename, self.status)
+
+    @property
+    def is_finished(self):
+        return self.status in (self.DONE, self.FAILED, self.IMPORTED)
+
+    def delete_file(self):
+        """Remove the file of the job if it is a copy of the upload"""
+        if self.is_temporary and os.path.exists(self.filename):
+            os.unlink(self.filename)
+
+    def promote(self):
+        """Add the staged rows that are not duplicates as transactions
+
+        The rows are copied with a single INSERT ... SELECT and their
+        balance deltas are summed per account and month by the database,
+        so confirming costs the same number of queries however long the
+        statement is. Returns the number of transactions added.
+        """
+        with transaction.atomic():
+            job = ImportJob.objects.select_for_update().get(pk=self.pk)
+            if job.status != self.DONE:
+                raise ValidationError("The import has already been "
+                                      "confirmed")
+            rows = ImportRow.objects.filter(job=job, is_duplicate=False)
+            if rows.filter(Q(account_debit=None) |
+                           Q(account_credit=None)).exists():
+                raise ValidationError("Debit and credit are required for "
+                                      "every transaction that is not a "
+                                      "duplicate")
+            cursor = connection.cursor()
+            cursor.execute(PROMOTE_IMPORT_ROWS_SQL.format(
+                transaction=connection.ops.quote_name(
+                    Transaction._meta.db_table
+                ),
+                row=connection.ops.quote_name(ImportRow._meta.db_table)
+            ), [job.pk])
+            count = cursor.rowcount
+            apply_balance_deltas(rows.balance_deltas())
+            ImportRow.objects.filter(job=job).delete()
+            job.status = self.IMPORTED
+            job.save(update_fields=["status", "updated"])
+        self.status = job.status
+        return count
+
+
+PROMOTE_IMPORT_ROWS_SQL = """
+INSERT INTO {transaction} (account_debit_id, account_credit_id, amount,
+                           summary, description, date, fingerprint,
+                           external_id)
+SELECT account_debit_id, account_credit_id, amount, summary, '', date,
+       fingerprint, external_id
+FROM {row}
+WHERE job_id = %s AND NOT is_duplicate
+ORDER BY position
+"""
+
+
+class ImportRowQuerySet(models.QuerySet):
+    def balance_deltas(self):
+        """Balance deltas of the rows, summed per account and month"""
+        rows = self.order_by().extra(select=dict(
+            (name, connection.ops.date_extract_sql(
+                name, ImportRow.column_sql("date")
+            )) for name in ("year", "month")
+        ))
+        deltas = []
+        for field, sign in (("account_debit", 1), ("account_credit", -1)):
+            sums = rows.values(field, "year", "month").annotate(
+                total=Sum("amount"), count=Count("pk")
+            )
+            for row in sums:
+                deltas.append(BalanceDelta(
+                    row[field], int(row["year"]), int(row["month"]),
+                    sign * row["total"], row["count"]
+                ))
+        return deltas
+
+
+class ImportRow(models.Model):
+    """Transaction read from the statement of an import job, staged for
+    review until the import is confirmed
+    """
+    job = models.ForeignKey(ImportJob, related_name="rows")
+    # order of the transaction in the statement
+    position = models.IntegerField()
+    account_debit = models.ForeignKey(Account, null=True, blank=True,
+                                      related_name="+", verbose_name="debit")
+    account_credit = models.ForeignKey(Account, null=True, blank=True,
+                                       related_name="+",
+                                       verbose_name="credit")
+    amount = models.DecimalField(decimal_places=2, max_digits=8)
+    summary = models.CharField(max_length=100)
+    date = models.DateField()
+    fingerprint = models.CharField(max_length=40, blank=True,
+                                   editable=False)
+    external_id = models.CharField(max_length=255, blank=True,
+                                   editable=False)
+    is_duplicate = models.BooleanField(default=False,
+                                       verbose_name="duplicate")
+
+    objects = ImportRowQuerySet.as_manager()
+
+    class Meta:
+        ordering = ["position"]
+        unique_together = (("job", "position"),)
+
+    def __unicode__(self):
+        return u"{0} {1}".format(self.summary, self.amount)
+
+    @classmethod
+    def column_sql(cls, name):
+        return "{0}.{1}".format(connection.ops.quote_name(cls._meta.db_table),
+                                connection.ops.quote_name(name))
+
+    def set_fingerprint(self):
+        self.fingerprint = transaction_fingerprint(
+            self.job.profile_id, self.date, self.amount, self.summary
+        )
+
     def save(self, **kwargs):
-        super(Transaction, self).save(**kwargs)
-        profile = self.account_debit.profile
-        if isinstance(self.date, datetime.date):
-            year = self.date.year
-        else:
-            year = self.date[:4]
-        cache.delete_many([
-            self.account_debit.cache_key,
-            self.account_credit.cache_key,
-            "{0}-{1}-debits-vs-credits".format(
-                profile.pk,
-                year
-            ),
-            "{0}-{1}-debits-vs-credits".format(
-                profile.pk,
-                year
-            ),
-        ])
+        self.set_fingerprint()
+        super(ImportRow, self).save(**kwargs)
+
+
+@receiver(post_delete, sender=Transaction)
+def remove_transaction_balances(sender, instance, **kwargs):
+    # rows of accounts that are being deleted may already be gone,
+    # so only existing balances are touched
+    apply_balance_deltas(instance.balance_deltas(-1), create=False)
+
+
+@receiver(post_save, sender=Account)
+@receiver(post_delete, sender=Account)
+@receiver(post_save, sender=AccountType)
+@receiver(post_delete, sender=AccountType)
+def invalidate_profile_cache(sender, instance, **kwargs):
+    # the account tree feeds every cached value of the profile,
+    # re-parents included
+    bump_version(instance.profile_id)
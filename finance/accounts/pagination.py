@@ -0,0 +1,150 @@
+import datetime
+
+from django.db.models import Q
+from django.utils.http import urlencode
+from finance.core.identity import get_identity_map
+from finance.core.utils import date_to_str
+
+
+def encode_cursor(trx):
+    return "{0}.{1}".format(date_to_str(trx.date), trx.pk)
+
+
+def decode_cursor(value):
+    """Position (date, pk) in the ledger, or None when invalid"""
+    try:
+        date, pk = value.split(".")
+        return (datetime.datetime.strptime(date, "%Y-%m-%d").date(),
+                int(pk))
+    except (AttributeError, ValueError):
+        return None
+
+
+def newer_than(date, pk):
+    return Q(date__gt=date) | Q(date=date, pk__gt=pk)
+
+
+def older_than(date, pk):
+    return Q(date__lt=date) | Q(date=date, pk__lt=pk)
+
+
+class LedgerPage(object):
+    def __init__(self, object_list, has_previous, has_next, position):
+        self.object_list = object_list
+        self.has_previous = has_previous
+        self.has_next = has_next
+        self.position = position
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    @property
+    def previous_query(self):
+        if not self.object_list:
+            return ""
+        return urlencode({"after": encode_cursor(self.object_list[0])})
+
+    @property
+    def next_query(self):
+        if not self.object_list:
+            return ""
+        return urlencode({"before": encode_cursor(self.object_list[-1])})
+
+    @property
+    def query(self):
+        """Query string that leads back to this page"""
+        return urlencode(self.position)
+
+
+class LedgerPaginator(object):
+    """Keyset pagination of an account ledger ordered by (date, pk)
+
+    Pages seek past the (date, pk) of the row on the edge of the page that
+    linked to them instead of counting rows, and the running balance of the
+    first row is carried over from the account balance, so every page costs
+    the same number of queries however deep in the ledger it is.
+    """
+    def __init__(self, account, per_page=25):
+        self.account = account
+        self.per_page = per_page
+        self.trxs = account.ledger(running_balance=False)
+
+    def page(self, before=None, after=None, number=None):
+        trxs = None
+        if decode_cursor(before) is not None:
+            position = {"before": before}
+            trxs, has_previous, has_next = self._seek_older(
+                decode_cursor(before)
+            )
+        elif decode_cursor(after) is not None:
+            position = {"after": after}
+            trxs, has_previous, has_next = self._seek_newer(
+                decode_cursor(after)
+            )
+        if trxs is not None and not trxs:
+            # the rows past the cursor are gone, e.g. deleted since the
+            # link was made, so land on the last or the first page
+            if decode_cursor(before) is not None:
+                trxs, has_previous, has_next, number = self._last_page()
+            else:
+                trxs, has_previous, has_next, number = self._offset(1)
+            position = {"page": number}
+        elif trxs is None:
+            try:
+                number = max(int(number), 1)
+            except (TypeError, ValueError):
+                number = 1
+            trxs, has_previous, has_next, number = self._offset(number)
+            position = {"page": number}
+        self._set_balances(trxs, at_top=not has_previous)
+        return LedgerPage(trxs, has_previous, has_next, position)
+
+    def _slice(self, trxs, offset=0):
+        rows = get_identity_map().attach(
+            trxs[offset:offset + self.per_page + 1],
+            "account_debit", "account_credit"
+        )
+        return rows[:self.per_page], len(rows) > self.per_page
+
+    def _seek_older(self, cursor):
+        trxs, has_next = self._slice(self.trxs.filter(older_than(*cursor)))
+        return trxs, True, has_next
+
+    def _seek_newer(self, cursor):
+        trxs, has_previous = self._slice(
+            self.trxs.filter(newer_than(*cursor)).order_by("date", "pk")
+        )
+        trxs.reverse()
+        return trxs, has_previous, True
+
+    def _offset(self, number):
+        offset = (number - 1) * self.per_page
+        trxs, has_next = self._slice(self.trxs, offset)
+        if not trxs and offset:
+            # past the end, show the last page instead
+            return self._last_page()
+        return trxs, offset > 0, has_next, number
+
+    def _last_page(self):
+        count = self.trxs.count()
+        offset = max(count - 1, 0) // self.per_page * self.per_page
+        trxs, has_next = self._slice(self.trxs, offset)
+        return trxs, offset > 0, has_next, offset // self.per_page + 1
+
+    def _set_balances(self, trxs, at_top):
+        if not trxs:
+            return
+        if self.account.is_category:
+            balance = self.account.ledger_sum(self.trxs)
+        else:
+            balance = self.account.balance()
+        if not at_top:
+            balance -= self.account.ledger_sum(
+                self.trxs.filter(newer_than(trxs[0].date, trxs[0].pk))
+            )
+        for trx in trxs:
+            trx.balance = balance
+            balance -= trx.signed_amount
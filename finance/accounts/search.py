@@ -0,0 +1,83 @@
+import bisect
+import threading
+
+from collections import OrderedDict
+from finance.accounts.models import Account
+from finance.core.cache import profile_cache_key
+
+MAX_INDEXES = 100
+MAX_RESULTS = 20
+
+_indexes = OrderedDict()
+_lock = threading.Lock()
+
+
+class AccountIndex(object):
+    """Sorted prefix index over the names of the accounts of a profile
+
+    Every word of the label of an account, its categories included, is an
+    entry, so "groc" and "food gro" both find "Food / Groceries". Lookups
+    bisect the sorted words instead of scanning the accounts.
+    """
+    def __init__(self, accounts):
+        self.labels = {}
+        entries = []
+        names = []
+        for account in accounts.tree():
+            del names[account.level:]
+            names.append(account.name)
+            if account.is_category:
+                continue
+            label = u" / ".join(names)
+            self.labels[account.pk] = label
+            for word in set(label.lower().split()):
+                entries.append((word, label.lower(), account.pk))
+        entries.sort()
+        self.words = [word for word, _, _ in entries]
+        self.pks = [pk for _, _, pk in entries]
+
+    def search(self, query, limit=MAX_RESULTS):
+        """(pk, label) of the accounts with a word starting with each word
+        of the query
+        """
+        terms = query.lower().split()
+        if not terms:
+            return []
+        results = []
+        seen = set()
+        start = bisect.bisect_left(self.words, terms[0])
+        for i in range(start, len(self.words)):
+            if not self.words[i].startswith(terms[0]):
+                break
+            pk = self.pks[i]
+            if pk in seen:
+                continue
+            seen.add(pk)
+            words = self.labels[pk].lower().split()
+            if all(any(word.startswith(term) for word in words)
+                   for term in terms[1:]):
+                results.append((pk, self.labels[pk]))
+                if len(results) == limit:
+                    break
+        return results
+
+
+def get_account_index(profile):
+    """Account index of the profile
+
+    Each process keeps the index of the last profiles used, and builds it
+    again once the version of the profile has been bumped.
+    """
+    profile_pk = profile.pk
+    key = profile_cache_key(profile_pk, "account-index")
+    with _lock:
+        cached = _indexes.pop(profile_pk, None)
+        if cached is not None and cached[0] == key:
+            _indexes[profile_pk] = cached
+            return cached[1]
+    index = AccountIndex(Account.objects.filter(profile=profile_pk))
+    with _lock:
+        _indexes[profile_pk] = (key, index)
+        while len(_indexes) > MAX_INDEXES:
+            _indexes.popitem(last=False)
+    return index
@@ -1,22 +1,145 @@
 import csv
 import datetime
+import logging
+import multiprocessing
 import os
+import re
 import subprocess
 
-from decimal import Decimal
+from contextlib import contextmanager
+from decimal import Decimal, InvalidOperation
+from multiprocessing.pool import ThreadPool
+from xml.sax.saxutils import unescape
 from django.db.models import Q
-from finance.accounts.models import Account, Transaction
+from django.utils import timezone
+from finance.accounts.models import (Account, ImportJob, ImportRow,
+                                     Transaction, transaction_fingerprint)
+
+CHUNK_SIZE = 500
+PDF_PAGES_PER_PROCESS = 4
+PDF_DATE_RE = re.compile(r"^\s*\d{1,2}/\d{1,2}\s")
+OFX_TAG_RE = re.compile(r"<(/?)([A-Za-z0-9.]+)>([^<]*)")
+OFX_READ_SIZE = 64 * 1024
+
+logger = logging.getLogger(__name__)
+
+
+def chunked(iterable, size):
+    """Lists of up to ``size`` items from the iterable"""
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def pdf_page_count(filename):
+    """Number of pages of the PDF according to pdfinfo, None if unknown"""
+    output = subprocess.Popen(["pdfinfo", filename],
+                              stdout=subprocess.PIPE).communicate()[0]
+    match = re.search(r"^Pages:\s+(\d+)", output, re.MULTILINE)
+    return int(match.group(1)) if match else None
+
+
+def pdf_to_text(filename, pages=None):
+    """Text of the PDF, or of a (first, last) range of its pages, read
+    from the pdftotext output
+    """
+    args = ["pdftotext", "-layout"]
+    if pages is not None:
+        args += ["-f", str(pages[0]), "-l", str(pages[1])]
+    return subprocess.Popen(args + [filename, "-"],
+                            stdout=subprocess.PIPE).communicate()[0]
+
+
+def pdf_lines(filename):
+    """Lines of the PDF text, in page order
+
+    Longer statements are split into page ranges that are converted by
+    concurrent pdftotext processes.
+    """
+    page_count = pdf_page_count(filename)
+    if not page_count or page_count <= PDF_PAGES_PER_PROCESS:
+        for line in pdf_to_text(filename).splitlines():
+            yield line
+        return
+    ranges = [(first, min(first + PDF_PAGES_PER_PROCESS - 1, page_count))
+              for first in range(1, page_count + 1, PDF_PAGES_PER_PROCESS)]
+    pool = ThreadPool(min(len(ranges), multiprocessing.cpu_count()))
+    try:
+        for text in pool.imap(lambda pages: pdf_to_text(filename, pages),
+                              ranges):
+            for line in text.splitlines():
+                yield line
+    finally:
+        pool.terminate()
+
+
+def ofx_tags(fp, size=OFX_READ_SIZE):
+    """(is closing, name, value) of each tag of an OFX/QFX file
+
+    The file is read ``size`` bytes at a time. Works for both the SGML
+    (OFX 1.x, leaf elements left open) and the XML (OFX 2.x) flavours.
+    """
+    def tag(match):
+        return (match.group(1) == "/", match.group(2).upper(),
+                unescape(match.group(3).strip()))
+
+    buf = ""
+    while True:
+        chunk = fp.read(size)
+        if not chunk:
+            break
+        buf += chunk
+        # the value of the last tag may continue in the next chunk
+        last = buf.rfind("<")
+        if last > 0:
+            for match in OFX_TAG_RE.finditer(buf, 0, last):
+                yield tag(match)
+            buf = buf[last:]
+    for match in OFX_TAG_RE.finditer(buf):
+        yield tag(match)
+
+
+def ofx_transactions(fp):
+    """Fields of each STMTTRN aggregate of an OFX/QFX file"""
+    fields = None
+    for closing, name, value in ofx_tags(fp):
+        if name == "STMTTRN":
+            if fields is not None:
+                yield fields
+            fields = None if closing else {}
+        elif fields is not None and not closing and value:
+            fields[name] = value
+    if fields is not None:
+        yield fields
+
+
+def get_file_type(filename):
+    _, file_ext = os.path.splitext(filename)
+    if ".pdf" == file_ext.lower():
+        return "PDF"
+    if file_ext.lower() in (".ofx", ".qfx"):
+        return "OFX"
+    return "CSV"
 
 
 class TransactionsImport():
     """Import transactions from file
 
-    Handle PDF, CSV file formats
+    Handle PDF, OFX/QFX, CSV file formats
 
     PDF:
     If PDF, convert to text and then extract trxs from
     lines in expected format
 
+    OFX/QFX:
+    Read the STMTTRN records, the bank's FITID is kept to detect
+    duplicates
+
     CSV:
     Format of file may be one of the following:
 
@@ -36,7 +159,8 @@ class TransactionsImport():
      - does a record exist where summary equals description?
      - if so, use that same account for the other side of the transaction
     2. Is this transaction a duplicate?
-     - does a record exist with the same post date and amount
+     - does a record, or an earlier row of the file, exist with the
+       same date, amount and summary
      - mark as duplicate
     """
 
@@ -44,51 +168,98 @@ class TransactionsImport():
         self.main_account_pk = main_account_pk
         self.main_account = Account.objects.get(pk=self.main_account_pk)
         self.filename = filename
+        # read instead of the file when given, e.g. the upload itself
+        self.fileobj = kwargs.get("fileobj")
         self.transactions = []
+        self.account_map = None
+        self.seen = set()
+        self.rejected = 0
         self.year = kwargs.get("year", datetime.date.today().year)
 
     def get_file_type(self):
-        filename, file_ext = os.path.splitext(self.filename)
-        if ".pdf" == file_ext.lower():
-            return "PDF"
-        return "CSV"
+        return get_file_type(self.filename)
+
+    @contextmanager
+    def open_file(self):
+        if self.fileobj is not None:
+            self.fileobj.seek(0)
+            yield self.fileobj
+        else:
+            with open(self.filename, "rb") as fp:
+                yield fp
 
     def parse_file(self):
         """Based on file ext, parse file and create transactions"""
+        self.transactions = list(self.iter_transactions())
 
-        file_type = self.get_file_type()
+    def iter_transactions(self, chunk_size=CHUNK_SIZE):
+        """Parsed transactions with their accounts set and duplicates
+        marked, read and checked ``chunk_size`` rows at a time
+        """
+        for chunk in chunked(self.read_rows(), chunk_size):
+            for trx in chunk:
+                self.set_accounts(trx)
+            self.mark_duplicates(chunk)
+            for trx in chunk:
+                yield trx
 
+    def read_rows(self):
+        """Transactions from the file, before they are classified"""
+        file_type = self.get_file_type()
         if file_type == "PDF":
-            temp_filename, _ = os.path.splitext(self.filename)
-            temp_file = "{0}.txt".format(temp_filename)
-            subprocess.Popen(["pdftotext", "-layout", self.filename,
-                              temp_file]).communicate()
-            with open(temp_file, "rb") as fp:
-                for row in fp:
-                    try:
-                        data = row.split(" " * 15)
-                        month, day = data[0].split("/")
-                        trx = {
-                            "date": datetime.date(int(self.year), int(month),
-                                                  int(day)),
-                            "summary": data[1].strip(),
-                            "amount": Decimal(data[-1].strip())
-                        }
-                        self.add_trx(trx)
-                    except Exception:
-                        pass
-            os.unlink(temp_file)
-        else:
-            with open(self.filename, 'rb') as fp:
-                filereader = csv.DictReader(fp, delimiter=',')
-                for row in filereader:
-                    trx = self.map_fields(row)
-                    self.add_trx(trx)
+            return self.read_pdf_rows()
+        if file_type == "OFX":
+            return self.read_ofx_rows()
+        return self.read_csv_rows()
+
+    def read_pdf_rows(self):
+        for line in pdf_lines(self.filename):
+            if not line.strip():
+                continue
+            trx = self.parse_pdf_line(line)
+            if trx is not None:
+                yield trx
+            elif PDF_DATE_RE.match(line):
+                # looks like a transaction but could not be read
+                self.rejected += 1
+                logger.info("Rejected line in %s: %r", self.filename, line)
+
+    def parse_pdf_line(self, line):
+        try:
+            data = line.split(" " * 15)
+            month, day = data[0].split("/")
+            return {
+                "date": datetime.date(int(self.year), int(month), int(day)),
+                "summary": data[1].strip(),
+                "amount": Decimal(data[-1].strip())
+            }
+        except (ValueError, IndexError, InvalidOperation):
+            return None
 
-    def add_trx(self, trx):
-        self.set_accounts(trx)
-        trx['DELETE'] = self.is_duplicate(trx)
-        self.transactions.append(trx)
+    def read_ofx_rows(self):
+        with self.open_file() as fp:
+            for fields in ofx_transactions(fp):
+                try:
+                    trx = {
+                        "date": datetime.datetime.strptime(
+                            fields["DTPOSTED"][:8], "%Y%m%d"
+                        ).date(),
+                        "summary": fields.get("NAME") or fields["MEMO"],
+                        "amount": Decimal(fields["TRNAMT"]),
+                        "external_id": fields.get("FITID", ""),
+                    }
+                except (KeyError, ValueError, InvalidOperation):
+                    self.rejected += 1
+                    logger.info("Rejected transaction in %s: %r",
+                                self.filename, fields)
+                    continue
+                yield trx
+
+    def read_csv_rows(self):
+        with self.open_file() as fp:
+            filereader = csv.DictReader(fp, delimiter=',')
+            for row in filereader:
+                yield self.map_fields(row)
 
     def map_fields(self, trx_import):
         """Map the respecitve fields"""
@@ -131,20 +302,113 @@ class TransactionsImport():
 
     def get_account(self, summary):
         """Look for other side of transaction based on description"""
-        res = Transaction.objects.filter(summary=summary).filter(
-            Q(account_debit__pk=self.main_account_pk) |
-            Q(account_credit__pk=self.main_account_pk)
-        ).first()
-        if res is None:
-            return None
-        if res.account_debit.pk == self.main_account_pk:
-            return res.account_credit.pk
-        return res.account_debit.pk
-
-    def is_duplicate(self, trx):
-        """Check whether transaction is a possible duplicate"""
-        return bool(Transaction.objects.filter(
-            summary=trx['summary'],
-            amount=trx['amount'],
-            date=trx['date']
-        ).first())
+        if self.account_map is None:
+            self.account_map = self.get_account_map()
+        return self.account_map.get(summary)
+
+    def get_account_map(self):
+        """Other side of the latest transaction of the main account
+        for each summary, from a single query
+        """
+        main_pk = self.main_account.pk
+        trxs = Transaction.objects.filter(
+            Q(account_debit=main_pk) | Q(account_credit=main_pk)
+        ).order_by("summary", "-date", "-pk").distinct("summary").values_list(
+            "summary", "account_debit", "account_credit"
+        )
+        return dict(
+            (summary, credit_pk if debit_pk == main_pk else debit_pk)
+            for summary, debit_pk, credit_pk in trxs
+        )
+
+    def get_fingerprint(self, trx):
+        # hashed as it is stored, so it matches the fingerprint the row
+        # and its transaction compute from the saved summary
+        return transaction_fingerprint(self.main_account.profile_id,
+                                       trx['date'], trx['amount'],
+                                       stored_summary(trx))
+
+    def mark_duplicates(self, trxs):
+        """Mark the transactions that are already in the system, or
+        earlier in the file, as duplicates
+
+        Transactions with a bank id are matched on it, the others on
+        their fingerprint, each with a single indexed query.
+        """
+        keys = [self.get_duplicate_key(trx) for trx in trxs]
+        external_ids = set(value for kind, value in keys if kind == "id")
+        fingerprints = set(value for kind, value in keys if kind != "id")
+        existing = set()
+        if external_ids:
+            trxs_ids = Transaction.objects.filter(
+                Q(account_debit=self.main_account.pk) |
+                Q(account_credit=self.main_account.pk),
+                external_id__in=external_ids
+            ).values_list("external_id", flat=True)
+            existing.update(("id", value) for value in trxs_ids)
+        if fingerprints:
+            trxs_fingerprints = Transaction.objects.filter(
+                fingerprint__in=fingerprints
+            ).values_list("fingerprint", flat=True)
+            existing.update(("fingerprint", value)
+                            for value in trxs_fingerprints)
+        for trx, key in zip(trxs, keys):
+            trx['DELETE'] = key in existing or key in self.seen
+            self.seen.add(key)
+
+    def get_duplicate_key(self, trx):
+        if trx.get('external_id'):
+            return ("id", trx['external_id'])
+        return ("fingerprint", self.get_fingerprint(trx))
+
+
+def stored_summary(trx):
+    """Summary of the transaction cut to the length it is stored with"""
+    return trx["summary"][:ImportRow._meta.get_field("summary").max_length]
+
+
+def import_row(job, position, trx):
+    """Staged row of an imported transaction"""
+    date = trx["date"]
+    if isinstance(date, datetime.datetime):
+        date = date.date()
+    row = ImportRow(job=job, position=position, date=date,
+                    amount=trx["amount"], summary=stored_summary(trx),
+                    account_debit_id=trx["account_debit"],
+                    account_credit_id=trx["account_credit"],
+                    external_id=trx.get("external_id", ""),
+                    is_duplicate=trx["DELETE"])
+    row.set_fingerprint()
+    return row
+
+
+def run_import_job(job, fileobj=None):
+    """Parse the file of a claimed job, or ``fileobj`` in its place
+
+    Every chunk of transactions is staged as import rows, for review on
+    the confirm page, and the progress saved. Temporary copies of uploads
+    are removed afterwards.
+    """
+    jobs = ImportJob.objects.filter(pk=job.pk)
+    kwargs = {"year": job.year} if job.year else {}
+    processed = 0
+    try:
+        parser = TransactionsImport(job.account_id, job.filename,
+                                    fileobj=fileobj, **kwargs)
+        for trxs in chunked(parser.iter_transactions(), CHUNK_SIZE):
+            ImportRow.objects.bulk_create([
+                import_row(job, processed + i, trx)
+                for i, trx in enumerate(trxs)
+            ])
+            processed += len(trxs)
+            jobs.update(processed=processed, updated=timezone.now())
+    except Exception as e:
+        logger.exception("Import job %s failed", job.pk)
+        ImportRow.objects.filter(job=job).delete()
+        jobs.update(status=ImportJob.FAILED, error=u"{0}".format(e),
+                    updated=timezone.now())
+    else:
+        jobs.update(status=ImportJob.DONE, processed=processed,
+                    rejected=parser.rejected, updated=timezone.now())
+    finally:
+        job.delete_file()
@@ -3,9 +3,10 @@ from django.contrib.auth.decorators import login_required
 from finance.accounts.views import (
     DashboardView, SettingsView, AccountTypeAddView, AccountTypeEditView,
     AccountTypeDeleteView, AccountView, AccountAddView, AccountEditView,
-    AccountDeleteView, AccountTransactionView, TransactionAddView,
-    TransactionEditView, TransactionDeleteView, TransactionImportView,
-    TransactionImportConfirmView, DataYearlyDebit, DataYearlyDebitVsCredit
+    AccountDeleteView, AccountAutocompleteView, AccountTransactionView,
+    TransactionAddView, TransactionEditView, TransactionDeleteView,
+    TransactionImportView, ImportJobView, ImportJobStatusView,
+    DataYearlyDebit, DataYearlyDebitVsCredit
 )
 
 
@@ -44,6 +45,8 @@ urlpatterns = patterns(
         name="accounts.account.edit"),
     url("^delete/(?P<pk>\d+)/$", login_required(AccountDeleteView.as_view()),
         name="accounts.account.delete"),
+    url("^autocomplete/$", login_required(AccountAutocompleteView.as_view()),
+        name="accounts.account.autocomplete"),
 
     # transactions
     url("^transaction/list/(?P<pk>[\d]+)/$",
@@ -60,7 +63,10 @@ urlpatterns = patterns(
     url("^transaction/import/$",
         login_required(TransactionImportView.as_view()),
         name="accounts.transaction.import"),
-    url("^transaction/import/confirm/$",
-        login_required(TransactionImportConfirmView.as_view()),
-        name="accounts.transaction.import.confirm"),
+    url("^transaction/import/(?P<pk>\d+)/$",
+        login_required(ImportJobView.as_view()),
+        name="accounts.transaction.import.job"),
+    url("^transaction/import/(?P<pk>\d+)/status/$",
+        login_required(ImportJobStatusView.as_view()),
+        name="accounts.transaction.import.job.status"),
 )
@@ -1,51 +1,48 @@
 from finance.accounts.models import Account, AccountType
+from finance.core.cache import get_or_set
 
 BLANK_OPTION = [("", "-" * 9)]
 
 
-def get_account_type_choices(user):
+def get_account_type_choices(profile):
     valid_options = [(x.pk, x.name) for x in AccountType.objects.filter(
-        profile__user=user
+        profile_id=profile.pk
     )]
     return BLANK_OPTION + valid_options
 
 
-def get_account_choices(user, categories_only=False):
-    options = Account.objects.filter(profile__user=user).exclude(
-        parent__isnull=False
+def get_account_choices(profile, categories_only=False):
+    """Account options grouped by account type, subaccounts below
+    their category
+
+    The options are built from a single query and kept in the cache
+    until the version of the profile is bumped.
+    """
+    options = get_or_set(
+        profile.pk,
+        "account-choices-{0}".format(
+            "categories" if categories_only else "all"
+        ),
+        lambda: build_account_choices(
+            Account.objects.filter(profile_id=profile.pk), categories_only
+        )
     )
-    if categories_only:
-        options = options.filter(is_category=True)
-    acct_type = None
-    valid_options = []
-    for option in options:
-        if option.account_type != acct_type:
-            acct_type = option.account_type
-            valid_options.append(("", acct_type.name))
-        if option.is_category:
-            pk = option.pk if categories_only else ""
-            valid_options.append((pk, "- {0}".format(option.name)))
-            valid_options = valid_options + get_suboptions(option, 1,
-                                                           categories_only)
-        else:
-            valid_options.append((option.pk, "- {0}".format(option.name)))
-    return BLANK_OPTION + valid_options
+    return BLANK_OPTION + options
 
 
-def get_suboptions(account, level, categories_only):
+def build_account_choices(accounts, categories_only=False):
+    acct_type = None
     options = []
-    subaccounts = account.subaccounts()
-    if categories_only:
-        subaccounts = subaccounts.filter(is_category=True)
-    for option in subaccounts:
+    for option in accounts.tree():
+        if categories_only and not option.is_category:
+            continue
+        if option.level == 0 and option.account_type != acct_type:
+            acct_type = option.account_type
+            options.append(("", acct_type.name))
         if option.is_category:
             pk = option.pk if categories_only else ""
-            options.append((pk, "{0} {1}".format("-" * (level + 1),
-                                                 option.name)))
-            new_level = level + 1
-            options = options + get_suboptions(option, new_level,
-                                               categories_only)
         else:
-            options.append((option.pk, "{0} {1}".format("-" * (level + 1),
-                                                        option.name)))
+            pk = option.pk
+        options.append((pk, "{0} {1}".format("-" * (option.level + 1),
+                                             option.name)))
     return options
@@ -1,10 +1,11 @@
 from django.contrib import messages
-from django.core.paginator import Paginator, PageNotAnInteger, EmptyPage
+from django.core.exceptions import ValidationError
 from django.core.urlresolvers import reverse_lazy, reverse
 from django.http import JsonResponse
-from django.shortcuts import render_to_response
+from django.shortcuts import get_object_or_404, redirect, render_to_response
 from django.template import RequestContext
 from django.template.loader import render_to_string
+from django.utils.http import urlencode
 from django.views.generic import (TemplateView, CreateView, UpdateView, View,
                                   DeleteView, ListView, FormView, DetailView)
 from finance.accounts.dashboard import (get_monthly_totals, get_debits_title,
@@ -12,11 +13,13 @@ from finance.accounts.dashboard import (get_monthly_totals, get_debits_title,
                                         get_monthly_debits_vs_credits)
 from finance.accounts.forms import (AccountTypeForm, TransactionImportForm,
                                     TransactionFormSet, AccountForm,
-                                    TransactionImportFormSet)
-from finance.accounts.models import AccountType, Account, Transaction
+                                    ImportRowFormSet, AccountAutocompleteInput)
+from finance.accounts.models import (AccountType, Account, ImportJob,
+                                     Transaction)
+from finance.accounts.pagination import LedgerPaginator
+from finance.accounts.search import get_account_index
 from finance.accounts.utils import (get_account_choices,
                                     get_account_type_choices)
-from finance.core.models import get_user_profile
 
 
 class DashboardView(TemplateView):
@@ -25,9 +28,8 @@ class DashboardView(TemplateView):
     def get_context_data(self, **kwargs):
         kwargs = super(DashboardView, self).get_context_data(**kwargs)
         kwargs["page"] = "dashboard"
-        profile = get_user_profile(self.request.user)
-        kwargs["debits_title"] = get_debits_title(profile)
-        kwargs["credits_title"] = get_credits_title(profile)
+        kwargs["debits_title"] = get_debits_title(self.request.profile)
+        kwargs["credits_title"] = get_credits_title(self.request.profile)
         return kwargs
 
 
@@ -37,7 +39,7 @@ class SettingsView(TemplateView):
     def get_context_data(self, **kwargs):
         kwargs = super(SettingsView, self).get_context_data(**kwargs)
         kwargs["account_types"] = AccountType.objects.filter(
-            profile__user=self.request.user
+            profile_id=self.request.profile.pk
         )
         return kwargs
 
@@ -48,7 +50,7 @@ class AccountTypeAddView(CreateView):
     form_class = AccountTypeForm
 
     def form_valid(self, form):
-        form.instance.profile = get_user_profile(self.request.user)
+        form.instance.profile_id = self.request.profile.pk
         response = super(AccountTypeAddView, self).form_valid(form)
         messages.success(self.request,
                          u"Successfully added Account Type {0}".format(
@@ -64,7 +66,7 @@ class AccountTypeEditView(UpdateView):
 
     def get_queryset(self):
         qs = super(AccountTypeEditView, self).get_queryset()
-        qs = qs.filter(profile__user=self.request.user)
+        qs = qs.filter(profile_id=self.request.profile.pk)
         return qs
 
     def form_valid(self, form):
@@ -82,7 +84,7 @@ class AccountTypeDeleteView(DeleteView):
 
     def get_queryset(self):
         qs = super(AccountTypeDeleteView, self).get_queryset()
-        qs = qs.filter(profile__user=self.request.user)
+        qs = qs.filter(profile_id=self.request.profile.pk)
         return qs
 
     def post(self, request, *args, **kwargs):
@@ -97,14 +99,15 @@ class AccountView(ListView):
 
     def get_queryset(self):
         qs = super(AccountView, self).get_queryset()
-        qs = qs.filter(profile__user=self.request.user).exclude(
-            parent__isnull=False
-        )
+        qs = qs.filter(profile_id=self.request.profile.pk)
         return qs
 
     def get_context_data(self, **kwargs):
         kwargs = super(AccountView, self).get_context_data(**kwargs)
         kwargs["page"] = "accounts"
+        kwargs["accounts"] = self.object_list.tree(
+            year=self.request.profile.year
+        )
         return kwargs
 
 
@@ -121,18 +124,19 @@ class AccountAddView(CreateView):
     def get_form(self, form_class):
         form = super(AccountAddView, self).get_form(form_class)
         form.fields["account_type"].choices = get_account_type_choices(
-            self.request.user
+            self.request.profile
+        )
+        form.fields["parent"].choices = get_account_choices(
+            self.request.profile, True
         )
-        parent_account_choices = get_account_choices(self.request.user, True)
-        form.fields["parent"].choices = parent_account_choices
         return form
 
     def form_valid(self, form):
-        form.instance.profile = get_user_profile(self.request.user)
+        form.instance.profile_id = self.request.profile.pk
         response = super(AccountAddView, self).form_valid(form)
         if self.request.is_ajax():
-            account_options = get_account_choices(self.request.user)
-            parent_options = get_account_choices(self.request.user, True)
+            account_options = get_account_choices(self.request.profile)
+            parent_options = get_account_choices(self.request.profile, True)
             return JsonResponse(
                 {"result": render_to_string("options.html",
                                             {"options": account_options}),
@@ -166,15 +170,16 @@ class AccountEditView(UpdateView):
     def get_form(self, form_class):
         form = super(AccountEditView, self).get_form(form_class)
         form.fields["account_type"].choices = get_account_type_choices(
-            self.request.user
+            self.request.profile
+        )
+        form.fields["parent"].choices = get_account_choices(
+            self.request.profile, True
         )
-        form.fields["parent"].choices = get_account_choices(self.request.user,
-                                                            True)
         return form
 
     def get_queryset(self):
         qs = super(AccountEditView, self).get_queryset()
-        qs = qs.filter(profile__user=self.request.user)
+        qs = qs.filter(profile_id=self.request.profile.pk)
         return qs
 
     def form_valid(self, form):
@@ -192,7 +197,7 @@ class AccountDeleteView(DeleteView):
 
     def get_queryset(self):
         qs = super(AccountDeleteView, self).get_queryset()
-        qs = qs.filter(profile__user=self.request.user)
+        qs = qs.filter(profile_id=self.request.profile.pk)
         return qs
 
     def post(self, request, *args, **kwargs):
@@ -208,26 +213,39 @@ class AccountTransactionView(DetailView):
 
     def get_queryset(self):
         qs = super(AccountTransactionView, self).get_queryset()
-        qs = qs.filter(profile__user=self.request.user)
+        qs = qs.filter(profile_id=self.request.profile.pk)
         return qs
 
     def get_context_data(self, **kwargs):
         kwargs = super(AccountTransactionView, self).get_context_data(**kwargs)
         kwargs["page"] = "accounts"
-        paginator = Paginator(kwargs["object"].transactions(), 25)
-        page = self.request.GET.get("page")
-        try:
-            trxs = paginator.page(page)
-        except PageNotAnInteger:
-            trxs = paginator.page(1)
-        except EmptyPage:
-            trxs = paginator.page(paginator.num_pages)
-        kwargs["trxs"] = trxs
-        kwargs["page_number"] = page
+        paginator = LedgerPaginator(kwargs["object"], 25)
+        kwargs["trxs"] = paginator.page(
+            before=self.request.GET.get("before"),
+            after=self.request.GET.get("after"),
+            number=self.request.GET.get("page")
+        )
 
         return kwargs
 
 
+class LedgerRedirectMixin(object):
+    """Return to the ledger page the transaction was changed from"""
+    def get_success_url(self):
+        if "next" in self.request.GET:
+            position = dict(
+                (key, self.request.GET[key])
+                for key in ("before", "after", "page")
+                if key in self.request.GET
+            ) or {"page": 1}
+            return "{0}?{1}".format(
+                reverse("accounts.transaction.list.by_account",
+                        args=[self.request.GET["next"]]),
+                urlencode(position)
+            )
+        return super(LedgerRedirectMixin, self).get_success_url()
+
+
 class TransactionAddView(FormView):
     template_name = "accounts/transaction_add.html"
     form_class = TransactionFormSet
@@ -235,53 +253,41 @@ class TransactionAddView(FormView):
 
     def get_form_kwargs(self):
         kwargs = super(TransactionAddView, self).get_form_kwargs()
-        kwargs["user"] = self.request.user
+        kwargs["profile"] = self.request.profile
         return kwargs
 
     def get_context_data(self, **kwargs):
         kwargs = super(TransactionAddView, self).get_context_data(**kwargs)
         kwargs["page"] = "accounts"
-        kwargs["form_account"] = AccountForm(user=self.request.user)
+        kwargs["form_account"] = AccountForm(profile=self.request.profile)
         return kwargs
 
     def form_valid(self, form):
-        added_trx_count = 0
-        for f in form:
-            if f.cleaned_data:
-                f.save()
-                added_trx_count += 1
+        trxs = form.save()
         response = super(TransactionAddView, self).form_valid(form)
         messages.success(self.request,
                          u"Successfully added {0} Transaction(s)".format(
-                             added_trx_count
+                             len(trxs)
                          ))
         return response
 
 
-class TransactionEditView(UpdateView):
+class TransactionEditView(LedgerRedirectMixin, UpdateView):
     model = Transaction
     success_url = reverse_lazy("accounts.account.list")
 
-    def get_success_url(self):
-        if "next" in self.request.GET:
-            page = self.request.GET.get("page", 1)
-            return "{0}?page={1}".format(
-                reverse("accounts.transaction.list.by_account",
-                        args=[self.request.GET["next"]]),
-                page
-            )
-        return super(TransactionEditView, self).get_success_url()
-
     def get_queryset(self):
         qs = super(TransactionEditView, self).get_queryset()
-        qs = qs.filter(account_debit__profile__user=self.request.user)
+        qs = qs.filter(account_debit__profile_id=self.request.profile.pk)
         return qs
 
     def get_form(self, form_class):
         form = super(TransactionEditView, self).get_form(form_class)
-        account_choices = get_account_choices(self.request.user)
-        form.fields["account_debit"].choices = account_choices
-        form.fields["account_credit"].choices = account_choices
+        labels = get_account_index(self.request.profile).labels
+        accounts = Account.objects.filter(profile_id=self.request.profile.pk)
+        for name in ("account_debit", "account_credit"):
+            form.fields[name].widget = AccountAutocompleteInput(labels=labels)
+            form.fields[name].queryset = accounts
         return form
 
     def get_context_data(self, **kwargs):
@@ -295,23 +301,13 @@ class TransactionEditView(UpdateView):
         return response
 
 
-class TransactionDeleteView(DeleteView):
+class TransactionDeleteView(LedgerRedirectMixin, DeleteView):
     model = Transaction
     success_url = reverse_lazy("accounts.account.list")
 
-    def get_success_url(self):
-        if "next" in self.request.GET:
-            page = self.request.GET.get("page", 1)
-            return "{0}?page={1}".format(
-                reverse("accounts.transaction.list.by_account",
-                        args=[self.request.GET["next"]]),
-                page
-            )
-        return super(TransactionDeleteView, self).get_success_url()
-
     def get_queryset(self):
         qs = super(TransactionDeleteView, self).get_queryset()
-        qs = qs.filter(account_debit__profile__user=self.request.user)
+        qs = qs.filter(account_debit__profile_id=self.request.profile.pk)
         return qs
 
     def post(self, request, *args, **kwargs):
@@ -333,57 +329,135 @@ class TransactionImportView(FormView):
 
     def get_form_kwargs(self):
         kwargs = super(TransactionImportView, self).get_form_kwargs()
-        kwargs["user"] = self.request.user
+        kwargs["profile"] = self.request.profile
         return kwargs
 
     def form_valid(self, form):
-        formset = TransactionImportFormSet(initial=form.process_file(),
-                                           user=self.request.user)
-        form_account = AccountForm(user=self.request.user)
-        return render_to_response(
-            "accounts/transaction_import_confirm.html",
-            self.get_context_data(form=formset, form_account=form_account),
-            context_instance=RequestContext(self.request)
-        )
+        job = form.create_job()
+        return redirect("accounts.transaction.import.job", pk=job.pk)
 
 
-class TransactionImportConfirmView(FormView):
-    template_name = "accounts/transaction_import_confirm.html"
-    form_class = TransactionImportFormSet
-    success_url = reverse_lazy("accounts.account.list")
+class ImportJobView(DetailView):
+    """Progress of an import job, and the review of its staged rows once
+    it is done
 
-    def get_form_kwargs(self):
-        kwargs = super(TransactionImportConfirmView, self).get_form_kwargs()
-        kwargs["user"] = self.request.user
-        return kwargs
+    The rows are reviewed a page at a time, each page saving its changes
+    before moving to another, and confirming adds the rows that are not
+    duplicates as transactions.
+    """
+    model = ImportJob
+    template_name = "accounts/transaction_import_job.html"
+    paginate_by = 50
+
+    def get_queryset(self):
+        qs = super(ImportJobView, self).get_queryset()
+        qs = qs.filter(profile_id=self.request.profile.pk)
+        return qs
+
+    def get_page_number(self):
+        pages = max(self.object.processed - 1, 0) // self.paginate_by + 1
+        try:
+            number = int(self.request.GET.get("page", 1))
+        except ValueError:
+            number = 1
+        return min(max(number, 1), pages), pages
+
+    def get_formset(self, data=None):
+        # rows are numbered from 0 in the order of the statement, so a
+        # page is a range of positions
+        start = (self.page_number - 1) * self.paginate_by
+        rows = self.object.rows.select_related("job").filter(
+            position__gte=start, position__lt=start + self.paginate_by
+        )
+        return ImportRowFormSet(data, queryset=rows,
+                                profile=self.request.profile)
+
+    def get_page_url(self, number=None):
+        return "{0}?{1}".format(
+            reverse("accounts.transaction.import.job", args=[self.object.pk]),
+            urlencode({"page": number or self.page_number})
+        )
 
     def get_context_data(self, **kwargs):
-        kwargs = super(TransactionImportConfirmView,
-                       self).get_context_data(**kwargs)
+        kwargs = super(ImportJobView, self).get_context_data(**kwargs)
         kwargs["page"] = "accounts"
-        kwargs["form_account"] = AccountForm(user=self.request.user)
         return kwargs
 
-    def form_valid(self, form):
-        import_trx_count = 0
-        for f in form:
-            if not f.cleaned_data["DELETE"]:
-                f.save()
-                import_trx_count += 1
-        messages.success(self.request,
-                         "Successfully added {0} Transactions".format(
-                             import_trx_count
-                         ))
-        return super(TransactionImportConfirmView, self).form_valid(form)
+    def render_to_response(self, context, **response_kwargs):
+        if self.object.status == ImportJob.DONE:
+            return self.render_review(context)
+        return super(ImportJobView, self).render_to_response(
+            context, **response_kwargs
+        )
+
+    def render_review(self, context, formset=None):
+        self.page_number, pages = self.get_page_number()
+        if formset is None:
+            formset = self.get_formset()
+        context["form"] = formset
+        context["form_account"] = AccountForm(profile=self.request.profile)
+        context["page_number"] = self.page_number
+        context["pages"] = pages
+        return render_to_response(
+            "accounts/transaction_import_confirm.html", context,
+            context_instance=RequestContext(self.request)
+        )
+
+    def post(self, request, *args, **kwargs):
+        self.object = self.get_object()
+        if self.object.status != ImportJob.DONE:
+            return redirect("accounts.transaction.import.job",
+                            pk=self.object.pk)
+        self.page_number = self.get_page_number()[0]
+        formset = self.get_formset(request.POST)
+        if not formset.is_valid():
+            return self.render_review(
+                self.get_context_data(object=self.object), formset
+            )
+        formset.save()
+        if "goto" in request.POST:
+            # the pager submits the page, so moving on keeps its changes
+            return redirect(self.get_page_url(request.POST["goto"]))
+        if "confirm" not in request.POST:
+            messages.success(request, "Saved changes")
+            return redirect(self.get_page_url())
+        try:
+            count = self.object.promote()
+        except ValidationError as e:
+            messages.error(request, e.messages[0])
+            return redirect(self.get_page_url())
+        messages.success(request,
+                         "Successfully added {0} Transactions".format(count))
+        return redirect("accounts.account.list")
+
+
+class ImportJobStatusView(View):
+    def get(self, request, pk):
+        job = get_object_or_404(ImportJob, pk=pk,
+                                profile_id=request.profile.pk)
+        return JsonResponse({
+            "status": job.status,
+            "processed": job.processed,
+            "rejected": job.rejected,
+            "error": job.error,
+        })
+
+
+class AccountAutocompleteView(View):
+    def get(self, request):
+        index = get_account_index(request.profile)
+        return JsonResponse({"results": [
+            {"id": pk, "text": label}
+            for pk, label in index.search(request.GET.get("q", ""))
+        ]})
 
 
 class DataYearlyDebit(View):
     def get(self, request):
-        profile = get_user_profile(request.user)
-        return JsonResponse(get_monthly_totals(profile))
+        return JsonResponse(get_monthly_totals(request.profile))
 
 
 class DataYearlyDebitVsCredit(View):
     def get(self, request):
-        profile = get_user_profile(request.user)
-        return JsonResponse(get_monthly_debits_vs_credits(profile), safe=False)
+        return JsonResponse(get_monthly_debits_vs_credits(request.profile),
+                            safe=False)
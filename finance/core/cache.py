@@ -0,0 +1,78 @@
+"""Versioned cache keys for the values derived from the data of a profile
+
+The versions live in the database, so a bump made by one process is seen
+by all of them, and it commits together with the change it invalidates.
+"""
+import time
+
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from finance.core.models import CacheVersion
+
+
+def initial_version():
+    # values cached against an older database, e.g. before the tables
+    # were recreated, must not be picked up again
+    return int(time.time() * 1000)
+
+
+def version_key(profile_pk, year=None):
+    if year is None:
+        return "profile-{0}-version".format(profile_pk)
+    return "profile-{0}-{1}-version".format(profile_pk, year)
+
+
+def get_versions(keys):
+    versions = dict(CacheVersion.objects.filter(key__in=keys).values_list(
+        "key", "version"
+    ))
+    for key in keys:
+        if key not in versions:
+            versions[key] = CacheVersion.objects.get_or_create(
+                key=key, defaults={"version": initial_version()}
+            )[0].version
+    return [versions[key] for key in keys]
+
+
+def profile_cache_key(profile_pk, name, year=None):
+    """Cache key of a value derived from the data of a profile
+
+    The key carries the version of the profile, and of the year for
+    values of a single year, so it changes as soon as either is bumped.
+    """
+    keys = [version_key(profile_pk)]
+    if year is not None:
+        keys.append(version_key(profile_pk, year))
+    versions = get_versions(keys)
+    if year is None:
+        return "profile-{0}.{1}-{2}".format(profile_pk, versions[0], name)
+    return "profile-{0}.{1}-{2}.{3}-{4}".format(
+        profile_pk, versions[0], year, versions[1], name
+    )
+
+
+def get_or_set(profile_pk, name, func, year=None):
+    """Cached value of ``func()`` for the profile (and year)"""
+    cache_key = profile_cache_key(profile_pk, name, year)
+    value = cache.get(cache_key)
+    if value is None:
+        value = func()
+        cache.set(cache_key, value)
+    return value
+
+
+def bump_version(profile_pk, year=None):
+    """Invalidate every cached value of the profile, or only those of
+    one year
+    """
+    key = version_key(profile_pk, year)
+    versions = CacheVersion.objects.filter(key=key)
+    if versions.update(version=F("version") + 1):
+        return
+    try:
+        with transaction.atomic():
+            CacheVersion.objects.create(key=key, version=initial_version())
+    except IntegrityError:
+        # another writer created the version first
+        versions.update(version=F("version") + 1)
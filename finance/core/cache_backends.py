@@ -0,0 +1,78 @@
+import threading
+import time
+
+from collections import OrderedDict
+from django.core.cache import caches
+from django.core.cache.backends.base import BaseCache, DEFAULT_TIMEOUT
+
+
+class TwoTierCache(BaseCache):
+    """Bounded in-process LRU in front of a shared cache
+
+    Reads are served from the memory of the process when they can be and
+    fall back to the shared cache, writes go to both. Nothing tells the
+    other processes about a write, so this is meant for values stored
+    under versioned keys (see ``finance.core.cache``): a value is never
+    changed in place, a new version simply uses a new key, and the old
+    entries drop out of the LRU.
+    """
+    def __init__(self, location, params):
+        super(TwoTierCache, self).__init__(params)
+        options = params.get("OPTIONS", {})
+        self._shared_alias = options.get("SHARED", "shared")
+        self._local = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def shared(self):
+        return caches[self._shared_alias]
+
+    def _get_local(self, key):
+        with self._lock:
+            try:
+                expiry, value = self._local.pop(key)
+            except KeyError:
+                return None
+            if expiry is not None and expiry <= time.time():
+                return None
+            # most recently used entries are kept at the end
+            self._local[key] = (expiry, value)
+            return value
+
+    def _set_local(self, key, value, timeout):
+        expiry = self.get_backend_timeout(timeout)
+        with self._lock:
+            self._local.pop(key, None)
+            self._local[key] = (expiry, value)
+            while len(self._local) > self._max_entries:
+                self._local.popitem(last=False)
+
+    def get(self, key, default=None, version=None):
+        local_key = self.make_key(key, version=version)
+        value = self._get_local(local_key)
+        if value is None:
+            value = self.shared.get(key, version=version)
+            if value is None:
+                return default
+            self._set_local(local_key, value, DEFAULT_TIMEOUT)
+        return value
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self.shared.set(key, value, timeout, version=version)
+        self._set_local(self.make_key(key, version=version), value, timeout)
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        if not self.shared.add(key, value, timeout, version=version):
+            return False
+        self._set_local(self.make_key(key, version=version), value, timeout)
+        return True
+
+    def delete(self, key, version=None):
+        with self._lock:
+            self._local.pop(self.make_key(key, version=version), None)
+        self.shared.delete(key, version=version)
+
+    def clear(self):
+        with self._lock:
+            self._local.clear()
+        self.shared.clear()
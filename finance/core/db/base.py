@@ -0,0 +1,20 @@
+"""PostgreSQL backend that logs the slow statements
+
+Same as ``django.db.backends.postgresql_psycopg2``, with the cursors
+wrapped while ``settings.SLOW_QUERY_MS`` is set, see
+``finance.core.slow_queries``.
+"""
+from django.db.backends.postgresql_psycopg2.base import *  # NOQA
+from django.db.backends.postgresql_psycopg2.base import (
+    DatabaseWrapper as BaseDatabaseWrapper
+)
+from finance.core.slow_queries import SlowQueryCursorWrapper, get_threshold
+
+
+class DatabaseWrapper(BaseDatabaseWrapper):
+    def create_cursor(self):
+        cursor = super(DatabaseWrapper, self).create_cursor()
+        threshold = get_threshold()
+        if threshold is None:
+            return cursor
+        return SlowQueryCursorWrapper(cursor, self, threshold)
@@ -0,0 +1,113 @@
+"""Identity map of the instances of the current profile loaded during a
+request
+
+Querysets of models that opt in register the instances they load, and the
+foreign keys of the instances that are added or attached are filled from
+the map, so following ``account.profile`` or ``trx.account_debit`` to an
+instance that has already been loaded does not query it again.
+"""
+import threading
+
+_local = threading.local()
+
+
+class IdentityMap(object):
+    def __init__(self, profile_id=None):
+        self.profile_id = profile_id
+        self.instances = {}
+
+    def key(self, instance):
+        return (instance._meta.concrete_model, instance.pk)
+
+    def belongs(self, instance):
+        """Only instances of the current profile are kept"""
+        if self.profile_id is None:
+            return False
+        if instance._meta.model_name == "profile":
+            return instance.pk == self.profile_id
+        return getattr(instance, "profile_id", None) == self.profile_id
+
+    def get(self, model, pk):
+        return self.instances.get((model._meta.concrete_model, pk))
+
+    def add(self, instance):
+        """Register the instance, and its related instances that are
+        already loaded, and fill its foreign keys from the map
+        """
+        if instance.pk is None or not self.belongs(instance):
+            return instance
+        self.instances[self.key(instance)] = instance
+        for field in instance._meta.concrete_fields:
+            if field.rel is None or not field.rel.to:
+                continue
+            cache_name = field.get_cache_name()
+            related = getattr(instance, cache_name, None)
+            if related is not None:
+                if self.belongs(related):
+                    self.instances.setdefault(self.key(related), related)
+                continue
+            related = self.get(field.rel.to, getattr(instance, field.attname))
+            if related is not None:
+                setattr(instance, cache_name, related)
+        return instance
+
+    def attach(self, objs, *field_names):
+        """Fill the foreign keys ``field_names`` of the objects from the
+        map, loading the instances that are not in it with a single query
+        per field
+        """
+        objs = list(objs)
+        if not objs:
+            return objs
+        for name in field_names:
+            field = objs[0]._meta.get_field(name)
+            model = field.rel.to
+            pks = set(getattr(obj, field.attname) for obj in objs)
+            pks.discard(None)
+            loaded = dict(
+                (pk, self.get(model, pk)) for pk in pks
+                if self.get(model, pk) is not None
+            )
+            missing = pks - set(loaded)
+            if missing:
+                for instance in model._default_manager.filter(pk__in=missing):
+                    loaded[instance.pk] = self.add(instance)
+            for obj in objs:
+                pk = getattr(obj, field.attname)
+                if pk in loaded:
+                    setattr(obj, field.get_cache_name(), loaded[pk])
+        return objs
+
+    def clear(self):
+        self.instances.clear()
+
+
+def activate(profile=None):
+    """Start the identity map of a request"""
+    identity_map = IdentityMap(profile.pk if profile is not None else None)
+    if profile is not None:
+        identity_map.add(profile)
+    _local.identity_map = identity_map
+    return identity_map
+
+
+def deactivate():
+    _local.identity_map = None
+
+
+def get_identity_map():
+    """Identity map of the current request, or an empty one that keeps
+    nothing outside of requests
+    """
+    identity_map = getattr(_local, "identity_map", None)
+    if identity_map is None:
+        return IdentityMap()
+    return identity_map
+
+
+class IdentityMapQuerySetMixin(object):
+    """QuerySet registering the instances it loads in the identity map"""
+    def iterator(self):
+        identity_map = get_identity_map()
+        for instance in super(IdentityMapQuerySetMixin, self).iterator():
+            yield identity_map.add(instance)
@@ -0,0 +1,49 @@
+from optparse import make_option
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils.six import StringIO
+from finance.core.profiling import categorize, read_profiles
+
+
+class Command(BaseCommand):
+    help = "Merge the request profiles into a report per view"
+
+    option_list = BaseCommand.option_list + (
+        make_option("--dir", dest="dir", default=None,
+                    help="Directory of the profiles, PROFILE_DIR by default"),
+        make_option("--view", action="append", dest="views", default=[],
+                    help="Only report this URL name, can be repeated"),
+        make_option("--limit", dest="limit", type="int", default=20,
+                    help="Number of functions to show per view"),
+        make_option("--sort", dest="sort", default="cumulative",
+                    help="pstats sort key of the functions"),
+    )
+
+    def handle(self, *args, **options):
+        profiles = read_profiles(options["dir"] or settings.PROFILE_DIR,
+                                 options["views"])
+        if not profiles:
+            self.stdout.write("No profiles found")
+            return
+        # slowest views first, by the time of an average request
+        ranked = sorted(profiles.items(),
+                        key=lambda item: item[1][0].total_tt / item[1][1],
+                        reverse=True)
+        for url_name, (stats, count) in ranked:
+            self.stdout.write(
+                "{0}: {1} request(s), {2:.1f} ms per request".format(
+                    url_name, count, stats.total_tt * 1000 / count
+                )
+            )
+            total = stats.total_tt or 1
+            for name, seconds in categorize(stats).items():
+                self.stdout.write("  {0}: {1:.1f}%".format(
+                    name, seconds * 100 / total
+                ))
+            stream = StringIO()
+            stats.stream = stream
+            # the header would list every profile merged
+            stats.files = []
+            stats.sort_stats(options["sort"]).print_stats(options["limit"])
+            self.stdout.write(stream.getvalue())
@@ -0,0 +1,42 @@
+from optparse import make_option
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from finance.core.slow_queries import read_log, top_offenders
+
+
+class Command(BaseCommand):
+    help = "Summarize the slow query log by total time"
+
+    option_list = BaseCommand.option_list + (
+        make_option("--log", dest="log", default=None,
+                    help="Slow query log to read, SLOW_QUERY_LOG by default"),
+        make_option("--limit", dest="limit", type="int", default=10,
+                    help="Number of statements to show"),
+        make_option("--plans", action="store_true", dest="plans",
+                    default=False,
+                    help="Show the plan of the slowest run of each statement"),
+    )
+
+    def handle(self, *args, **options):
+        offenders = top_offenders(
+            read_log(options["log"] or settings.SLOW_QUERY_LOG),
+            options["limit"]
+        )
+        if not offenders:
+            self.stdout.write("No slow queries logged")
+        for n, offender in enumerate(offenders, 1):
+            self.stdout.write(
+                "{0}. {1:.1f} ms total, {2} run(s), {3:.1f} ms max".format(
+                    n, offender["total_ms"], offender["count"],
+                    offender["max_ms"]
+                )
+            )
+            self.stdout.write("   at {0}".format(offender["location"]))
+            self.stdout.write("   views: {0}".format(
+                ", ".join(offender["views"]) or "-"
+            ))
+            self.stdout.write("   {0}".format(offender["sql"]))
+            if options["plans"] and offender["plan"]:
+                for line in offender["plan"].splitlines():
+                    self.stdout.write("     {0}".format(line))
@@ -1,9 +1,131 @@
-from finance.core.models import Profile
+import cProfile
+import json
+import logging
+
+from django.conf import settings
+from django.db import connection
+from django.utils.functional import SimpleLazyObject
+from finance.core import identity, profiling, slow_queries
+from finance.core.models import get_request_profile
+
+query_logger = logging.getLogger("finance.queries")
+
+
+class ProfileMiddleware(object):
+    """Set ``request.profile``, resolved the first time it is used"""
+    def process_request(self, request):
+        request.profile = SimpleLazyObject(
+            lambda: get_request_profile(request)
+        )
 
 
 class ProfileContextMiddleware(object):
     def process_template_response(self, request, response):
         if request.user.is_authenticated():
-            profile = Profile.objects.get(user=request.user)
-            response.context_data["profile"] = profile
+            response.context_data["profile"] = request.profile
+        return response
+
+
+class IdentityMapMiddleware(object):
+    """Identity map of the instances of the request profile, dropped once
+    the response has been made
+    """
+    def process_request(self, request):
+        if request.user.is_authenticated():
+            identity.activate(request.profile)
+        else:
+            identity.activate()
+
+    def process_response(self, request, response):
+        identity.deactivate()
         return response
+
+    def process_exception(self, request, exception):
+        identity.deactivate()
+
+
+class QueryCountMiddleware(object):
+    """Count the queries of each request and the time spent in them
+
+    The totals are sent as the ``X-Query-Count`` and ``X-Query-Time``
+    (milliseconds) headers and logged as JSON with the name of the URL.
+    Only on with ``DEBUG`` or ``QUERY_COUNT``, since every query of the
+    request is kept in memory to count it. Goes first so the queries of
+    the other middleware are counted too.
+    """
+    def process_request(self, request):
+        if not (settings.DEBUG or getattr(settings, "QUERY_COUNT", False)):
+            return
+        request._query_debug_cursor = connection.use_debug_cursor
+        connection.use_debug_cursor = True
+        request._query_start = len(connection.queries)
+
+    def process_response(self, request, response):
+        if not hasattr(request, "_query_start"):
+            return response
+        queries = connection.queries[request._query_start:]
+        connection.use_debug_cursor = request._query_debug_cursor
+        count = len(queries)
+        time = sum(float(query["time"]) for query in queries) * 1000
+        response["X-Query-Count"] = str(count)
+        response["X-Query-Time"] = "{0:.1f}".format(time)
+        match = getattr(request, "resolver_match", None)
+        query_logger.info(json.dumps({
+            "url_name": match.url_name if match is not None else None,
+            "method": request.method,
+            "status": response.status_code,
+            "queries": count,
+            "time_ms": round(time, 1),
+        }, sort_keys=True))
+        return response
+
+
+class SlowQueryMiddleware(object):
+    """Name the view the slow statements of the request are logged with"""
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        match = getattr(request, "resolver_match", None)
+        if match is not None and match.url_name:
+            slow_queries.set_view(match.url_name)
+        else:
+            slow_queries.set_view("{0}.{1}".format(
+                view_func.__module__, view_func.__name__
+            ))
+
+    def process_response(self, request, response):
+        slow_queries.set_view(None)
+        return response
+
+    def process_exception(self, request, exception):
+        slow_queries.set_view(None)
+
+
+class ProfilingMiddleware(object):
+    """Profile the view and the rendering of its response for a sample of
+    the requests, see finance.core.profiling
+
+    Goes last so the profile starts right before the view.
+    """
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        match = getattr(request, "resolver_match", None)
+        url_name = match.url_name if match is not None else None
+        if url_name and profiling.should_profile(request, url_name):
+            request._profile_url_name = url_name
+            request._profiler = cProfile.Profile()
+            request._profiler.enable()
+
+    def process_response(self, request, response):
+        self.dump(request)
+        return response
+
+    def process_exception(self, request, exception):
+        # failed requests are often the slow ones, keep their profile too
+        self.dump(request)
+
+    def dump(self, request):
+        profiler = getattr(request, "_profiler", None)
+        if profiler is not None:
+            profiler.disable()
+            del request._profiler
+            profiler.dump_stats(
+                profiling.profile_path(request._profile_url_name)
+            )
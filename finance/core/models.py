@@ -4,10 +4,38 @@ from django.contrib.auth.models import User
 from django.db import models
 
 
+PROFILE_SESSION_KEY = "_profile"
+
+
 def get_user_profile(user):
     return Profile.objects.get(user=user)
 
 
+def get_request_profile(request):
+    """Profile of the logged in user
+
+    The fields are kept in the session so later requests build the
+    profile without a query, until ``forget_request_profile`` drops them.
+    """
+    if not request.user.is_authenticated():
+        return None
+    fields = request.session.get(PROFILE_SESSION_KEY)
+    if fields is None or fields["user_id"] != request.user.pk:
+        profile = get_user_profile(request.user)
+        request.session[PROFILE_SESSION_KEY] = {
+            "id": profile.pk,
+            "user_id": profile.user_id,
+            "is_active": profile.is_active,
+            "current_year": profile.current_year,
+        }
+        return profile
+    return Profile(**fields)
+
+
+def forget_request_profile(request):
+    request.session.pop(PROFILE_SESSION_KEY, None)
+
+
 class Profile(models.Model):
     user = models.ForeignKey(User, unique=True)
     is_active = models.BooleanField(default=True)
@@ -22,3 +50,15 @@ class Profile(models.Model):
         if self.current_year is not None:
             return self.current_year
         return datetime.date.today().year
+
+
+class CacheVersion(models.Model):
+    """Version of a group of cached values, shared by every process
+
+    Bumped in the same database transaction as the change it invalidates.
+    """
+    key = models.CharField(max_length=100, unique=True)
+    version = models.BigIntegerField()
+
+    def __unicode__(self):
+        return u"{0}: {1}".format(self.key, self.version)
@@ -0,0 +1,90 @@
+"""Profiles of a sample of the requests
+
+Off unless ``settings.PROFILE_SAMPLE_RATE`` is set. ``ProfilingMiddleware``
+runs cProfile over the view and the rendering of its response for that
+share of the requests, optionally only those of the URL names in
+``PROFILE_URL_NAMES`` or of the users in ``PROFILE_USERS``, and dumps the
+stats of each request to ``PROFILE_DIR/<url name>/``.
+``manage.py profile_report`` merges them per view.
+"""
+import os
+import pstats
+import random
+import threading
+import time
+
+from collections import OrderedDict
+from django.conf import settings
+
+# where the time of a view goes, by the file or function it is spent in
+CATEGORIES = (
+    ("ORM", ("django/db/",)),
+    ("templates", ("django/template/", "templatetags")),
+    ("decimal", ("decimal",)),
+    ("importer", ("finance/accounts/trx_import.py",)),
+)
+
+
+def get_sample_rate():
+    return float(getattr(settings, "PROFILE_SAMPLE_RATE", None) or 0)
+
+
+def should_profile(request, url_name):
+    """Whether the request is in the sample"""
+    rate = get_sample_rate()
+    if rate <= 0:
+        return False
+    url_names = getattr(settings, "PROFILE_URL_NAMES", None)
+    if url_names and url_name not in url_names:
+        return False
+    users = getattr(settings, "PROFILE_USERS", None)
+    if users and (not request.user.is_authenticated() or
+                  request.user.get_username() not in users):
+        return False
+    return random.random() < rate
+
+
+def profile_path(url_name):
+    """File the profile of a request to ``url_name`` is dumped to"""
+    directory = os.path.join(settings.PROFILE_DIR, url_name)
+    if not os.path.isdir(directory):
+        try:
+            os.makedirs(directory)
+        except OSError:
+            # made by another thread or process meanwhile
+            pass
+    return os.path.join(directory, "{0:.6f}-{1}-{2}.pstats".format(
+        time.time(), os.getpid(), threading.current_thread().ident
+    ))
+
+
+def read_profiles(directory, url_names=None):
+    """Stats of each view merged, with the number of requests profiled"""
+    profiles = OrderedDict()
+    if not os.path.isdir(directory):
+        return profiles
+    for url_name in sorted(os.listdir(directory)):
+        if url_names and url_name not in url_names:
+            continue
+        path = os.path.join(directory, url_name)
+        if not os.path.isdir(path):
+            continue
+        filenames = sorted(
+            os.path.join(path, name) for name in os.listdir(path)
+            if name.endswith(".pstats")
+        )
+        if filenames:
+            profiles[url_name] = (pstats.Stats(*filenames), len(filenames))
+    return profiles
+
+
+def categorize(stats):
+    """Time spent in the functions of each category, in seconds"""
+    totals = OrderedDict((name, 0.0) for name, _ in CATEGORIES)
+    for (filename, line, function), stat in stats.stats.items():
+        location = u"{0} {1}".format(filename, function).replace(os.sep, "/")
+        for name, patterns in CATEGORIES:
+            if any(pattern in location for pattern in patterns):
+                totals[name] += stat[2]
+                break
+    return totals
@@ -0,0 +1,188 @@
+"""Log of the statements slower than ``settings.SLOW_QUERY_MS``
+
+Off unless the threshold is set. The database backend in
+``finance.core.db`` wraps its cursors so every statement over the
+threshold is logged as a JSON line to the ``finance.slow_queries`` logger,
+with the view and the line of the project that ran it and the EXPLAIN
+plan of the statement. ``manage.py slow_queries`` sums the log up.
+"""
+import datetime
+import json
+import logging
+import os
+import threading
+import time
+import traceback
+
+from collections import defaultdict
+from django.conf import settings
+
+EXPLAIN_STATEMENTS = ("SELECT", "INSERT", "UPDATE", "DELETE", "WITH")
+MAX_PARAMS_LENGTH = 500
+
+logger = logging.getLogger("finance.slow_queries")
+_local = threading.local()
+_core_dir = os.path.dirname(os.path.abspath(__file__))
+# frames that only pass the statement on, the querysets of the identity map
+# included, so the line reported is the one of the view or model
+_skip_files = (
+    os.path.abspath(__file__).rstrip("c"),
+    os.path.join(_core_dir, "db"),
+    os.path.join(_core_dir, "identity.py"),
+)
+
+
+def set_view(name):
+    _local.view = name
+
+
+def get_view():
+    return getattr(_local, "view", None)
+
+
+def get_threshold():
+    """Threshold in milliseconds, None when the log is off"""
+    value = getattr(settings, "SLOW_QUERY_MS", None)
+    return float(value) if value not in (None, "") else None
+
+
+def code_location():
+    """Innermost line of the project on the stack, outside of the
+    modules in ``_skip_files``
+    """
+    root = os.path.abspath(settings.BASE_DIR)
+    for filename, line, function, _ in reversed(traceback.extract_stack()):
+        filename = os.path.abspath(filename)
+        if (filename.startswith(root) and
+                not filename.startswith(_skip_files) and
+                "-packages" not in filename):
+            return u"{0}:{1} in {2}".format(
+                os.path.relpath(filename, root), line, function
+            )
+    return None
+
+
+def explain(db, sql, params):
+    """EXPLAIN plan of the statement, from a cursor that is not wrapped
+
+    Runs in a savepoint inside transactions, so an EXPLAIN that fails
+    does not break the transaction of the request.
+    """
+    if not sql.lstrip().upper().startswith(EXPLAIN_STATEMENTS):
+        return None
+    cursor = db.connection.cursor()
+    savepoint = db.in_atomic_block
+    try:
+        if savepoint:
+            cursor.execute("SAVEPOINT slow_query_explain")
+        try:
+            cursor.execute("EXPLAIN " + sql, params)
+            return u"\n".join(row[0] for row in cursor.fetchall())
+        except Exception as e:
+            if savepoint:
+                cursor.execute("ROLLBACK TO SAVEPOINT slow_query_explain")
+            return u"EXPLAIN failed: {0}".format(e)
+        finally:
+            if savepoint:
+                cursor.execute("RELEASE SAVEPOINT slow_query_explain")
+    finally:
+        cursor.close()
+
+
+def record(db, sql, params, duration, many=False):
+    logger.info(json.dumps({
+        "time": datetime.datetime.utcnow().isoformat(),
+        "duration_ms": round(duration, 1),
+        "sql": sql,
+        "params": repr(params)[:MAX_PARAMS_LENGTH],
+        "many": many,
+        "view": get_view(),
+        "location": code_location(),
+        "plan": None if many else explain(db, sql, params),
+    }, sort_keys=True))
+
+
+class SlowQueryCursorWrapper(object):
+    """Cursor logging the statements that take longer than ``threshold``
+    milliseconds
+    """
+    def __init__(self, cursor, db, threshold):
+        self.cursor = cursor
+        self.db = db
+        self.threshold = threshold
+
+    def __getattr__(self, attr):
+        return getattr(self.cursor, attr)
+
+    def __iter__(self):
+        return iter(self.cursor)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    def execute(self, sql, params=None):
+        start = time.time()
+        result = self.cursor.execute(sql, params)
+        duration = (time.time() - start) * 1000
+        if duration >= self.threshold:
+            record(self.db, sql, params, duration)
+        return result
+
+    def executemany(self, sql, param_list):
+        start = time.time()
+        result = self.cursor.executemany(sql, param_list)
+        duration = (time.time() - start) * 1000
+        if duration >= self.threshold:
+            record(self.db, sql, param_list, duration, many=True)
+        return result
+
+
+def read_log(filename):
+    """Entries of the log and of its rotated files"""
+    filenames = [filename]
+    n = 1
+    while os.path.exists("{0}.{1}".format(filename, n)):
+        filenames.append("{0}.{1}".format(filename, n))
+        n += 1
+    for name in filenames:
+        if not os.path.exists(name):
+            continue
+        with open(name) as fp:
+            for line in fp:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    continue
+
+
+def top_offenders(entries, limit=10):
+    """Statements that took the most time in total, per statement and
+    line of code, with their slowest run
+    """
+    totals = defaultdict(lambda: {"count": 0, "total_ms": 0, "views": set(),
+                                  "slowest": None})
+    for entry in entries:
+        total = totals[(entry["sql"], entry.get("location"))]
+        total["count"] += 1
+        total["total_ms"] += entry["duration_ms"]
+        if entry.get("view"):
+            total["views"].add(entry["view"])
+        if (total["slowest"] is None or
+                entry["duration_ms"] > total["slowest"]["duration_ms"]):
+            total["slowest"] = entry
+    offenders = []
+    for (sql, location), total in totals.items():
+        offenders.append({
+            "sql": sql,
+            "location": location,
+            "count": total["count"],
+            "total_ms": total["total_ms"],
+            "max_ms": total["slowest"]["duration_ms"],
+            "views": sorted(total["views"]),
+            "plan": total["slowest"].get("plan"),
+        })
+    offenders.sort(key=lambda offender: offender["total_ms"], reverse=True)
+    return offenders[:limit]
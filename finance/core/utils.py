@@ -8,3 +8,8 @@ def get_year_choices(blank=False):
     if blank:
         choices = [("", "-" * 9)] + choices
     return choices
+
+
+def date_to_str(date):
+    """YYYY-MM-DD of the date; unlike strftime on python 2, takes any year"""
+    return date.isoformat()
@@ -4,9 +4,8 @@ from django.contrib.auth import authenticate, login
 from django.core.urlresolvers import reverse, reverse_lazy
 from django.shortcuts import get_object_or_404
 from django.views.generic import TemplateView, FormView, UpdateView
-from finance.accounts.models import Account
 from finance.core.forms import RegisterForm, ContactForm
-from finance.core.models import Profile
+from finance.core.models import Profile, forget_request_profile
 from finance.core.utils import get_year_choices
 
 
@@ -56,7 +55,7 @@ class ProfileView(UpdateView):
     fields = ["current_year"]
 
     def get_object(self):
-        return get_object_or_404(Profile, user=self.request.user)
+        return get_object_or_404(Profile, pk=self.request.profile.pk)
 
     def get_form(self, form_class):
         form = super(ProfileView, self).get_form(form_class)
@@ -67,7 +66,7 @@ class ProfileView(UpdateView):
 
     def form_valid(self, form):
         response = super(ProfileView, self).form_valid(form)
-        Account.objects.filter(profile=self.object).clear_cache()
+        forget_request_profile(self.request)
         messages.success(self.request, "Successfully updated current year"
                          " to {0}".format(form.cleaned_data["current_year"]))
         return response
@@ -42,6 +42,8 @@ INSTALLED_APPS = (
 )
 
 MIDDLEWARE_CLASSES = (
+    'finance.core.middleware.QueryCountMiddleware',
+    'finance.core.middleware.SlowQueryMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -49,7 +51,10 @@ MIDDLEWARE_CLASSES = (
     'django.contrib.auth.middleware.SessionAuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'finance.core.middleware.ProfileMiddleware',
+    'finance.core.middleware.IdentityMapMiddleware',
     'finance.core.middleware.ProfileContextMiddleware',
+    'finance.core.middleware.ProfilingMiddleware',
 )
 
 ROOT_URLCONF = 'finance.urls'
@@ -65,7 +70,7 @@ LOGIN_REDIRECT_URL = '/'
 
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.postgresql_psycopg2',
+        'ENGINE': 'finance.core.db',
         'NAME': 'finance',
         'USER': os.environ.get("DJANGO_DATABASE_USER", "postgres"),
         'PASSWORD': os.environ.get("DJANGO_DATABASE_PASSWORD", ""),
@@ -74,6 +79,30 @@ DATABASES = {
     }
 }
 
+# count the queries of every request, see
+# finance.core.middleware.QueryCountMiddleware; always on with DEBUG
+QUERY_COUNT = bool(os.environ.get("DJANGO_QUERY_COUNT", False))
+
+# statements slower than this many milliseconds are logged with their
+# EXPLAIN plan, see finance.core.slow_queries; off when not set
+SLOW_QUERY_MS = os.environ.get("DJANGO_SLOW_QUERY_MS") or None
+SLOW_QUERY_LOG = os.environ.get(
+    "DJANGO_SLOW_QUERY_LOG", "../logs/slow_queries.log"
+)
+
+# share of the requests profiled, optionally only those to the URL names
+# and of the users listed, see finance.core.profiling; off when not set
+PROFILE_SAMPLE_RATE = os.environ.get("DJANGO_PROFILE_SAMPLE_RATE") or None
+PROFILE_URL_NAMES = [
+    name for name in os.environ.get("DJANGO_PROFILE_URL_NAMES", "").split(",")
+    if name
+]
+PROFILE_USERS = [
+    name for name in os.environ.get("DJANGO_PROFILE_USERS", "").split(",")
+    if name
+]
+PROFILE_DIR = os.environ.get("DJANGO_PROFILE_DIR", "../profiles")
+
 # Internationalization
 # https://docs.djangoproject.com/en/1.7/topics/i18n/
 
@@ -98,6 +127,10 @@ STATIC_ROOT = os.path.join(BASE_DIR, "static")
 MEDIA_ROOT = os.path.join(BASE_DIR, "finance/media")
 MEDIA_URL = "/media/"
 
+# statements up to this many bytes are imported within the upload request,
+# larger ones and PDFs are left to the process_imports worker
+IMPORT_INLINE_MAX_SIZE = 256 * 1024
+
 TEMPLATE_DIRS = [
     os.path.join(BASE_DIR, "finance/templates"),
 ]
@@ -130,6 +163,14 @@ LOGGING = {
             'class': 'logging.FileHandler',
             'filename': '../logs/debug.log',
         },
+        'slow_queries': {
+            'level': 'INFO',
+            'class': 'logging.handlers.RotatingFileHandler',
+            'filename': SLOW_QUERY_LOG,
+            'maxBytes': 10 * 1024 * 1024,
+            'backupCount': 5,
+            'delay': True,
+        },
         'mail_admins': {
             'level': 'ERROR',
             'class': 'django.utils.log.AdminEmailHandler'
@@ -146,13 +187,38 @@ LOGGING = {
             'level': 'ERROR',
             'propagate': True,
         },
+        'finance.queries': {
+            'handlers': ['file'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+        'finance.slow_queries': {
+            'handlers': ['slow_queries'],
+            'level': 'INFO',
+            'propagate': False,
+        },
     }
 }
 
 # Caching
+# values are kept in the memory of each process in front of a cache shared
+# by all the uwsgi processes, see finance.core.cache for how they are
+# invalidated
 CACHES = {
     'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'BACKEND': 'finance.core.cache_backends.TwoTierCache',
         'TIMEOUT': None,
-    }
+        'OPTIONS': {
+            'SHARED': 'shared',
+            'MAX_ENTRIES': 1000,
+        },
+    },
+    'shared': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.environ.get("DJANGO_CACHE_LOCATION", "../cache"),
+        'TIMEOUT': None,
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+        },
+    },
 }
@@ -28,3 +28,52 @@ function updateAccountOptions(options) {
         $(this).val(cur_value);
     });
 }
+
+$(function() {
+    var timer;
+    $(document).on("input", "input.account-autocomplete", function() {
+        var input = $(this);
+        // nothing is selected until a match is picked
+        input.prev().val("");
+        clearTimeout(timer);
+        timer = setTimeout(function() {
+            $.getJSON(input.data("url"), {q: input.val()}, function(data) {
+                showAccountMatches(input, data.results);
+            });
+        }, 200);
+    });
+    $(document).on("mousedown", ".account-autocomplete-menu a", function(e) {
+        e.preventDefault();
+        var link = $(this);
+        var input = link.parents(".account-autocomplete-menu").prev();
+        selectAccount(input, link.data("id"), link.text());
+    });
+    $(document).on("blur", "input.account-autocomplete", function() {
+        $(this).next(".account-autocomplete-menu").remove();
+    });
+});
+
+function showAccountMatches(input, results) {
+    input.next(".account-autocomplete-menu").remove();
+    if (!results.length) {
+        return;
+    }
+    var menu = $('<ul class="dropdown-menu account-autocomplete-menu"></ul>');
+    $.each(results, function(i, result) {
+        menu.append($("<li></li>").append(
+            $('<a href="#"></a>').text(result.text).data("id", result.id)
+        ));
+    });
+    input.after(menu);
+    var position = input.position();
+    menu.css({
+        top: position.top + input.outerHeight(),
+        left: position.left
+    }).show();
+}
+
+function selectAccount(input, id, label) {
+    input.val(label);
+    input.prev().val(id).change();
+    input.next(".account-autocomplete-menu").remove();
+}
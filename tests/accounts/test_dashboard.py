@@ -1,6 +1,9 @@
 import datetime
 import pytest
 
+from decimal import Decimal
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from finance.accounts.dashboard import (get_months, get_monthly_totals,
                                         get_debits_title, get_credits_title,
                                         get_monthly_debits_vs_credits)
@@ -108,6 +111,32 @@ class TestGetMonthlyAccounts():
             {"label": exp1.name, "balance": trx4.amount + trx5.amount},
         ]
 
+    def test_rollup_query(self):
+        p = profile_factory(current_year=2010)
+        expense_type = account_type_factory(profile=p, yearly=True,
+                                            default_type="DEBIT")
+        income_type = account_type_factory(profile=p, yearly=True,
+                                           default_type="CREDIT")
+        asset_type = account_type_factory(profile=p)
+        bank = account_factory(profile=p, account_type=asset_type)
+        exp = account_factory(profile=p, account_type=expense_type)
+        inc = account_factory(profile=p, account_type=income_type)
+        for month in range(1, 13):
+            transaction_factory(account_debit=exp, account_credit=bank,
+                                amount=10.00,
+                                date=datetime.date(2010, month, 1))
+            transaction_factory(account_debit=bank, account_credit=inc,
+                                amount=20.00,
+                                date=datetime.date(2010, month, 2))
+        with CaptureQueriesContext(connection) as queries:
+            debits = get_monthly_totals(p)
+            credits = get_monthly_totals(p, False)
+        rollup_queries = [q for q in queries
+                          if "accounts_monthlybalance" in q["sql"]]
+        assert len(rollup_queries) == 2
+        assert debits[12] == [{"label": exp.name, "balance": Decimal("10")}]
+        assert credits[12] == [{"label": inc.name, "balance": Decimal("-20")}]
+
     def test_credit_empty(self):
         p = profile_factory()
         assert get_monthly_totals(p, False) == {}
@@ -297,3 +326,35 @@ class TestMonthlyDebitsVsCredits():
         monthly_debits_credits = get_monthly_debits_vs_credits(p)
         assert (1, -50) in monthly_debits_credits
         assert (2, 30) in monthly_debits_credits
+
+
+@pytest.mark.django_db
+class TestInvalidation():
+    def test_transaction_changes(self):
+        p = profile_factory(current_year=2010)
+        expense_type = account_type_factory(profile=p, yearly=True,
+                                            default_type="DEBIT")
+        asset_type = account_type_factory(profile=p)
+        bank = account_factory(profile=p, account_type=asset_type)
+        exp = account_factory(profile=p, account_type=expense_type)
+        trx = transaction_factory(account_debit=exp, account_credit=bank,
+                                  amount=10.00,
+                                  date=datetime.date(2010, 1, 1))
+        assert get_monthly_totals(p)[1][0]["balance"] == Decimal("10")
+        assert (1, Decimal("10")) in get_monthly_debits_vs_credits(p)
+        trx.date = datetime.date(2010, 2, 1)
+        trx.save()
+        assert 1 not in get_monthly_totals(p)
+        assert (2, Decimal("10")) in get_monthly_debits_vs_credits(p)
+        trx.delete()
+        assert get_monthly_totals(p) == {}
+        assert (2, 0) in get_monthly_debits_vs_credits(p)
+
+    def test_account_type_changes(self):
+        p = profile_factory()
+        expense_type = account_type_factory(profile=p, name="Expenses",
+                                            yearly=True, default_type="DEBIT")
+        assert get_debits_title(p) == "Expenses"
+        expense_type.name = "Spending"
+        expense_type.save()
+        assert get_debits_title(p) == "Spending"
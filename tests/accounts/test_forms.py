@@ -0,0 +1,72 @@
+import pytest
+
+from decimal import Decimal
+from finance.accounts.forms import AccountAutocompleteInput, TransactionFormSet
+from mock import patch
+from tests.fixtures import account_factory, profile_factory
+
+
+class TestAccountAutocompleteInput():
+    def test_render(self):
+        widget = AccountAutocompleteInput(labels={2: "Food / Groceries"})
+        html = widget.render("acct", 2)
+        assert '<input type="hidden" name="acct" value="2" />' in html
+        assert 'value="Food / Groceries"' in html
+        assert "account-autocomplete" in html
+        assert "<option" not in html
+
+    def test_render_blank(self):
+        widget = AccountAutocompleteInput()
+        html = widget.render("acct", None)
+        assert '<input type="hidden" name="acct" value="" />' in html
+
+
+@pytest.mark.django_db
+class TestTransactionBaseFormSet():
+    def test_index_once(self):
+        profile = profile_factory()
+        acct = account_factory(profile=profile, parent=None,
+                               is_category=False)
+        initial = [{"account_debit": acct.pk, "amount": "1.00"}] * 20
+        with patch("finance.accounts.forms.get_account_index") as m:
+            m.return_value.labels = {acct.pk: "acct"}
+            formset = TransactionFormSet(initial=initial, profile=profile)
+            html = "".join(f["account_debit"].as_widget() for f in formset)
+        assert m.call_count == 1
+        assert html.count('value="acct"') == 20
+        assert "<option" not in html
+
+    def test_isolation(self):
+        profile = profile_factory()
+        acct1 = account_factory(profile=profile, parent=None,
+                                is_category=False)
+        acct2 = account_factory(parent=None, is_category=False)
+        data = {"form-TOTAL_FORMS": "1", "form-INITIAL_FORMS": "0",
+                "form-0-account_debit": acct1.pk,
+                "form-0-account_credit": acct2.pk,
+                "form-0-amount": "10.00", "form-0-summary": "trx",
+                "form-0-date": "2010-01-01"}
+        formset = TransactionFormSet(data, profile=profile)
+        assert formset.is_valid() is False
+        assert "account_credit" in formset.errors[0]
+
+    def test_save(self):
+        profile = profile_factory(current_year=2010)
+        acct1 = account_factory(profile=profile, parent=None,
+                                is_category=False)
+        acct2 = account_factory(profile=profile, parent=None,
+                                is_category=False)
+        data = {"form-TOTAL_FORMS": "3", "form-INITIAL_FORMS": "3"}
+        for i in range(3):
+            data.update({
+                "form-{0}-account_debit".format(i): acct1.pk,
+                "form-{0}-account_credit".format(i): acct2.pk,
+                "form-{0}-amount".format(i): "10.00",
+                "form-{0}-summary".format(i): "trx {0}".format(i),
+                "form-{0}-date".format(i): "2010-01-0{0}".format(i + 1),
+            })
+        formset = TransactionFormSet(data, profile=profile)
+        assert formset.is_valid()
+        trxs = formset.save()
+        assert [trx.summary for trx in trxs] == ["trx 0", "trx 1", "trx 2"]
+        assert acct1.balance() == Decimal("30.00")
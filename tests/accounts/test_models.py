@@ -1,8 +1,17 @@
 import datetime
+import os
 import pytest
+import tempfile
 
 from decimal import Decimal
-from finance.accounts.models import Account, AccountType, Transaction
+from django.core.exceptions import ValidationError
+from django.core.management import call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from finance.accounts.models import (Account, AccountBalance, AccountType,
+                                     ImportJob, ImportRow, MonthlyBalance,
+                                     Transaction, transaction_fingerprint)
 from tests.fixtures import (account_factory, account_type_factory,
                             transaction_factory, profile_factory)
 
@@ -108,6 +117,106 @@ class TestAccount():
         assert trxs[2] == t1
         assert trxs[2].balance == Decimal("5.00")
 
+    def test_balance_reparent(self):
+        year = 2010
+        p = profile_factory(current_year=year)
+        cat1 = account_factory(profile=p, parent=None, is_category=True)
+        cat2 = account_factory(profile=p, parent=None, is_category=True)
+        acct = account_factory(profile=p, parent=cat1, is_category=False)
+        transaction_factory(account_debit=acct, amount="5.25",
+                            date=datetime.date(year, 2, 1))
+        assert cat1.balance() == Decimal("5.25")
+        acct.parent = cat2
+        acct.save()
+        assert cat1.balance() == 0
+        assert cat2.balance() == Decimal("5.25")
+
+    def test_ledger(self):
+        year = 2010
+        p = profile_factory(current_year=year)
+        a = account_factory(profile=p)
+        t1 = transaction_factory(account_debit=a, amount="5",
+                                 date=datetime.date(year, 1, 1))
+        t2 = transaction_factory(account_credit=a, amount="2.5",
+                                 date=datetime.date(year, 4, 1))
+        t3 = transaction_factory(account_debit=a, amount="15.15",
+                                 date=datetime.date(year, 4, 2))
+        trxs = a.ledger()
+        assert trxs.count() == 3
+        # the running balance is calculated before the slice is applied
+        page = list(trxs[1:])
+        assert page == [t2, t1]
+        assert page[0].signed_amount == Decimal("-2.50")
+        assert page[0].balance == Decimal("2.50")
+        assert page[1].balance == Decimal("5.00")
+        assert trxs.first() == t3
+        assert trxs.first().balance == Decimal("17.65")
+
+    def test_ledger_month(self):
+        year = 2010
+        p = profile_factory(current_year=year)
+        a = account_factory(profile=p)
+        transaction_factory(account_debit=a, amount="5",
+                            date=datetime.date(year, 1, 1))
+        t2 = transaction_factory(account_credit=a, amount="2.5",
+                                 date=datetime.date(year, 4, 1))
+        t3 = transaction_factory(account_debit=a, amount="15.15",
+                                 date=datetime.date(year, 4, 2))
+        trxs = list(a.ledger(month=4))
+        assert trxs == [t3, t2]
+        assert trxs[0].balance == Decimal("12.65")
+
+    def test_path(self):
+        acct1 = account_factory(parent=None, is_category=True)
+        acct2 = account_factory(parent=acct1, is_category=True)
+        acct3 = account_factory(parent=acct2)
+        assert acct1.path == "{0}/".format(acct1.pk)
+        assert acct3.path == "{0}/{1}/{2}/".format(acct1.pk, acct2.pk,
+                                                   acct3.pk)
+        assert acct3.depth == 2
+        assert acct3.ancestor_ids == [acct1.pk, acct2.pk]
+        assert set(acct3.ancestors()) == set([acct1, acct2])
+        assert set(acct1.descendants()) == set([acct2, acct3])
+
+    def test_path_reparent(self):
+        acct1 = account_factory(parent=None, is_category=True)
+        acct2 = account_factory(parent=acct1, is_category=True)
+        acct3 = account_factory(parent=acct2)
+        acct4 = account_factory(parent=None, is_category=True)
+        acct2.parent = acct4
+        acct2.save()
+        acct3 = Account.objects.get(pk=acct3.pk)
+        assert acct3.path == "{0}/{1}/{2}/".format(acct4.pk, acct2.pk,
+                                                   acct3.pk)
+        assert acct3.depth == 2
+        assert set(acct1.descendants()) == set()
+        assert set(acct4.descendants()) == set([acct2, acct3])
+
+    def test_path_cycle(self):
+        acct1 = account_factory(parent=None, is_category=True)
+        acct2 = account_factory(parent=acct1, is_category=True)
+        acct1.parent = acct2
+        with pytest.raises(ValidationError):
+            acct1.full_clean()
+        with pytest.raises(ValidationError):
+            acct1.save()
+
+    def test_tree(self):
+        p = profile_factory()
+        acct_type = account_type_factory(profile=p)
+        cat = account_factory(profile=p, account_type=acct_type, name="b",
+                              parent=None, is_category=True)
+        sub = account_factory(profile=p, account_type=acct_type, name="c",
+                              parent=cat, is_category=False)
+        leaf = account_factory(profile=p, account_type=acct_type, name="a",
+                               parent=None, is_category=False)
+        hidden = account_factory(profile=p, account_type=acct_type,
+                                 name="d", parent=leaf, is_category=False)
+        tree = Account.objects.filter(profile=p).tree()
+        assert tree == [leaf, cat, sub]
+        assert [a.level for a in tree] == [0, 0, 1]
+        assert hidden not in tree
+
     def test_subaccounts(self):
         a = account_factory(name="acct1", parent=None)
         b = account_factory(name="acct2", parent=a)
@@ -123,3 +232,265 @@ class TestTransaction():
         t = Transaction(account_debit=a1, account_credit=a2, amount="10.00",
                         summary="quick trx")
         assert unicode(t) == "quick trx 10.00"
+
+    def test_balance_update(self):
+        year = 2010
+        p = profile_factory(current_year=year)
+        acct1 = account_factory(profile=p)
+        acct2 = account_factory(profile=p)
+        acct3 = account_factory(profile=p)
+        trx = transaction_factory(account_debit=acct1, account_credit=acct2,
+                                  amount="10.00",
+                                  date=datetime.date(year, 1, 1))
+        assert acct1.balance() == Decimal("10.00")
+        assert acct2.balance() == Decimal("-10.00")
+        trx.account_credit = acct3
+        trx.amount = "7.50"
+        trx.save()
+        assert acct1.balance() == Decimal("7.50")
+        assert acct2.balance() == 0
+        assert acct3.balance() == Decimal("-7.50")
+
+    def test_balance_year_change(self):
+        p = profile_factory(current_year=2010)
+        acct = account_factory(profile=p)
+        trx = transaction_factory(account_debit=acct, amount="10.00",
+                                  date=datetime.date(2010, 1, 1))
+        trx.date = datetime.date(2011, 1, 1)
+        trx.save()
+        assert acct.balance() == 0
+        assert AccountBalance.objects.balance(acct, 2011) == Decimal("10.00")
+
+    def test_balance_delete(self):
+        year = 2010
+        p = profile_factory(current_year=year)
+        cat = account_factory(profile=p, parent=None, is_category=True)
+        acct = account_factory(profile=p, parent=cat, is_category=False)
+        trx = transaction_factory(account_debit=acct, amount="10.00",
+                                  date=datetime.date(year, 1, 1))
+        trx.delete()
+        assert acct.balance() == 0
+        assert cat.balance() == 0
+
+    def test_balance_delete_account(self):
+        year = 2010
+        p = profile_factory(current_year=year)
+        acct1 = account_factory(profile=p)
+        acct2 = account_factory(profile=p)
+        transaction_factory(account_debit=acct1, account_credit=acct2,
+                            amount="10.00", date=datetime.date(year, 1, 1))
+        acct1.delete()
+        assert acct2.balance() == 0
+        assert AccountBalance.objects.filter(account=acct1.pk).exists() \
+            is False
+
+    def test_add_all(self):
+        year = 2010
+        p = profile_factory(current_year=year)
+        cat = account_factory(profile=p, parent=None, is_category=True)
+        acct1 = account_factory(profile=p, parent=cat, is_category=False)
+        acct2 = account_factory(profile=p, parent=None, is_category=False)
+        trxs = [
+            Transaction(account_debit=acct1, account_credit=acct2,
+                        amount=Decimal("1.00") * i, summary="trx",
+                        date=datetime.date(year, i, 1))
+            for i in range(1, 11)
+        ]
+        with CaptureQueriesContext(connection) as queries:
+            Transaction.objects.add_all(trxs)
+        inserts = [
+            q for q in queries
+            if q["sql"].startswith('INSERT INTO "accounts_transaction"')
+        ]
+        assert len(inserts) == 1
+        assert Transaction.objects.filter(account_debit=acct1).count() == 10
+        assert acct1.balance() == Decimal("55.00")
+        assert acct2.balance() == Decimal("-55.00")
+        assert cat.balance() == Decimal("55.00")
+        assert MonthlyBalance.objects.get(account=acct1, month=10).balance \
+            == Decimal("55.00")
+
+
+@pytest.mark.django_db
+class TestAccountBalance():
+    def test_rebuild(self):
+        year = 2010
+        p = profile_factory(current_year=year)
+        cat = account_factory(profile=p, parent=None, is_category=True)
+        acct1 = account_factory(profile=p, parent=cat, is_category=False)
+        acct2 = account_factory(profile=p, parent=None, is_category=False)
+        transaction_factory(account_debit=acct1, account_credit=acct2,
+                            amount="10.00", date=datetime.date(year, 1, 1))
+        transaction_factory(account_debit=acct1, account_credit=acct2,
+                            amount="2.50", date=datetime.date(year + 1, 1, 1))
+        Transaction.objects.update(amount="20.00")
+        AccountBalance.objects.rebuild(Account.objects.filter(profile=p))
+        assert acct1.balance() == Decimal("20.00")
+        assert acct2.balance() == Decimal("-20.00")
+        assert cat.balance() == Decimal("20.00")
+        assert AccountBalance.objects.balance(acct1, year + 1) == \
+            Decimal("20.00")
+
+    def test_rebuild_command(self):
+        year = 2010
+        p = profile_factory(current_year=year)
+        acct = account_factory(profile=p)
+        transaction_factory(account_debit=acct, amount="10.00",
+                            date=datetime.date(year, 1, 1))
+        AccountBalance.objects.all().delete()
+        MonthlyBalance.objects.all().delete()
+        call_command("rebuild_balances", profile=p.pk)
+        assert acct.balance() == Decimal("10.00")
+        assert MonthlyBalance.objects.get(account=acct).amount == \
+            Decimal("10.00")
+
+
+@pytest.mark.django_db
+class TestMonthlyBalance():
+    def rollup(self, account):
+        return list(MonthlyBalance.objects.filter(account=account).order_by(
+            "year", "month"
+        ).values_list("year", "month", "amount", "balance", "transactions"))
+
+    def test_apply(self):
+        year = 2010
+        p = profile_factory(current_year=year)
+        acct1 = account_factory(profile=p)
+        acct2 = account_factory(profile=p)
+        transaction_factory(account_debit=acct1, account_credit=acct2,
+                            amount="10.00", date=datetime.date(year, 3, 1))
+        transaction_factory(account_debit=acct1, account_credit=acct2,
+                            amount="5.00", date=datetime.date(year, 1, 1))
+        transaction_factory(account_debit=acct1, account_credit=acct2,
+                            amount="2.00", date=datetime.date(year, 3, 5))
+        assert self.rollup(acct1) == [
+            (year, 1, Decimal("5.00"), Decimal("5.00"), 1),
+            (year, 3, Decimal("12.00"), Decimal("17.00"), 2),
+        ]
+        assert self.rollup(acct2)[-1] == \
+            (year, 3, Decimal("-12.00"), Decimal("-17.00"), 2)
+        assert MonthlyBalance.objects.filter(account=acct1)[0].profile == p
+
+    def test_date_change(self):
+        year = 2010
+        p = profile_factory(current_year=year)
+        acct1 = account_factory(profile=p)
+        acct2 = account_factory(profile=p)
+        transaction_factory(account_debit=acct1, account_credit=acct2,
+                            amount="10.00", date=datetime.date(year, 1, 1))
+        trx = transaction_factory(account_debit=acct1, account_credit=acct2,
+                                  amount="5.00",
+                                  date=datetime.date(year, 1, 2))
+        trx.date = datetime.date(year, 2, 1)
+        trx.save()
+        assert self.rollup(acct1) == [
+            (year, 1, Decimal("10.00"), Decimal("10.00"), 1),
+            (year, 2, Decimal("5.00"), Decimal("15.00"), 1),
+        ]
+
+    def test_delete(self):
+        year = 2010
+        p = profile_factory(current_year=year)
+        acct1 = account_factory(profile=p)
+        acct2 = account_factory(profile=p)
+        trx = transaction_factory(account_debit=acct1, account_credit=acct2,
+                                  amount="10.00",
+                                  date=datetime.date(year, 1, 1))
+        transaction_factory(account_debit=acct1, account_credit=acct2,
+                            amount="5.00", date=datetime.date(year, 2, 1))
+        trx.delete()
+        assert self.rollup(acct1) == [
+            (year, 1, Decimal("0.00"), Decimal("0.00"), 0),
+            (year, 2, Decimal("5.00"), Decimal("5.00"), 1),
+        ]
+
+    def test_rebuild(self):
+        year = 2010
+        p = profile_factory(current_year=year)
+        acct1 = account_factory(profile=p)
+        acct2 = account_factory(profile=p)
+        transaction_factory(account_debit=acct1, account_credit=acct2,
+                            amount="10.00", date=datetime.date(year, 1, 1))
+        transaction_factory(account_debit=acct1, account_credit=acct2,
+                            amount="2.50", date=datetime.date(year, 4, 1))
+        Transaction.objects.update(amount="20.00")
+        MonthlyBalance.objects.rebuild(Account.objects.filter(profile=p))
+        assert self.rollup(acct1) == [
+            (year, 1, Decimal("20.00"), Decimal("20.00"), 1),
+            (year, 4, Decimal("20.00"), Decimal("40.00"), 1),
+        ]
+
+
+@pytest.mark.django_db
+class TestImportJob():
+    def create_job(self):
+        self.p = profile_factory(current_year=2010)
+        self.acct1 = account_factory(profile=self.p)
+        self.acct2 = account_factory(profile=self.p)
+        self.job = ImportJob.objects.create(
+            profile=self.p, account=self.acct1, filename="example.csv",
+            status=ImportJob.DONE
+        )
+        for i, amount in enumerate(["10.00", "5.00", "2.00"]):
+            ImportRow.objects.create(
+                job=self.job, position=i, account_debit=self.acct1,
+                account_credit=self.acct2, amount=amount,
+                summary="row {0}".format(i),
+                date=datetime.date(2010, i + 1, 1), is_duplicate=i == 1
+            )
+
+    def test_promote(self):
+        self.create_job()
+        with CaptureQueriesContext(connection) as queries:
+            assert self.job.promote() == 2
+        inserts = [q for q in queries.captured_queries
+                   if 'INSERT INTO "accounts_transaction"' in q["sql"]]
+        assert len(inserts) == 1
+        trx = Transaction.objects.get(summary="row 0")
+        assert trx.fingerprint == transaction_fingerprint(
+            self.p.pk, trx.date, trx.amount, trx.summary
+        )
+        assert self.acct1.balance() == Decimal("12.00")
+        assert MonthlyBalance.objects.get(account=self.acct2,
+                                          month=3).balance == \
+            Decimal("-12.00")
+        assert ImportRow.objects.count() == 0
+        assert ImportJob.objects.get(pk=self.job.pk).status == \
+            ImportJob.IMPORTED
+
+    def test_promote_once(self):
+        self.create_job()
+        self.job.promote()
+        with pytest.raises(ValidationError):
+            self.job.promote()
+        assert Transaction.objects.count() == 2
+
+    def test_missing_account(self):
+        self.create_job()
+        ImportRow.objects.filter(position=2).update(account_credit=None)
+        with pytest.raises(ValidationError):
+            self.job.promote()
+        assert Transaction.objects.count() == 0
+        assert ImportRow.objects.count() == 3
+
+    def test_purge(self):
+        self.create_job()
+        pending = ImportJob.objects.create(profile=self.p, account=self.acct1,
+                                           filename="other.csv")
+        assert ImportJob.objects.purge(60) == 0
+        a_week_ago = timezone.now() - datetime.timedelta(days=7)
+        ImportJob.objects.update(updated=a_week_ago)
+        assert ImportJob.objects.purge(60) == 1
+        assert list(ImportJob.objects.all()) == [pending]
+        assert ImportRow.objects.count() == 0
+
+    def test_purge_file(self):
+        self.create_job()
+        fd, filename = tempfile.mkstemp(suffix=".csv")
+        os.close(fd)
+        ImportJob.objects.filter(pk=self.job.pk).update(filename=filename,
+                                                        is_temporary=True)
+        a_week_ago = timezone.now() - datetime.timedelta(days=7)
+        ImportJob.objects.update(updated=a_week_ago)
+        assert ImportJob.objects.purge(60) == 1
+        assert os.path.exists(filename) is False
@@ -0,0 +1,104 @@
+import datetime
+import pytest
+
+from decimal import Decimal
+from finance.accounts.pagination import (LedgerPaginator, decode_cursor,
+                                         encode_cursor)
+from tests.fixtures import (account_factory, profile_factory,
+                            transaction_factory)
+
+
+class TestCursor():
+    def test_decode(self):
+        assert decode_cursor("2010-01-05.12") == (datetime.date(2010, 1, 5),
+                                                  12)
+
+    def test_decode_invalid(self):
+        assert decode_cursor(None) is None
+        assert decode_cursor("2010-01-05") is None
+        assert decode_cursor("abc.12") is None
+
+
+@pytest.mark.django_db
+class TestLedgerPaginator():
+    def setup_ledger(self, count):
+        year = 2010
+        p = profile_factory(current_year=year)
+        self.acct = account_factory(profile=p, is_category=False)
+        self.trxs = [
+            transaction_factory(account_debit=self.acct, amount="1.00",
+                                date=datetime.date(year, 1, 1 + i % 28))
+            for i in range(count)
+        ]
+
+    def test_first_page(self):
+        self.setup_ledger(30)
+        page = LedgerPaginator(self.acct, 25).page()
+        assert len(page) == 25
+        assert page.has_previous is False
+        assert page.has_next is True
+        assert page.object_list[0].balance == Decimal("30.00")
+        assert page.object_list[-1].balance == Decimal("6.00")
+
+    def test_seek_older(self):
+        self.setup_ledger(30)
+        paginator = LedgerPaginator(self.acct, 25)
+        first = paginator.page()
+        page = paginator.page(before=encode_cursor(first.object_list[-1]))
+        assert len(page) == 5
+        assert page.has_previous is True
+        assert page.has_next is False
+        assert page.object_list[0].balance == Decimal("5.00")
+        assert page.object_list[-1].balance == Decimal("1.00")
+
+    def test_seek_newer(self):
+        self.setup_ledger(30)
+        paginator = LedgerPaginator(self.acct, 25)
+        last = paginator.page(number=2)
+        page = paginator.page(after=encode_cursor(last.object_list[0]))
+        assert [t.pk for t in page] == [
+            t.pk for t in paginator.page().object_list
+        ]
+        assert page.has_previous is False
+        assert page.object_list[0].balance == Decimal("30.00")
+
+    def test_page_number(self):
+        self.setup_ledger(30)
+        page = LedgerPaginator(self.acct, 25).page(number="2")
+        assert len(page) == 5
+        assert page.object_list[0].balance == Decimal("5.00")
+        assert page.query == "page=2"
+
+    def test_page_number_past_end(self):
+        self.setup_ledger(3)
+        page = LedgerPaginator(self.acct, 25).page(number="10")
+        assert len(page) == 3
+        assert page.object_list[0].balance == Decimal("3.00")
+
+    def test_seek_older_stale(self):
+        self.setup_ledger(30)
+        paginator = LedgerPaginator(self.acct, 25)
+        cursor = encode_cursor(self.trxs[0])
+        self.trxs[0].delete()
+        page = paginator.page(before=cursor)
+        assert len(page) == 4
+        assert page.has_previous is True
+        assert page.has_next is False
+        assert page.query == "page=2"
+
+    def test_seek_newer_stale(self):
+        self.setup_ledger(3)
+        paginator = LedgerPaginator(self.acct, 25)
+        page = paginator.page(after="2099-01-01.1")
+        assert len(page) == 3
+        assert page.has_previous is False
+        assert page.has_next is False
+        assert page.previous_query
+
+    def test_empty(self):
+        self.setup_ledger(0)
+        page = LedgerPaginator(self.acct, 25).page()
+        assert len(page) == 0
+        assert page.has_next is False
+        assert page.previous_query == ""
+        assert page.next_query == ""
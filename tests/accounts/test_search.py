@@ -0,0 +1,77 @@
+import pytest
+
+from finance.accounts.search import AccountIndex, get_account_index
+from finance.accounts.models import Account
+from tests.fixtures import (account_factory, account_type_factory,
+                            profile_factory)
+
+
+@pytest.mark.django_db
+class TestAccountIndex():
+    def create_accounts(self):
+        self.profile = profile_factory()
+        acct_type = account_type_factory(profile=self.profile)
+        self.food = account_factory(profile=self.profile, name="Food",
+                                    account_type=acct_type, is_category=True,
+                                    parent=None)
+        self.groceries = account_factory(profile=self.profile,
+                                         name="Groceries",
+                                         account_type=acct_type,
+                                         is_category=False, parent=self.food)
+        self.checking = account_factory(profile=self.profile,
+                                        name="Chase Checking",
+                                        account_type=acct_type,
+                                        is_category=False, parent=None)
+        return AccountIndex(Account.objects.filter(profile=self.profile))
+
+    def test_labels(self):
+        index = self.create_accounts()
+        assert index.labels == {
+            self.groceries.pk: "Food / Groceries",
+            self.checking.pk: "Chase Checking",
+        }
+
+    def test_search(self):
+        index = self.create_accounts()
+        assert index.search("gro") == [(self.groceries.pk,
+                                        "Food / Groceries")]
+        assert index.search("CHE") == [(self.checking.pk, "Chase Checking")]
+        assert index.search("food gr") == [(self.groceries.pk,
+                                            "Food / Groceries")]
+        assert index.search("food ch") == []
+        assert index.search("") == []
+
+    def test_categories(self):
+        index = self.create_accounts()
+        assert [pk for pk, _ in index.search("food")] == [self.groceries.pk]
+
+    def test_limit(self):
+        profile = profile_factory()
+        for i in range(5):
+            account_factory(profile=profile, name="acct {0}".format(i),
+                            is_category=False, parent=None)
+        index = AccountIndex(Account.objects.filter(profile=profile))
+        assert len(index.search("acct", limit=3)) == 3
+
+
+@pytest.mark.django_db
+class TestGetAccountIndex():
+    def test_cached(self):
+        profile = profile_factory()
+        account_factory(profile=profile, is_category=False, parent=None)
+        assert get_account_index(profile) is \
+            get_account_index(profile)
+
+    def test_invalidated(self):
+        profile = profile_factory()
+        index = get_account_index(profile)
+        acct = account_factory(profile=profile, name="Savings",
+                               is_category=False, parent=None)
+        assert get_account_index(profile) is not index
+        assert get_account_index(profile).search("sav") == \
+            [(acct.pk, "Savings")]
+
+    def test_isolation(self):
+        profile = profile_factory()
+        account_factory(name="Savings", is_category=False, parent=None)
+        assert get_account_index(profile).search("sav") == []
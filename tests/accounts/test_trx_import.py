@@ -1,13 +1,29 @@
 import datetime
 import os
 import pytest
+import tempfile
 
 from django.conf import settings
-from finance.accounts.trx_import import TransactionsImport
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from finance.accounts.models import ImportJob, ImportRow, Transaction
+from finance.accounts.trx_import import (TransactionsImport, chunked,
+                                         ofx_tags, pdf_lines, run_import_job)
+from mock import patch
+from StringIO import StringIO
 from tests.fixtures import (account_factory, account_type_factory,
                             transaction_factory)
 
 
+class TestChunked():
+    def test_chunked(self):
+        assert list(chunked(range(5), 2)) == [[0, 1], [2, 3], [4]]
+
+    def test_empty(self):
+        assert list(chunked([], 2)) == []
+
+
 @pytest.mark.django_db
 class TestTransactionsImport():
     TEST_FILE = os.path.join(settings.BASE_DIR,
@@ -36,23 +52,63 @@ class TestTransactionsImport():
         t = TransactionsImport(a.pk, "example.png")
         assert t.get_file_type() == "CSV"
 
-    def test_is_duplicate(self):
+    def test_mark_duplicates_fingerprint(self):
         trx = {"summary": "sum", "amount": "10.00",
                "date": datetime.date(2010, 1, 1)}
-        transaction_factory(summary=trx["summary"],
+        a = account_factory()
+        transaction_factory(account_debit=a, summary=" SUM ",
                             amount=trx["amount"], date="2010-01-01")
+        t = TransactionsImport(a.pk, self.TEST_FILE)
+        t.mark_duplicates([trx])
+        assert trx["DELETE"] is True
+
+    def test_mark_duplicates_fingerprint_false(self):
+        trx = {"summary": "sum", "amount": "10.00",
+               "date": datetime.date(2010, 1, 1)}
         a = account_factory()
+        transaction_factory(account_debit=a, summary=trx["summary"],
+                            amount=trx["amount"], date="2010-01-02")
         t = TransactionsImport(a.pk, self.TEST_FILE)
-        assert t.is_duplicate(trx) is True
+        t.mark_duplicates([trx])
+        assert trx["DELETE"] is False
 
-    def test_is_duplicate_false(self):
+    def test_mark_duplicates_fingerprint_isolation(self):
         trx = {"summary": "sum", "amount": "10.00",
                "date": datetime.date(2010, 1, 1)}
-        transaction_factory(summary=trx["summary"],
-                            amount=trx["amount"])
+        transaction_factory(summary=trx["summary"], amount=trx["amount"],
+                            date="2010-01-01")
+        a = account_factory()
+        t = TransactionsImport(a.pk, self.TEST_FILE)
+        t.mark_duplicates([trx])
+        assert trx["DELETE"] is False
+
+    def test_mark_duplicates_long_summary(self):
+        trx = {"summary": "long " * 30, "amount": "10.00",
+               "date": datetime.date(2010, 1, 1)}
         a = account_factory()
+        transaction_factory(account_debit=a, summary=trx["summary"][:100],
+                            amount=trx["amount"], date="2010-01-01")
         t = TransactionsImport(a.pk, self.TEST_FILE)
-        assert t.is_duplicate(trx) is False
+        t.mark_duplicates([trx])
+        assert trx["DELETE"] is True
+
+    def test_mark_duplicates(self):
+        a = account_factory()
+        transaction_factory(account_debit=a, summary="sum", amount="10.00",
+                            date="2010-01-01")
+        trxs = [
+            {"summary": "sum", "amount": "10.00",
+             "date": datetime.datetime(2010, 1, 1)},
+            {"summary": "other", "amount": "5.00",
+             "date": datetime.datetime(2010, 1, 1)},
+            {"summary": "other", "amount": "5.00",
+             "date": datetime.datetime(2010, 1, 1)},
+        ]
+        t = TransactionsImport(a.pk, self.TEST_FILE)
+        with CaptureQueriesContext(connection) as queries:
+            t.mark_duplicates(trxs)
+        assert len(queries) == 1
+        assert [trx["DELETE"] for trx in trxs] == [True, False, True]
 
     def test_get_account_debit(self):
         acct1 = account_factory()
@@ -87,6 +143,28 @@ class TestTransactionsImport():
         t = TransactionsImport(acct2.pk, self.TEST_FILE)
         assert t.get_account("sum") is None
 
+    def test_get_account_latest(self):
+        acct1 = account_factory()
+        acct2 = account_factory()
+        acct3 = account_factory()
+        transaction_factory(account_debit=acct1, account_credit=acct2,
+                            summary="sum", date=datetime.date(2010, 1, 1))
+        transaction_factory(account_debit=acct3, account_credit=acct1,
+                            summary="sum", date=datetime.date(2010, 2, 1))
+        t = TransactionsImport(acct1.pk, self.TEST_FILE)
+        assert t.get_account("sum") == acct3.pk
+
+    def test_get_account_single_query(self):
+        acct1 = account_factory()
+        acct2 = account_factory()
+        transaction_factory(account_debit=acct1, account_credit=acct2,
+                            summary="sum")
+        t = TransactionsImport(acct1.pk, self.TEST_FILE)
+        with CaptureQueriesContext(connection) as queries:
+            for summary in ["sum", "other", "sum"] * 10:
+                t.get_account(summary)
+        assert len(queries) == 1
+
     def test_set_accounts_debit_debit(self):
         acct1 = account_factory()
         acct2 = account_factory()
@@ -169,7 +247,9 @@ class TestChaseCSVTransactionsImport():
 
     def test_parse_file_duplicate(self):
         acct = account_factory()
-        transaction_factory(account_credit=acct, summary="SPICE & GRAIN",
+        other = account_factory(profile=acct.profile)
+        transaction_factory(account_debit=other,
+                            account_credit=acct, summary="SPICE & GRAIN",
                             amount="76.35", date="2013-02-22")
         t = TransactionsImport(acct.pk, self.TEST_FILE)
         t.parse_file()
@@ -206,7 +286,9 @@ class TestCapitalOne360TransactionsImport():
 
     def test_parse_file_duplicate(self):
         acct = account_factory()
-        transaction_factory(account_credit=acct,
+        other = account_factory(profile=acct.profile)
+        transaction_factory(account_debit=other,
+                            account_credit=acct,
                             summary="Monthly Interest Paid",
                             amount="0.22", date="2014-11-30")
         t = TransactionsImport(acct.pk, self.TEST_FILE)
@@ -216,6 +298,22 @@ class TestCapitalOne360TransactionsImport():
         assert t.transactions[1]["DELETE"] is False
         assert t.transactions[2]["DELETE"] is False
 
+    def test_iter_transactions(self):
+        acct = account_factory()
+        other = account_factory(profile=acct.profile)
+        transaction_factory(account_debit=other,
+                            account_credit=acct,
+                            summary="Monthly Interest Paid",
+                            amount="0.22", date="2014-11-30")
+        t = TransactionsImport(acct.pk, self.TEST_FILE)
+        with patch.object(t, "mark_duplicates",
+                          wraps=t.mark_duplicates) as m:
+            trxs = t.iter_transactions(chunk_size=2)
+            assert m.called is False
+            trxs = list(trxs)
+        assert m.call_count == 2
+        assert [trx["DELETE"] for trx in trxs] == [True, False, False]
+
 
 @pytest.mark.django_db
 class TestChasePDFTransactionsImport():
@@ -230,7 +328,9 @@ class TestChasePDFTransactionsImport():
 
     def test_parse_file_duplicate(self):
         acct = account_factory()
-        transaction_factory(account_credit=acct,
+        other = account_factory(profile=acct.profile)
+        transaction_factory(account_debit=other,
+                            account_credit=acct,
                             summary="THE OXFORD HOUSE INN FRYEBURG ME",
                             amount="111.26", date="2013-12-14")
         t = TransactionsImport(acct.pk, self.TEST_FILE, year=2013)
@@ -238,3 +338,202 @@ class TestChasePDFTransactionsImport():
         assert len(t.transactions) == 69
         assert t.transactions[0]["DELETE"] is True
         assert t.transactions[-1]["DELETE"] is False
+
+
+class TestOFXTags():
+    def test_chunks(self):
+        data = "HEADER:1\n<OFX><STMTTRN>\n<NAME>A &amp; B\n<TRNAMT>1.00" \
+            "\n</STMTTRN></OFX>"
+        expected = [(False, "OFX", ""), (False, "STMTTRN", ""),
+                    (False, "NAME", "A & B"), (False, "TRNAMT", "1.00"),
+                    (True, "STMTTRN", ""), (True, "OFX", "")]
+        for size in (3, 7, 1024):
+            assert list(ofx_tags(StringIO(data), size)) == expected
+
+
+@pytest.mark.django_db
+class TestOFXTransactionsImport():
+    TEST_FILE = os.path.join(settings.BASE_DIR,
+                             "tests/import_test_sample.ofx")
+
+    def test_get_file_type(self):
+        a = account_factory()
+        assert TransactionsImport(a.pk, "example.qfx").get_file_type() == \
+            "OFX"
+
+    def test_parse_file(self):
+        acct = account_factory()
+        t = TransactionsImport(acct.pk, self.TEST_FILE)
+        t.parse_file()
+        assert len(t.transactions) == 3
+        trx = t.transactions[0]
+        assert trx["date"] == datetime.date(2014, 11, 3)
+        assert trx["summary"] == "HANNAFORD #0352"
+        assert trx["amount"] == "42.41"
+        assert trx["external_id"] == "201411030001"
+        assert t.transactions[2]["summary"] == "Monthly Interest Paid"
+
+    def test_parse_file_duplicate(self):
+        acct = account_factory()
+        other = account_factory(profile=acct.profile)
+        trx = transaction_factory(account_debit=other, account_credit=acct,
+                                  summary="renamed", amount="42.41",
+                                  date="2014-11-03")
+        Transaction.objects.filter(pk=trx.pk).update(
+            external_id="201411030001"
+        )
+        transaction_factory(account_debit=acct, account_credit=other,
+                            summary="PAYROLL", amount="1500.00",
+                            date="2014-11-15")
+        t = TransactionsImport(acct.pk, self.TEST_FILE)
+        t.parse_file()
+        assert [row["DELETE"] for row in t.transactions] == \
+            [True, False, False]
+
+
+class TestPDFLines():
+    def test_single_process(self):
+        with patch("finance.accounts.trx_import.pdf_page_count",
+                   return_value=2), \
+                patch("finance.accounts.trx_import.pdf_to_text",
+                      return_value="a\nb\n") as m:
+            assert list(pdf_lines("example.pdf")) == ["a", "b"]
+        m.assert_called_once_with("example.pdf")
+
+    def test_page_ranges(self):
+        def pdf_to_text(filename, pages):
+            return "{0}-{1}\n".format(*pages)
+        with patch("finance.accounts.trx_import.pdf_page_count",
+                   return_value=10), \
+                patch("finance.accounts.trx_import.pdf_to_text",
+                      side_effect=pdf_to_text):
+            assert list(pdf_lines("example.pdf")) == ["1-4", "5-8", "9-10"]
+
+
+@pytest.mark.django_db
+class TestPDFRows():
+    def test_rejected(self):
+        acct = account_factory()
+        lines = [
+            "ACCOUNT ACTIVITY",
+            "",
+            "12/14{0}THE OXFORD HOUSE INN{0}111.26".format(" " * 15),
+            "12/15{0}UNREADABLE{0}12,00O".format(" " * 15),
+        ]
+        t = TransactionsImport(acct.pk, "example.pdf", year=2013)
+        with patch("finance.accounts.trx_import.pdf_lines",
+                   return_value=lines):
+            trxs = list(t.read_rows())
+        assert len(trxs) == 1
+        assert trxs[0]["date"] == datetime.date(2013, 12, 14)
+        assert trxs[0]["summary"] == "THE OXFORD HOUSE INN"
+        assert t.rejected == 1
+
+
+@pytest.mark.django_db
+class TestRunImportJob():
+    def test_claim(self):
+        acct = account_factory()
+        job = ImportJob.objects.create(profile=acct.profile, account=acct,
+                                       filename="example.csv")
+        assert ImportJob.objects.claim() == job
+        assert ImportJob.objects.get(pk=job.pk).status == ImportJob.RUNNING
+        assert ImportJob.objects.claim() is None
+
+    def test_claim_stale(self):
+        acct = account_factory()
+        job = ImportJob.objects.create(profile=acct.profile, account=acct,
+                                       filename="example.csv")
+        assert ImportJob.objects.claim(timeout=60) == job
+        ImportRow.objects.create(job=job, position=0, amount="1.00",
+                                 summary="sum", date=datetime.date.today())
+        assert ImportJob.objects.claim(timeout=60) is None
+        # the worker died an hour ago
+        an_hour_ago = timezone.now() - datetime.timedelta(hours=1)
+        ImportJob.objects.filter(pk=job.pk).update(started=an_hour_ago,
+                                                   updated=an_hour_ago)
+        assert ImportJob.objects.claim(timeout=60) == job
+        job = ImportJob.objects.get(pk=job.pk)
+        assert job.status == ImportJob.RUNNING
+        assert job.attempts == 2
+        assert job.rows.count() == 0
+
+    def test_claim_stale_failed(self):
+        acct = account_factory()
+        an_hour_ago = timezone.now() - datetime.timedelta(hours=1)
+        job = ImportJob.objects.create(profile=acct.profile, account=acct,
+                                       filename="example.csv",
+                                       status=ImportJob.RUNNING,
+                                       attempts=ImportJob.MAX_ATTEMPTS)
+        ImportJob.objects.filter(pk=job.pk).update(started=an_hour_ago,
+                                                   updated=an_hour_ago)
+        assert ImportJob.objects.claim(timeout=60) is None
+        job = ImportJob.objects.get(pk=job.pk)
+        assert job.status == ImportJob.FAILED
+        assert job.error
+
+    def test_claim_stale_file(self):
+        acct = account_factory()
+        an_hour_ago = timezone.now() - datetime.timedelta(hours=1)
+        filenames = []
+        for attempts in (1, ImportJob.MAX_ATTEMPTS):
+            fd, filename = tempfile.mkstemp(suffix=".csv")
+            os.close(fd)
+            filenames.append(filename)
+            ImportJob.objects.create(profile=acct.profile, account=acct,
+                                     filename=filename, is_temporary=True,
+                                     status=ImportJob.RUNNING,
+                                     attempts=attempts)
+        ImportJob.objects.update(started=an_hour_ago, updated=an_hour_ago)
+        assert ImportJob.objects.requeue_stale(60) == 2
+        # kept for the next run of the job given back, not for the failed one
+        assert os.path.exists(filenames[0]) is True
+        assert os.path.exists(filenames[1]) is False
+        os.unlink(filenames[0])
+
+    def test_run(self):
+        acct = account_factory()
+        job = ImportJob.objects.create(
+            profile=acct.profile, account=acct,
+            filename=os.path.join(settings.BASE_DIR,
+                                  "tests/import_test_chase_sample.csv")
+        )
+        run_import_job(ImportJob.objects.claim())
+        job = ImportJob.objects.get(pk=job.pk)
+        assert job.status == ImportJob.DONE
+        assert job.processed == 2
+        rows = list(job.rows.all())
+        assert [row.position for row in rows] == [0, 1]
+        assert rows[0].date == datetime.date(2013, 2, 22)
+        assert rows[0].fingerprint
+
+    def test_failed(self):
+        acct = account_factory()
+        job = ImportJob.objects.create(profile=acct.profile, account=acct,
+                                       filename="missing.csv")
+        run_import_job(ImportJob.objects.claim())
+        job = ImportJob.objects.get(pk=job.pk)
+        assert job.status == ImportJob.FAILED
+        assert "missing.csv" in job.error
+        assert job.rows.count() == 0
+
+    def test_fileobj(self):
+        acct = account_factory()
+        job = ImportJob.objects.create(profile=acct.profile, account=acct,
+                                       filename="upload.csv")
+        with open(os.path.join(settings.BASE_DIR,
+                               "tests/import_test_chase_sample.csv")) as fp:
+            run_import_job(ImportJob.objects.claim(), fp)
+        assert ImportJob.objects.get(pk=job.pk).processed == 2
+
+    def test_temporary(self):
+        acct = account_factory()
+        fd, filename = tempfile.mkstemp(suffix=".csv")
+        with os.fdopen(fd, "wb") as fp:
+            with open(os.path.join(settings.BASE_DIR,
+                                   "tests/import_test_chase_sample.csv")) as f:
+                fp.write(f.read())
+        ImportJob.objects.create(profile=acct.profile, account=acct,
+                                 filename=filename, is_temporary=True)
+        run_import_job(ImportJob.objects.claim())
+        assert os.path.exists(filename) is False
@@ -1,22 +1,24 @@
 import pytest
 
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from finance.accounts.utils import (BLANK_OPTION, get_account_choices,
                                     get_account_type_choices)
-from tests.fixtures import (user_factory, profile_factory, account_factory,
+from tests.fixtures import (profile_factory, account_factory,
                             account_type_factory)
 
 
 @pytest.mark.django_db
 class TestGetAccountTypeChoices():
     def test_empty(self):
-        user = user_factory()
-        assert get_account_type_choices(user) == BLANK_OPTION
+        profile = profile_factory()
+        assert get_account_type_choices(profile) == BLANK_OPTION
 
     def test_valid_options(self):
         profile = profile_factory()
         acct_type1 = account_type_factory(profile=profile)
         acct_type2 = account_type_factory()
-        choices = get_account_type_choices(profile.user)
+        choices = get_account_type_choices(profile)
         assert BLANK_OPTION[0] in choices
         assert (acct_type1.pk, acct_type1.name) in choices
         assert (acct_type2.pk, acct_type2.name) not in choices
@@ -25,8 +27,8 @@ class TestGetAccountTypeChoices():
 @pytest.mark.django_db
 class TestGetAccountChoices():
     def test_empty(self):
-        user = user_factory()
-        assert get_account_choices(user) == BLANK_OPTION
+        profile = profile_factory()
+        assert get_account_choices(profile) == BLANK_OPTION
 
     def test_valid_options(self):
         profile = profile_factory()
@@ -34,7 +36,7 @@ class TestGetAccountChoices():
         acct1 = account_factory(profile=profile, account_type=acct_type,
                                 is_category=False, parent=None)
         acct2 = account_factory(is_category=False, parent=None)
-        choices = get_account_choices(profile.user)
+        choices = get_account_choices(profile)
         assert BLANK_OPTION[0] in choices
         assert ("", acct_type.name) in choices
         assert (acct1.pk, "- {0}".format(acct1.name)) in choices
@@ -47,7 +49,7 @@ class TestGetAccountChoices():
                                 is_category=True, parent=None)
         acct2 = account_factory(profile=profile, is_category=False,
                                 parent=None)
-        choices = get_account_choices(profile.user, True)
+        choices = get_account_choices(profile, True)
         assert BLANK_OPTION[0] in choices
         assert ("", acct_type.name) in choices
         assert (acct1.pk, "- {0}".format(acct1.name)) in choices
@@ -65,7 +67,7 @@ class TestGetAccountChoices():
                                 is_category=False, parent=None)
         acct_type3 = account_type_factory(profile=profile)
         acct3 = account_factory(is_category=False, parent=None)
-        choices = get_account_choices(profile.user)
+        choices = get_account_choices(profile)
         assert BLANK_OPTION[0] in choices
         assert ("", acct_type1.name) in choices
         assert (acct1a.pk, "- {0}".format(acct1a.name)) in choices
@@ -86,7 +88,7 @@ class TestGetAccountChoices():
                                 is_category=False, parent=acct2)
         acct4 = account_factory(profile=profile, account_type=acct_type1,
                                 is_category=False, parent=acct1)
-        choices = get_account_choices(profile.user)
+        choices = get_account_choices(profile)
         assert BLANK_OPTION[0] in choices
         assert ("", "- {0}".format(acct1.name)) in choices
         assert ("", "-- {0}".format(acct2.name)) in choices
@@ -104,9 +106,45 @@ class TestGetAccountChoices():
                                 is_category=False, parent=acct2)
         acct4 = account_factory(profile=profile, account_type=acct_type1,
                                 is_category=False, parent=acct1)
-        choices = get_account_choices(profile.user, True)
+        choices = get_account_choices(profile, True)
         assert BLANK_OPTION[0] in choices
         assert (acct1.pk, "- {0}".format(acct1.name)) in choices
         assert (acct2.pk, "-- {0}".format(acct2.name)) in choices
         assert (acct3.pk, "--- {0}".format(acct3.name)) not in choices
         assert (acct4.pk, "-- {0}".format(acct4.name)) not in choices
+
+    def test_cache_invalidation(self):
+        profile = profile_factory()
+        acct_type = account_type_factory(profile=profile)
+        acct1 = account_factory(profile=profile, account_type=acct_type,
+                                is_category=False, parent=None)
+        choices = get_account_choices(profile)
+        assert (acct1.pk, "- {0}".format(acct1.name)) in choices
+        acct2 = account_factory(profile=profile, account_type=acct_type,
+                                is_category=False, parent=None)
+        choices = get_account_choices(profile)
+        assert (acct2.pk, "- {0}".format(acct2.name)) in choices
+        acct_type.name = "renamed"
+        acct_type.save()
+        assert ("", "renamed") in get_account_choices(profile)
+        acct2.delete()
+        choices = get_account_choices(profile)
+        assert (acct2.pk, "- {0}".format(acct2.name)) not in choices
+
+    def test_queries(self):
+        profile = profile_factory()
+        acct_type = account_type_factory(profile=profile)
+        acct1 = account_factory(profile=profile, account_type=acct_type,
+                                is_category=True, parent=None)
+        acct2 = account_factory(profile=profile, account_type=acct_type,
+                                is_category=True, parent=acct1)
+        account_factory(profile=profile, account_type=acct_type,
+                        is_category=False, parent=acct2)
+        with CaptureQueriesContext(connection) as queries:
+            get_account_choices(profile)
+        # cache version and the account tree
+        assert len(queries) == 2
+        with CaptureQueriesContext(connection) as queries:
+            get_account_choices(profile)
+        # cache version only
+        assert len(queries) == 1
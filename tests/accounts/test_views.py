@@ -3,14 +3,59 @@ import json
 import os
 
 from django.conf import settings
+from django.core.management import call_command
 from django.core.urlresolvers import reverse
-from finance.accounts.models import AccountType, Account, Transaction
+from django.db import connection
+from django.test.utils import CaptureQueriesContext, override_settings
+from finance.accounts.models import (AccountType, Account, ImportJob,
+                                     ImportRow, Transaction)
 from decimal import Decimal
 from tests.fixtures import (BaseWebTest, account_type_factory, profile_factory,
                             account_factory, transaction_factory)
 
 
-class TestDashboardView(BaseWebTest):
+# most queries a request may make, per URL name: the count measured with
+# the fixtures of these tests, the login of the test user on the first
+# request of a test included, plus a margin of 2
+QUERY_BUDGETS = {
+    "accounts.dashboard": 23,
+    "accounts.settings": 16,
+    "data.yearly_debit": 25,
+    "data.yearly_debit_vs_credit": 25,
+    "accounts.account_type.add": 15,
+    "accounts.account_type.edit": 16,
+    "accounts.account_type.delete": 19,
+    "accounts.account.list": 17,
+    "accounts.account.add": 29,
+    "accounts.account.edit": 19,
+    "accounts.account.delete": 26,
+    "accounts.account.autocomplete": 21,
+    "accounts.transaction.list.by_account": 21,
+    "accounts.transaction.add": 34,
+    "accounts.transaction.edit": 18,
+    "accounts.transaction.delete": 28,
+    "accounts.transaction.import": 17,
+    "accounts.transaction.import.job": 58,
+    "accounts.transaction.import.job.status": 16,
+}
+
+
+class AccountsWebTest(BaseWebTest):
+    query_budgets = QUERY_BUDGETS
+
+    def assert_constant_queries(self, url, add_rows):
+        """The page makes as many queries after ``add_rows()`` has added
+        more rows to it, e.g. no query per row
+        """
+        self.app.get(url, user=self.user)
+        add_rows(2)
+        count = self.app.get(url, user=self.user).headers["X-Query-Count"]
+        add_rows(10)
+        response = self.app.get(url, user=self.user)
+        assert response.headers["X-Query-Count"] == count
+
+
+class TestDashboardView(AccountsWebTest):
     def test_view(self):
         response = self.app.get(reverse("accounts.dashboard"), user=self.user)
         assert response.status_code == 200
@@ -20,8 +65,31 @@ class TestDashboardView(BaseWebTest):
         response = self.app.get(reverse("accounts.dashboard"))
         assert response.status_code == 302
 
+    def test_query_count(self):
+        acct_type = account_type_factory(profile=self.profile, yearly=True,
+                                         default_type="DEBIT")
+
+        def add_rows(count):
+            for i in range(count):
+                transaction_factory(
+                    account_debit=account_factory(profile=self.profile,
+                                                  account_type=acct_type),
+                    account_credit=account_factory(profile=self.profile),
+                    amount="1.00", date=datetime.date(self.profile.year, 1, 1)
+                )
+        self.assert_constant_queries(reverse("accounts.dashboard"), add_rows)
+
+    def test_profile_from_session(self):
+        self.app.get(reverse("accounts.dashboard"), user=self.user)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.app.get(reverse("accounts.dashboard"),
+                                    user=self.user)
+        assert response.status_code == 200
+        assert not [q for q in queries.captured_queries
+                    if '"core_profile"' in q["sql"]]
+
 
-class TestSettingsView(BaseWebTest):
+class TestSettingsView(AccountsWebTest):
     def test_view(self):
         response = self.app.get(reverse("accounts.settings"), user=self.user)
         assert response.status_code == 200
@@ -32,7 +100,7 @@ class TestSettingsView(BaseWebTest):
         assert response.status_code == 302
 
 
-class TestAccountTypeAddView(BaseWebTest):
+class TestAccountTypeAddView(AccountsWebTest):
     def test_view(self):
         response = self.app.get(reverse("accounts.account_type.add"),
                                 user=self.user)
@@ -69,7 +137,7 @@ class TestAccountTypeAddView(BaseWebTest):
         assert "Name needs to be unique" in response
 
 
-class TestAccountTypeEditView(BaseWebTest):
+class TestAccountTypeEditView(AccountsWebTest):
     def test_permissions(self):
         acct_type = account_type_factory(profile=self.profile, name="acct1")
         response = self.app.get(reverse("accounts.account_type.edit",
@@ -130,7 +198,7 @@ class TestAccountTypeEditView(BaseWebTest):
         assert response.status_code == 404
 
 
-class TestAccountTypeDeleteView(BaseWebTest):
+class TestAccountTypeDeleteView(AccountsWebTest):
     csrf_checks = False
 
     def test_view(self):
@@ -159,7 +227,7 @@ class TestAccountTypeDeleteView(BaseWebTest):
         assert AccountType.objects.filter(pk=acct_type.pk).exists() is True
 
 
-class TestAccountView(BaseWebTest):
+class TestAccountView(AccountsWebTest):
     def test_view(self):
         acct1 = account_factory(profile=self.profile, parent=None)
         acct2 = account_factory(profile=self.profile, parent=acct1)
@@ -189,8 +257,16 @@ class TestAccountView(BaseWebTest):
         assert acct1.name in response
         assert acct2.name not in response
 
+    def test_query_count(self):
+        def add_rows(count):
+            for i in range(count):
+                parent = account_factory(profile=self.profile, parent=None)
+                account_factory(profile=self.profile, parent=parent)
+        self.assert_constant_queries(reverse("accounts.account.list"),
+                                     add_rows)
 
-class TestAccountAddView(BaseWebTest):
+
+class TestAccountAddView(AccountsWebTest):
     def test_view(self):
         acct_type = account_type_factory(profile=self.profile)
         response = self.app.get(reverse("accounts.account.add"),
@@ -223,7 +299,7 @@ class TestAccountAddView(BaseWebTest):
         assert "is required" in response
 
 
-class TestAccountAddAjaxView(BaseWebTest):
+class TestAccountAddAjaxView(AccountsWebTest):
     csrf_checks = False
 
     def test_view(self):
@@ -283,7 +359,7 @@ class TestAccountAddAjaxView(BaseWebTest):
         assert "is required" in res["result"]
 
 
-class TestAccountEditView(BaseWebTest):
+class TestAccountEditView(AccountsWebTest):
     def test_view(self):
         acct = account_factory(profile=self.profile, name="acct1")
         response = self.app.get(reverse("accounts.account.edit",
@@ -323,7 +399,7 @@ class TestAccountEditView(BaseWebTest):
         assert response.status_code == 404
 
 
-class TestAccountDeleteView(BaseWebTest):
+class TestAccountDeleteView(AccountsWebTest):
     csrf_checks = False
 
     def test_view(self):
@@ -352,7 +428,31 @@ class TestAccountDeleteView(BaseWebTest):
         assert Account.objects.filter(pk=acct.pk).exists() is True
 
 
-class TestAccountTransactionView(BaseWebTest):
+class TestAccountAutocompleteView(AccountsWebTest):
+    def test_view(self):
+        acct = account_factory(profile=self.profile, name="Groceries",
+                               is_category=False, parent=None)
+        account_factory(profile=self.profile, name="Rent",
+                        is_category=False, parent=None)
+        response = self.app.get(reverse("accounts.account.autocomplete"),
+                                {"q": "gro"}, user=self.user)
+        assert response.status_code == 200
+        assert json.loads(response.body) == {
+            "results": [{"id": acct.pk, "text": "Groceries"}]
+        }
+
+    def test_permissions(self):
+        response = self.app.get(reverse("accounts.account.autocomplete"))
+        assert response.status_code == 302
+
+    def test_isolation(self):
+        account_factory(name="Groceries", is_category=False, parent=None)
+        response = self.app.get(reverse("accounts.account.autocomplete"),
+                                {"q": "gro"}, user=self.user)
+        assert json.loads(response.body) == {"results": []}
+
+
+class TestAccountTransactionView(AccountsWebTest):
     def setUp(self):
         super(TestAccountTransactionView, self).setUp()
         self.acct1 = account_factory(profile=self.profile)
@@ -422,8 +522,58 @@ class TestAccountTransactionView(BaseWebTest):
         assert self.acct2.name in response
         assert "10.00" in response
 
+    def test_next_page(self):
+        for day in range(1, 28):
+            transaction_factory(account_debit=self.acct1,
+                                account_credit=self.acct2, amount="1.00",
+                                date=datetime.date(self.profile.year, 1, day))
+        response = self.app.get(reverse("accounts.transaction.list.by_account",
+                                        args=[self.acct1.pk]),
+                                user=self.user)
+        assert response.status_code == 200
+        assert "27.00" in response
+        response = response.click("Older", index=0)
+        assert response.status_code == 200
+        assert "2.00" in response
+        assert "27.00" not in response
+        response = response.click("Newer", index=0)
+        assert response.status_code == 200
+        assert "27.00" in response
+
+    def test_query_count(self):
+        def add_rows(count):
+            for i in range(count):
+                transaction_factory(
+                    account_debit=self.acct1,
+                    account_credit=account_factory(profile=self.profile),
+                    amount="1.00", date=datetime.date(self.profile.year, 1, 1)
+                )
+        self.assert_constant_queries(
+            reverse("accounts.transaction.list.by_account",
+                    args=[self.acct1.pk]),
+            add_rows
+        )
+
+    def test_stale_cursor(self):
+        for day in range(1, 28):
+            transaction_factory(account_debit=self.acct1,
+                                account_credit=self.acct2, amount="1.00",
+                                date=datetime.date(self.profile.year, 1, day))
+        response = self.app.get(reverse("accounts.transaction.list.by_account",
+                                        args=[self.acct1.pk]),
+                                user=self.user)
+        older = response.click("Older", index=0).request.url
+        # the rows the link leads to are gone by the time it is followed
+        Transaction.objects.filter(
+            account_debit=self.acct1,
+            date__lt=datetime.date(self.profile.year, 1, 3)
+        ).delete()
+        response = self.app.get(older, user=self.user)
+        assert response.status_code == 200
+        assert "Older" not in response
+
 
-class TestTransactionAddView(BaseWebTest):
+class TestTransactionAddView(AccountsWebTest):
     def setUp(self):
         super(TestTransactionAddView, self).setUp()
         self.acct1 = account_factory(profile=self.profile, is_category=False,
@@ -468,7 +618,7 @@ class TestTransactionAddView(BaseWebTest):
         assert "is required" in response
 
 
-class TestTransactionEditView(BaseWebTest):
+class TestTransactionEditView(AccountsWebTest):
     def setUp(self):
         super(TestTransactionEditView, self).setUp()
         self.acct1 = account_factory(profile=self.profile, parent=None)
@@ -508,6 +658,18 @@ class TestTransactionEditView(BaseWebTest):
             self.acct1.name
         ) in response
 
+    def test_redirect_cursor(self):
+        trx = transaction_factory(account_debit=self.acct1,
+                                  account_credit=self.acct2, amount="10.00")
+        response = self.app.get("{0}?next={1}&before=2010-01-01.5".format(
+            reverse("accounts.transaction.edit", args=[trx.pk]),
+            self.acct1.pk
+        ), user=self.user)
+        form = response.forms[1]
+        response = form.submit()
+        assert response.status_code == 302
+        assert response.location.endswith("?before=2010-01-01.5")
+
     def test_permissions(self):
         trx = transaction_factory(account_debit=self.acct1,
                                   account_credit=self.acct2)
@@ -538,7 +700,7 @@ class TestTransactionEditView(BaseWebTest):
         assert response.status_code == 404
 
 
-class TestTransactionDeleteView(BaseWebTest):
+class TestTransactionDeleteView(AccountsWebTest):
     csrf_checks = False
 
     def setUp(self):
@@ -587,7 +749,7 @@ class TestTransactionDeleteView(BaseWebTest):
         assert Transaction.objects.filter(pk=trx.pk).exists() is True
 
 
-class TestTransactionImportView(BaseWebTest):
+class TestTransactionImportView(AccountsWebTest):
     def setUp(self):
         super(TestTransactionImportView, self).setUp()
         self.acct1 = account_factory(profile=self.profile, is_category=False,
@@ -597,48 +759,89 @@ class TestTransactionImportView(BaseWebTest):
         self.sample_file = os.path.join(settings.BASE_DIR,
                                         "tests/import_test_chase_sample.csv")
 
-    def test_view(self):
+    def upload(self):
         response = self.app.get(reverse("accounts.transaction.import"),
                                 user=self.user)
-        assert response.status_code == 200
         form = response.forms[1]
         form["account_main"] = self.acct1.pk
         form["filename"] = [self.sample_file]
         response = form.submit()
+        assert response.status_code == 302
+        return response.follow()
+
+    def test_view(self):
+        response = self.upload()
         assert response.status_code == 200
         assert "Confirm Import Transaction" in response
         form = response.forms[1]
         form["form-0-account_debit"] = self.acct2.pk
         form["form-1-account_debit"] = self.acct2.pk
-        response = form.submit().follow()
+        response = form.submit("confirm").follow()
         assert response.status_code == 200
         assert "Successfully added 2 Transactions" in response
+        assert ImportRow.objects.count() == 0
 
-    def test_validation(self):
+    def test_save_page(self):
+        response = self.upload()
+        form = response.forms[1]
+        form["form-0-account_debit"] = self.acct2.pk
+        form["form-0-summary"] = "Edited"
+        response = form.submit("save").follow()
+        assert response.status_code == 200
+        assert "Saved changes" in response
+        row = ImportRow.objects.get(position=0)
+        assert row.account_debit == self.acct2
+        assert row.summary == "Edited"
+        assert response.forms[1]["form-0-summary"].value == "Edited"
+
+    def test_pdf(self):
         response = self.app.get(reverse("accounts.transaction.import"),
                                 user=self.user)
-        assert response.status_code == 200
         form = response.forms[1]
         form["account_main"] = self.acct1.pk
-        response = form.submit()
-        assert response.status_code == 200
-        assert "is required" in response
+        form["filename"] = [os.path.join(settings.BASE_DIR,
+                                         "tests/import_test_chase_sample.pdf")]
+        response = form.submit().follow()
+        assert "Reading the statement" in response
+        job = ImportJob.objects.get(profile=self.profile)
+        assert job.status == ImportJob.PENDING
+        assert job.is_temporary is True
+        assert os.path.exists(job.filename)
+        os.unlink(job.filename)
+
+    def test_large_file(self):
+        with override_settings(IMPORT_INLINE_MAX_SIZE=10):
+            response = self.upload()
+        assert "Reading the statement" in response
+        job = ImportJob.objects.get(profile=self.profile)
+        assert job.status == ImportJob.PENDING
+        assert job.is_temporary is True
+        call_command("process_imports", once=True)
+        job = ImportJob.objects.get(pk=job.pk)
+        assert job.status == ImportJob.DONE
+        assert job.processed == 2
+        assert os.path.exists(job.filename) is False
 
-    def test_confirm_validation(self):
+    def test_validation(self):
         response = self.app.get(reverse("accounts.transaction.import"),
                                 user=self.user)
         assert response.status_code == 200
         form = response.forms[1]
         form["account_main"] = self.acct1.pk
-        form["filename"] = [self.sample_file]
         response = form.submit()
         assert response.status_code == 200
+        assert "is required" in response
+
+    def test_confirm_validation(self):
+        response = self.upload()
+        assert response.status_code == 200
         assert "Confirm Import Transaction" in response
         form = response.forms[1]
         form["form-0-account_debit"] = self.acct2.pk
-        response = form.submit()
+        response = form.submit("confirm").follow()
         assert response.status_code == 200
-        assert "is required" in response
+        assert "Debit and credit are required" in response
+        assert Transaction.objects.count() == 0
 
     def test_isolation(self):
         n_acct = account_factory(name="n_acct")
@@ -649,37 +852,129 @@ class TestTransactionImportView(BaseWebTest):
 
     def test_confirm_isolation(self):
         n_acct = account_factory(name="n_acct")
-        response = self.app.get(reverse("accounts.transaction.import"),
-                                user=self.user)
-        assert response.status_code == 200
-        form = response.forms[1]
-        form["account_main"] = self.acct1.pk
-        form["filename"] = [self.sample_file]
-        response = form.submit()
+        response = self.upload()
         assert response.status_code == 200
         assert "Confirm Import Transaction" in response
         assert n_acct.name not in response
 
     def test_duplicate(self):
-        response = self.app.get(reverse("accounts.transaction.import"),
-                                user=self.user)
-        assert response.status_code == 200
-        form = response.forms[1]
-        form["account_main"] = self.acct1.pk
-        form["filename"] = [self.sample_file]
-        response = form.submit()
+        response = self.upload()
         assert response.status_code == 200
         assert "Confirm Import Transaction" in response
         form = response.forms[1]
         form["form-0-account_debit"] = self.acct2.pk
         form["form-1-account_debit"] = self.acct2.pk
-        form["form-1-DELETE"] = True
-        response = form.submit().follow()
+        form["form-1-is_duplicate"] = True
+        response = form.submit("confirm").follow()
         assert response.status_code == 200
         assert "Successfully added 1 Transactions" in response
 
 
-class TestDataYearlyDebit(BaseWebTest):
+class TestImportJobView(AccountsWebTest):
+    def setUp(self):
+        super(TestImportJobView, self).setUp()
+        acct = account_factory(profile=self.profile)
+        self.job = ImportJob.objects.create(
+            profile=self.profile, account=acct,
+            filename=os.path.join(settings.BASE_DIR,
+                                  "tests/import_test_chase_sample.csv")
+        )
+
+    def test_pending(self):
+        response = self.app.get(
+            reverse("accounts.transaction.import.job", args=[self.job.pk]),
+            user=self.user
+        )
+        assert response.status_code == 200
+        assert "Reading the statement" in response
+
+    def test_status(self):
+        url = reverse("accounts.transaction.import.job.status",
+                      args=[self.job.pk])
+        response = self.app.get(url, user=self.user)
+        assert json.loads(response.body)["status"] == "PENDING"
+        call_command("process_imports", once=True)
+        response = self.app.get(url, user=self.user)
+        res = json.loads(response.body)
+        assert res["status"] == "DONE"
+        assert res["processed"] == 2
+
+    def test_pages(self):
+        ImportRow.objects.bulk_create([
+            ImportRow(job=self.job, position=i, amount="1.00",
+                      summary="row {0}".format(i),
+                      date=datetime.date(2014, 1, 1))
+            for i in range(60)
+        ])
+        self.job.status = ImportJob.DONE
+        self.job.processed = 60
+        self.job.save()
+        url = reverse("accounts.transaction.import.job", args=[self.job.pk])
+        response = self.app.get(url, user=self.user)
+        assert "Page 1 of 2" in response
+        assert response.forms[1]["form-TOTAL_FORMS"].value == "50"
+        response = self.app.get(url, {"page": 2}, user=self.user)
+        assert "Page 2 of 2" in response
+        assert response.forms[1]["form-TOTAL_FORMS"].value == "10"
+        assert response.forms[1]["form-0-summary"].value == "row 50"
+
+    def test_query_count(self):
+        self.job.status = ImportJob.DONE
+        self.job.save()
+
+        def add_rows(count):
+            start = self.job.processed
+            ImportRow.objects.bulk_create([
+                ImportRow(job=self.job, position=start + i, amount="1.00",
+                          summary="row {0}".format(start + i),
+                          account_debit=account_factory(profile=self.profile),
+                          account_credit=account_factory(
+                              profile=self.profile
+                          ),
+                          date=datetime.date(2014, 1, 1))
+                for i in range(count)
+            ])
+            self.job.processed += count
+            self.job.save()
+        self.assert_constant_queries(
+            reverse("accounts.transaction.import.job", args=[self.job.pk]),
+            add_rows
+        )
+
+    def test_pager_saves(self):
+        ImportRow.objects.bulk_create([
+            ImportRow(job=self.job, position=i, amount="1.00",
+                      summary="row {0}".format(i),
+                      date=datetime.date(2014, 1, 1))
+            for i in range(60)
+        ])
+        self.job.status = ImportJob.DONE
+        self.job.processed = 60
+        self.job.save()
+        url = reverse("accounts.transaction.import.job", args=[self.job.pk])
+        form = self.app.get(url, user=self.user).forms[1]
+        form["form-0-summary"] = "Edited"
+        response = form.submit("goto").follow()
+        assert "Page 2 of 2" in response
+        assert ImportRow.objects.get(job=self.job, position=0).summary \
+            == "Edited"
+
+    def test_permissions(self):
+        response = self.app.get(
+            reverse("accounts.transaction.import.job", args=[self.job.pk])
+        )
+        assert response.status_code == 302
+
+    def test_isolation(self):
+        user = profile_factory().user
+        for name in ("accounts.transaction.import.job",
+                     "accounts.transaction.import.job.status"):
+            response = self.app.get(reverse(name, args=[self.job.pk]),
+                                    user=user, status=404)
+            assert response.status_code == 404
+
+
+class TestDataYearlyDebit(AccountsWebTest):
     def test_view(self):
         acct_type1 = account_type_factory(profile=self.profile, yearly=True,
                                           default_type="DEBIT")
@@ -721,7 +1016,7 @@ class TestDataYearlyDebit(BaseWebTest):
         assert res == {}
 
 
-class TestDataYearlyDebitVsCredit(BaseWebTest):
+class TestDataYearlyDebitVsCredit(AccountsWebTest):
     def test_view(self):
         expense_type = account_type_factory(profile=self.profile, yearly=True,
                                             default_type="DEBIT")
@@ -0,0 +1,71 @@
+import pytest
+
+from django.core.cache import caches
+from finance.core.cache import bump_version, get_or_set, profile_cache_key
+from finance.core.cache_backends import TwoTierCache
+
+
+@pytest.mark.django_db
+class TestProfileCacheKey():
+    def test_profile_bump(self):
+        key = profile_cache_key(1001, "name")
+        year_key = profile_cache_key(1001, "name", 2010)
+        assert key != year_key
+        bump_version(1001)
+        assert profile_cache_key(1001, "name") != key
+        assert profile_cache_key(1001, "name", 2010) != year_key
+
+    def test_year_bump(self):
+        key = profile_cache_key(1002, "name")
+        year_key = profile_cache_key(1002, "name", 2010)
+        other_year_key = profile_cache_key(1002, "name", 2011)
+        bump_version(1002, 2010)
+        assert profile_cache_key(1002, "name") == key
+        assert profile_cache_key(1002, "name", 2010) != year_key
+        assert profile_cache_key(1002, "name", 2011) == other_year_key
+
+    def test_isolation(self):
+        key = profile_cache_key(1003, "name")
+        bump_version(1004)
+        assert profile_cache_key(1003, "name") == key
+
+
+@pytest.mark.django_db
+class TestGetOrSet():
+    def test_get_or_set(self):
+        values = iter(["first", "second"])
+        assert get_or_set(1005, "name", lambda: next(values)) == "first"
+        assert get_or_set(1005, "name", lambda: next(values)) == "first"
+        bump_version(1005)
+        assert get_or_set(1005, "name", lambda: next(values)) == "second"
+
+
+class TestTwoTierCache():
+    def get_cache(self):
+        return TwoTierCache("", {
+            "OPTIONS": {"SHARED": "shared", "MAX_ENTRIES": 2},
+        })
+
+    def test_shared(self):
+        cache1 = self.get_cache()
+        cache2 = self.get_cache()
+        cache1.set("two-tier-shared", "value")
+        assert cache2.get("two-tier-shared") == "value"
+        assert caches["shared"].get("two-tier-shared") == "value"
+
+    def test_local(self):
+        cache = self.get_cache()
+        cache.set("two-tier-local", "value")
+        caches["shared"].delete("two-tier-local")
+        assert cache.get("two-tier-local") == "value"
+
+    def test_lru(self):
+        cache = self.get_cache()
+        for key in ("two-tier-lru1", "two-tier-lru2"):
+            cache.set(key, key)
+        caches["shared"].delete_many(["two-tier-lru1", "two-tier-lru2"])
+        cache.get("two-tier-lru1")
+        cache.set("two-tier-lru3", "two-tier-lru3")
+        assert cache.get("two-tier-lru1") == "two-tier-lru1"
+        assert cache.get("two-tier-lru2") is None
+        assert cache.get("two-tier-lru3") == "two-tier-lru3"
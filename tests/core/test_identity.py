@@ -0,0 +1,77 @@
+import pytest
+
+from django.db import connection
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+from finance.accounts.models import Account, AccountType, Transaction
+from finance.core import identity
+from finance.core.middleware import IdentityMapMiddleware
+from tests.fixtures import (account_factory, account_type_factory,
+                            profile_factory, transaction_factory)
+
+
+@pytest.mark.django_db
+class TestIdentityMap():
+    def teardown_method(self, method):
+        identity.deactivate()
+
+    def test_foreign_keys(self):
+        profile = profile_factory()
+        acct_type = account_type_factory(profile=profile)
+        acct = account_factory(profile=profile, account_type=acct_type,
+                               parent=None)
+        identity.activate(profile)
+        AccountType.objects.get(pk=acct_type.pk)
+        acct = Account.objects.get(pk=acct.pk)
+        with CaptureQueriesContext(connection) as queries:
+            assert acct.account_type.pk == acct_type.pk
+            assert acct.profile.year == profile.year
+        assert len(queries) == 0
+
+    def test_other_profile(self):
+        profile = profile_factory()
+        acct = account_factory(parent=None)
+        identity_map = identity.activate(profile)
+        Account.objects.get(pk=acct.pk)
+        assert identity_map.get(Account, acct.pk) is None
+
+    def test_attach(self):
+        profile = profile_factory()
+        acct1 = account_factory(profile=profile, parent=None)
+        acct2 = account_factory(profile=profile, parent=None)
+        for i in range(3):
+            transaction_factory(account_debit=acct1, account_credit=acct2)
+        identity_map = identity.activate(profile)
+        acct1 = Account.objects.get(pk=acct1.pk)
+        trxs = list(Transaction.objects.all())
+        with CaptureQueriesContext(connection) as queries:
+            identity_map.attach(trxs, "account_debit", "account_credit")
+        # only the credit accounts were not loaded yet
+        assert len(queries) == 1
+        assert all(trx.account_debit is acct1 for trx in trxs)
+        assert trxs[0].account_credit is trxs[1].account_credit
+        with CaptureQueriesContext(connection) as queries:
+            identity_map.attach(list(Transaction.objects.all()),
+                                "account_debit", "account_credit")
+        assert len(queries) == 1
+
+    def test_outside_request(self):
+        acct = account_factory(parent=None)
+        Account.objects.get(pk=acct.pk)
+        assert identity.get_identity_map().instances == {}
+
+
+@pytest.mark.django_db
+class TestIdentityMapMiddleware():
+    def test_reset(self):
+        profile = profile_factory()
+        acct = account_factory(profile=profile, parent=None)
+        request = RequestFactory().get("/")
+        request.user = profile.user
+        request.profile = profile
+        middleware = IdentityMapMiddleware()
+        middleware.process_request(request)
+        Account.objects.get(pk=acct.pk)
+        assert identity.get_identity_map().get(Account, acct.pk) is not None
+        middleware.process_response(request, None)
+        assert identity.get_identity_map().get(Account, acct.pk) is None
@@ -1,8 +1,12 @@
 import datetime
 import pytest
 
-from django.db import IntegrityError
-from finance.core.models import get_user_profile, Profile
+from django.contrib.auth.models import AnonymousUser
+from django.db import IntegrityError, connection
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+from finance.core.models import (forget_request_profile, get_request_profile,
+                                 get_user_profile, Profile)
 from tests.fixtures import user_factory, profile_factory
 
 
@@ -14,6 +18,46 @@ class TestGetUserProfile():
         assert get_user_profile(u) == p
 
 
+@pytest.mark.django_db
+class TestGetRequestProfile():
+    def request(self, user):
+        request = RequestFactory().get("/")
+        request.user = user
+        request.session = {}
+        return request
+
+    def test_session(self):
+        p = profile_factory(current_year=2010)
+        request = self.request(p.user)
+        assert get_request_profile(request) == p
+        with CaptureQueriesContext(connection) as queries:
+            profile = get_request_profile(request)
+        assert len(queries) == 0
+        assert profile.pk == p.pk
+        assert profile.user_id == p.user_id
+        assert profile.year == 2010
+
+    def test_other_user(self):
+        p1 = profile_factory()
+        p2 = profile_factory()
+        request = self.request(p1.user)
+        get_request_profile(request)
+        request.user = p2.user
+        assert get_request_profile(request) == p2
+
+    def test_forget(self):
+        p = profile_factory(current_year=2010)
+        request = self.request(p.user)
+        get_request_profile(request)
+        Profile.objects.filter(pk=p.pk).update(current_year=2011)
+        assert get_request_profile(request).year == 2010
+        forget_request_profile(request)
+        assert get_request_profile(request).year == 2011
+
+    def test_anonymous(self):
+        assert get_request_profile(self.request(AnonymousUser())) is None
+
+
 @pytest.mark.django_db
 class TestProfile():
     def test_unicode(self):
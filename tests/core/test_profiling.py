@@ -0,0 +1,130 @@
+import cProfile
+import pytest
+import shutil
+import tempfile
+
+from decimal import Decimal
+from django.core.management import call_command
+from django.core.urlresolvers import reverse
+from django.test.utils import override_settings
+from django.utils.six import StringIO
+from finance.core import profiling
+from mock import Mock, patch
+from tests.fixtures import BaseWebTest
+
+
+def dump_profile(directory, url_name, func):
+    profiler = cProfile.Profile()
+    profiler.runcall(func)
+    with override_settings(PROFILE_DIR=str(directory)):
+        profiler.dump_stats(profiling.profile_path(url_name))
+
+
+def request_for(username=None):
+    request = Mock()
+    request.user.is_authenticated.return_value = username is not None
+    request.user.get_username.return_value = username
+    return request
+
+
+class TestShouldProfile():
+    def test_off(self):
+        with override_settings(PROFILE_SAMPLE_RATE=None):
+            assert profiling.should_profile(request_for(), "home") is False
+
+    def test_rate(self):
+        with override_settings(PROFILE_SAMPLE_RATE=1, PROFILE_URL_NAMES=[],
+                               PROFILE_USERS=[]):
+            assert profiling.should_profile(request_for(), "home") is True
+
+    def test_url_names(self):
+        with override_settings(PROFILE_SAMPLE_RATE=1, PROFILE_USERS=[],
+                               PROFILE_URL_NAMES=["accounts.account.view"]):
+            assert profiling.should_profile(request_for(), "home") is False
+            assert profiling.should_profile(
+                request_for(), "accounts.account.view"
+            ) is True
+
+    def test_users(self):
+        with override_settings(PROFILE_SAMPLE_RATE=1, PROFILE_URL_NAMES=[],
+                               PROFILE_USERS=["admin"]):
+            assert profiling.should_profile(request_for(), "home") is False
+            assert profiling.should_profile(
+                request_for("other"), "home"
+            ) is False
+            assert profiling.should_profile(
+                request_for("admin"), "home"
+            ) is True
+
+
+class TestProfilingMiddleware(BaseWebTest):
+    def setUp(self):
+        super(TestProfilingMiddleware, self).setUp()
+        self.profile_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.profile_dir)
+        super(TestProfilingMiddleware, self).tearDown()
+
+    def test_view(self):
+        with override_settings(PROFILE_SAMPLE_RATE=1,
+                               PROFILE_DIR=self.profile_dir):
+            self.app.get(reverse("home"), user=self.user)
+        profiles = profiling.read_profiles(self.profile_dir)
+        assert list(profiles) == ["home"]
+        assert profiles["home"][1] == 1
+
+    def test_exception(self):
+        with override_settings(PROFILE_SAMPLE_RATE=1,
+                               PROFILE_DIR=self.profile_dir):
+            with patch("finance.core.views.HomeView.get",
+                       Mock(side_effect=ValueError)):
+                with pytest.raises(ValueError):
+                    self.app.get(reverse("home"), user=self.user)
+        profiles = profiling.read_profiles(self.profile_dir)
+        assert profiles["home"][1] == 1
+
+    def test_filtered(self):
+        with override_settings(PROFILE_SAMPLE_RATE=1,
+                               PROFILE_URL_NAMES=["accounts.account.view"],
+                               PROFILE_DIR=self.profile_dir):
+            self.app.get(reverse("home"), user=self.user)
+        assert not profiling.read_profiles(self.profile_dir)
+
+
+class TestCategorize():
+    def test_decimal(self, tmpdir):
+        dump_profile(tmpdir, "home", lambda: [
+            Decimal(n).quantize(Decimal("0.01")) for n in range(1000)
+        ])
+        stats, count = profiling.read_profiles(str(tmpdir))["home"]
+        totals = profiling.categorize(stats)
+        assert list(totals) == ["ORM", "templates", "decimal", "importer"]
+        assert totals["decimal"] > 0
+        assert totals["ORM"] == 0
+
+
+class TestProfileReportCommand():
+    def test_report(self, tmpdir):
+        dump_profile(tmpdir, "home", lambda: sum(range(1000)))
+        dump_profile(tmpdir, "home", lambda: sum(range(1000)))
+        dump_profile(tmpdir, "accounts.account.view", lambda: sorted([3, 1]))
+        out = StringIO()
+        call_command("profile_report", dir=str(tmpdir), stdout=out)
+        report = out.getvalue()
+        assert "home: 2 request(s)" in report
+        assert "accounts.account.view: 1 request(s)" in report
+        assert "decimal:" in report
+
+    def test_view(self, tmpdir):
+        dump_profile(tmpdir, "home", lambda: sum(range(1000)))
+        dump_profile(tmpdir, "accounts.account.view", lambda: sorted([3, 1]))
+        out = StringIO()
+        call_command("profile_report", dir=str(tmpdir), views=["home"],
+                     stdout=out)
+        assert "accounts.account.view" not in out.getvalue()
+
+    def test_empty(self, tmpdir):
+        out = StringIO()
+        call_command("profile_report", dir=str(tmpdir), stdout=out)
+        assert "No profiles found" in out.getvalue()
@@ -0,0 +1,120 @@
+import json
+import pytest
+
+from django.core.management import call_command
+from django.core.urlresolvers import reverse
+from django.db import connection
+from django.test.utils import override_settings
+from django.utils.six import StringIO
+from finance.accounts.models import Account
+from finance.core import slow_queries
+from mock import patch
+from tests.fixtures import BaseWebTest, account_factory
+
+
+def logged(m):
+    return [json.loads(c[0][0]) for c in m.info.call_args_list]
+
+
+def entry(sql, duration, location="finance/views.py:1 in get", view=None):
+    return {"sql": sql, "duration_ms": duration, "location": location,
+            "view": view, "plan": "Seq Scan"}
+
+
+@pytest.mark.django_db
+class TestSlowQueryCursorWrapper():
+    def test_off(self):
+        with override_settings(SLOW_QUERY_MS=None):
+            with patch("finance.core.slow_queries.logger") as m:
+                Account.objects.count()
+        assert m.info.called is False
+
+    def test_record(self):
+        acct = account_factory()
+        with override_settings(SLOW_QUERY_MS=0):
+            with patch("finance.core.slow_queries.logger") as m:
+                Account.objects.filter(pk=acct.pk).count()
+        line = logged(m)[-1]
+        assert "accounts_account" in line["sql"]
+        assert line["location"].startswith("tests/core/test_slow_queries.py")
+        assert line["plan"]
+        assert not line["plan"].startswith("EXPLAIN failed")
+
+    def test_location_identity_map(self):
+        acct = account_factory()
+        with override_settings(SLOW_QUERY_MS=0):
+            with patch("finance.core.slow_queries.logger") as m:
+                list(Account.objects.filter(pk=acct.pk))
+        line = logged(m)[-1]
+        assert "accounts_account" in line["sql"]
+        assert line["location"].startswith("tests/core/test_slow_queries.py")
+
+    def test_threshold(self):
+        with override_settings(SLOW_QUERY_MS=60 * 1000):
+            with patch("finance.core.slow_queries.logger") as m:
+                Account.objects.count()
+        assert m.info.called is False
+
+    def test_explain_failed(self):
+        # the transaction carries on after an EXPLAIN that fails
+        connection.ensure_connection()
+        plan = slow_queries.explain(connection, "SELECT * FROM missing", [])
+        assert plan.startswith("EXPLAIN failed")
+        assert Account.objects.count() == 0
+
+
+class TestSlowQueryMiddleware(BaseWebTest):
+    def test_view(self):
+        with override_settings(SLOW_QUERY_MS=0):
+            with patch("finance.core.slow_queries.logger") as m:
+                self.app.get(reverse("home"), user=self.user)
+        assert "home" in [line["view"] for line in logged(m)]
+        assert slow_queries.get_view() is None
+
+
+class TestTopOffenders():
+    def test_order(self):
+        offenders = slow_queries.top_offenders([
+            entry("SELECT 1", 10, view="home"),
+            entry("SELECT 2", 25),
+            entry("SELECT 1", 20, view="accounts.account.view"),
+        ])
+        assert [o["sql"] for o in offenders] == ["SELECT 1", "SELECT 2"]
+        assert offenders[0]["total_ms"] == 30
+        assert offenders[0]["count"] == 2
+        assert offenders[0]["max_ms"] == 20
+        assert offenders[0]["views"] == ["accounts.account.view", "home"]
+
+    def test_location(self):
+        offenders = slow_queries.top_offenders([
+            entry("SELECT 1", 10),
+            entry("SELECT 1", 10, location="finance/models.py:2 in get"),
+        ])
+        assert len(offenders) == 2
+
+    def test_limit(self):
+        offenders = slow_queries.top_offenders(
+            [entry("SELECT {0}".format(n), n) for n in range(1, 6)], limit=2
+        )
+        assert [o["sql"] for o in offenders] == ["SELECT 5", "SELECT 4"]
+
+
+class TestSlowQueriesCommand():
+    def test_report(self, tmpdir):
+        log = tmpdir.join("slow_queries.log")
+        log.write(json.dumps(entry("SELECT 1", 10)) + "\n")
+        tmpdir.join("slow_queries.log.1").write(
+            json.dumps(entry("SELECT 2", 50)) + "\nnot json\n"
+        )
+        out = StringIO()
+        call_command("slow_queries", log=str(log), plans=True, stdout=out)
+        report = out.getvalue()
+        assert report.index("SELECT 2") < report.index("SELECT 1")
+        assert "50.0 ms total, 1 run(s)" in report
+        assert "Seq Scan" in report
+
+    def test_empty(self, tmpdir):
+        out = StringIO()
+        call_command("slow_queries", log=str(tmpdir.join("missing.log")),
+                     stdout=out)
+        assert "No slow queries logged" in out.getvalue()
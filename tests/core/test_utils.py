@@ -1,5 +1,5 @@
 import datetime
-from finance.core.utils import get_year_choices
+from finance.core.utils import date_to_str, get_year_choices
 
 
 class TestGetYearChoices():
@@ -21,3 +21,11 @@ class TestGetYearChoices():
             (current_year - 1, current_year - 1),
             (current_year, current_year),
         ]
+
+
+class TestDateToStr():
+    def test_date(self):
+        assert date_to_str(datetime.date(2014, 3, 5)) == "2014-03-05"
+
+    def test_old_year(self):
+        assert date_to_str(datetime.date(1066, 10, 14)) == "1066-10-14"
@@ -1,11 +1,15 @@
 import datetime
+import json
+import pytest
 
+from decimal import Decimal
 from django.contrib.auth.models import User
-from django.core.cache import cache
 from django.core.urlresolvers import reverse
+from django.test.utils import override_settings
+from finance.accounts.models import Account
 from finance.core.models import Profile
 from mock import patch, Mock
-from tests.fixtures import BaseWebTest, account_factory, account_type_factory
+from tests.fixtures import BaseWebTest, account_factory, transaction_factory
 
 
 class TestHomeView(BaseWebTest):
@@ -126,6 +130,17 @@ class TestProfileView(BaseWebTest):
         p = Profile.objects.get(pk=self.profile.pk)
         assert p.current_year == new_year
 
+    def test_header_year(self):
+        new_year = datetime.date.today().year - 1
+        response = self.app.get(reverse("profile.home"), user=self.user)
+        form = response.forms[1]
+        form["current_year"] = new_year
+        form.submit().follow()
+        # the profile page has its own header, the year shows on the others
+        response = self.app.get(reverse("accounts.dashboard"), user=self.user)
+        assert '<span class="pull-right">{0}</span>'.format(new_year) \
+            in response
+
     def test_permissions(self):
         response = self.app.get(reverse("profile.home"))
         assert response.status_code == 302
@@ -141,16 +156,41 @@ class TestProfileView(BaseWebTest):
         assert response.status_code == 200
         assert "is required" in response
 
-    def test_clear_cache(self):
-        acct_type = account_type_factory(profile=self.profile, yearly=True)
-        acct1 = account_factory(profile=self.profile, account_type=acct_type)
-        acct1.balance()
-        acct2 = account_factory()
-        acct2.balance()
-        assert cache.get(acct1.cache_key) is not None
-        assert cache.get(acct2.cache_key) is not None
-        self.app.post(reverse("profile.home"),
-                      {"current_year": self.profile.year},
+    def test_year_balances(self):
+        year = datetime.date.today().year
+        acct = account_factory(profile=self.profile)
+        transaction_factory(account_debit=acct, amount="10.00",
+                            date=datetime.date(year - 1, 1, 1))
+        transaction_factory(account_debit=acct, amount="5.00",
+                            date=datetime.date(year, 1, 1))
+        self.app.post(reverse("profile.home"), {"current_year": year - 1},
                       user=self.user)
-        assert cache.get(acct1.cache_key) is None
-        assert cache.get(acct2.cache_key) is not None
+        assert Account.objects.get(pk=acct.pk).balance() == Decimal("10.00")
+        self.app.post(reverse("profile.home"), {"current_year": year},
+                      user=self.user)
+        assert Account.objects.get(pk=acct.pk).balance() == Decimal("5.00")
+
+
+class TestQueryCountMiddleware(BaseWebTest):
+    def test_headers(self):
+        response = self.app.get(reverse("home"), user=self.user)
+        assert int(response.headers["X-Query-Count"]) > 0
+        assert float(response.headers["X-Query-Time"]) >= 0
+
+    def test_log(self):
+        with patch("finance.core.middleware.query_logger") as m:
+            response = self.app.get(reverse("home"), user=self.user)
+        line = json.loads(m.info.call_args[0][0])
+        assert line["url_name"] == "home"
+        assert line["status"] == 200
+        assert line["queries"] == int(response.headers["X-Query-Count"])
+
+    def test_off(self):
+        with override_settings(QUERY_COUNT=False, DEBUG=False):
+            response = self.app.get(reverse("home"), user=self.user)
+        assert "X-Query-Count" not in response.headers
+
+    def test_budget(self):
+        self.query_budgets = {"home": 0}
+        with pytest.raises(AssertionError):
+            self.app.get(reverse("home"), user=self.user)
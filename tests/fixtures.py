@@ -1,15 +1,43 @@
 from django.contrib.auth.models import User
+from django.core.urlresolvers import resolve, Resolver404
+from django.test.utils import override_settings
 from django_dynamic_fixture import G
 from django_webtest import WebTest
 from finance.accounts.models import Account, AccountType, Transaction
 from finance.core.models import Profile
 
 
+@override_settings(QUERY_COUNT=True)
 class BaseWebTest(WebTest):
+    # most queries a request to each URL name may make, see
+    # finance.core.middleware.QueryCountMiddleware
+    query_budgets = {}
+
     def setUp(self):
         super(BaseWebTest, self).setUp()
         self.user = user_factory()
         self.profile = profile_factory(user=self.user)
+        do_request = self.app.do_request
+
+        def checked_request(req, *args, **kwargs):
+            response = do_request(req, *args, **kwargs)
+            self.check_query_budget(req, response)
+            return response
+        self.app.do_request = checked_request
+
+    def check_query_budget(self, req, response):
+        try:
+            url_name = resolve(req.path).url_name
+        except Resolver404:
+            return
+        budget = self.query_budgets.get(url_name)
+        count = int(response.headers.get("X-Query-Count", 0))
+        if budget is not None and count > budget:
+            raise AssertionError(
+                "{0} {1} made {2} queries, the budget of {3} is {4}".format(
+                    req.method, req.path, count, url_name, budget
+                )
+            )
 
 
 def user_factory(**kwargs):